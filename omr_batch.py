@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+OMR Batch Scanner - Scan many sheets in parallel, one JSON line per sheet
+Sheets come from a directory or a zip archive and are scanned across all
+cores by the ScanExecutor; results stream out as JSON Lines in completion
+order, so end-of-day reconciliation never waits on the slowest sheet.
+Multi-page PDFs and TIFFs are scanned page by page (name#page=N).
+
+Usage:
+    python omr_batch.py SHEETS_DIR_OR_ZIP [--workers N] [--template NAME] [--dpi DPI] [--output FILE]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from omr_circle_scanner import OMRCircleScanner
+from omr_documents import DEFAULT_DPI, DOCUMENT_EXTENSIONS, expand_documents
+from omr_executor import ScanExecutor, ScanQueueFull
+from omr_logging import configure_logging
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+def is_sheet_name(name):
+    """True for image and document files (ignoring hidden files and macOS zip metadata)"""
+    base = os.path.basename(name)
+    return (base.lower().endswith(IMAGE_EXTENSIONS + DOCUMENT_EXTENSIONS) and not base.startswith('.')
+            and not name.startswith('__MACOSX/'))
+
+def iter_directory_sheets(folder):
+    """Yield (name, bytes) for every image in a directory, in name order"""
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path) and is_sheet_name(name):
+            with open(path, 'rb') as f:
+                yield name, f.read()
+
+def iter_zip_sheets(archive):
+    """Yield (name, bytes) for every image in a zip (path or file object), one at a time"""
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            if not info.is_dir() and is_sheet_name(info.filename):
+                yield info.filename, zf.read(info)
+
+def iter_sheets(path):
+    """Yield (name, bytes) sheets from a directory or zip archive"""
+    if os.path.isdir(path):
+        return iter_directory_sheets(path)
+    if zipfile.is_zipfile(path):
+        return iter_zip_sheets(path)
+    raise ValueError(f'Not a directory or zip archive: {path}')
+
+def sheet_record(name, result=None, error=None):
+    """One JSON Lines record for a scanned sheet"""
+    if error is None and result is not None and 'error' in result:
+        error = result['error']
+    if error is not None:
+        return {'sheet': name, 'success': False, 'error': str(error)}
+
+    result = dict(result)
+    result.pop('debug_image', None)
+    return dict({'sheet': name, 'success': True}, **result)
+
+def scan_sheets(sheets, executor, max_in_flight=None, **options):
+    """
+    Scan (name, bytes or ndarray) sheets in parallel and yield a record per
+    sheet as each finishes. At most `max_in_flight` scans are outstanding,
+    so memory stays bounded however many sheets there are. A sheet whose
+    data is an exception (e.g. an unreadable document) is reported as failed.
+    """
+    if max_in_flight is None:
+        max_in_flight = max(1, executor.capacity)
+
+    in_flight = {}
+
+    def drain():
+        done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+        for future in done:
+            name = in_flight.pop(future)
+            try:
+                yield sheet_record(name, future.result())
+            except Exception as e:
+                yield sheet_record(name, error=e)
+
+    for name, data in sheets:
+        if isinstance(data, Exception):
+            yield sheet_record(name, error=data)
+            continue
+        while True:
+            if len(in_flight) >= max_in_flight:
+                yield from drain()
+                continue
+            try:
+                future = executor.submit(data, **options)
+                break
+            except ScanQueueFull:
+                # Executor shared with other traffic - wait for room
+                if in_flight:
+                    yield from drain()
+                else:
+                    time.sleep(0.05)
+        in_flight[future] = name
+
+    while in_flight:
+        yield from drain()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scan a directory or zip of OMR sheets (JSON Lines output)')
+    parser.add_argument('path', help='Directory or .zip archive of sheet images')
+    parser.add_argument('--workers', type=int, default=None, help='Scan processes (default: CPU count)')
+    parser.add_argument('--template', help='Registered form template name (see templates/)')
+    parser.add_argument('--dpi', type=int, default=DEFAULT_DPI, help='Resolution for PDF and TIFF pages')
+    parser.add_argument('--output', help='Write JSON Lines here instead of stdout')
+    args = parser.parse_args(argv)
+
+    options = {'debug': False}
+    if args.template:
+        from omr_templates import TemplateRegistry
+        template = TemplateRegistry().get(args.template)
+        if template is None:
+            parser.error(f'Unknown template: {args.template}')
+        options['template'] = template
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    # Logs go to stderr; stdout carries only the JSON Lines stream
+    configure_logging()
+    scanner = OMRCircleScanner()
+    executor = ScanExecutor(scanner, workers=args.workers)
+    started = time.time()
+    count = 0
+    try:
+        sheets = expand_documents(iter_sheets(args.path), args.dpi)
+        for record in scan_sheets(sheets, executor, **options):
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+            count += 1
+    finally:
+        executor.shutdown()
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.time() - started
+    logger.info("Scanned %d sheets in %.1fs", count, elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+OMR Benchmark - Speed and accuracy of the scanner on synthetic sheets
+Generates sheets with known answers (see omr_synthetic.py) and measures
+detect_circles, check_circle_fill and the full scan_shaded_circles path:
+latency percentiles, throughput, per-stage timings, and detection and
+fill accuracy against the ground truth. Run it before and after a
+detector change; a speedup only counts if the accuracy holds.
+
+--check-coarse is a regression check for coarse-to-fine detection: the
+same large sheets are read with and without the pyramid and the run fails
+(exit status 1) if the pyramid reads any sheet worse.
+
+--check-large reads phone-photo sized sheets (3000x4000 and 6000x8000)
+with bubbles across the scanner's expected size range, with and without
+debug, and fails if any bubble is missed or misread, or if debug changes
+the result (the decode factor and radius range must not depend on it).
+
+Usage:
+    python omr_benchmark.py [--sheets N] [--repeat N] [--json] [generator options]
+    python omr_benchmark.py --check-coarse --width 3000 --height 4000 --radius 35 --bubbles 12
+    python omr_benchmark.py --check-large
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from omr_circle_scanner import OMRCircleScanner
+from omr_logging import configure_logging
+from omr_synthetic import add_generator_arguments, encode_sheet, generate_sheet, generator_options
+
+def latency_summary(samples_ms):
+    """Percentiles, mean and throughput of a list of millisecond timings"""
+    if not samples_ms:
+        return {'count': 0}
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    total = float(samples.sum())
+    return {
+        'count': int(samples.size),
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p90_ms': round(float(np.percentile(samples, 90)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'max_ms': round(float(samples.max()), 3),
+        'per_second': round(samples.size * 1000.0 / total, 1) if total else None
+    }
+
+def match_circles(truth, circles, tolerance=0.5):
+    """
+    Pair detected circles with ground-truth bubbles, closest first; a pair
+    counts when the centres are within tolerance x the bubble radius.
+    Returns a list of (truth index, circle index).
+    """
+    if not truth or not circles:
+        return []
+    expected = np.array([b['center'] for b in truth], dtype=np.float64)
+    found = np.array([c['center'] for c in circles], dtype=np.float64)
+    limits = np.array([b['radius'] for b in truth], dtype=np.float64) * tolerance
+    distances = np.linalg.norm(expected[:, None, :] - found[None, :, :], axis=2)
+
+    pairs = []
+    used_truth, used_found = set(), set()
+    for flat in np.argsort(distances, axis=None):
+        t, c = np.unravel_index(flat, distances.shape)
+        if distances[t, c] > limits[t]:
+            continue
+        if t in used_truth or c in used_found:
+            continue
+        used_truth.add(t)
+        used_found.add(c)
+        pairs.append((int(t), int(c)))
+    return pairs
+
+class AccuracyTally:
+    """
+    Running detection and fill accuracy over scanned sheets
+    """
+    def __init__(self):
+        self.sheets = 0
+        self.exact_sheets = 0
+        self.bubbles = 0
+        self.detected = 0
+        self.matched = 0
+        self.correct_fill = 0
+        self.false_selected = 0
+        self.missed_selected = 0
+
+    def add(self, truth, circles):
+        pairs = match_circles(truth, circles)
+        wrong = 0
+        for t, c in pairs:
+            expected, found = truth[t]['filled'], bool(circles[c]['is_shaded'])
+            if expected == found:
+                self.correct_fill += 1
+            elif found:
+                self.false_selected += 1
+                wrong += 1
+            else:
+                self.missed_selected += 1
+                wrong += 1
+
+        self.sheets += 1
+        self.bubbles += len(truth)
+        self.detected += len(circles)
+        self.matched += len(pairs)
+        if wrong == 0 and len(pairs) == len(truth) == len(circles):
+            self.exact_sheets += 1
+
+    def summary(self):
+        def ratio(part, whole):
+            return round(part / whole, 4) if whole else None
+        return {
+            'sheets': self.sheets,
+            'exact_sheets': ratio(self.exact_sheets, self.sheets),
+            'detection_recall': ratio(self.matched, self.bubbles),
+            'detection_precision': ratio(self.matched, self.detected),
+            'fill_accuracy': ratio(self.correct_fill, self.matched),
+            'false_selected': self.false_selected,
+            'missed_selected': self.missed_selected
+        }
+
+def _elapsed_ms(started):
+    return (time.perf_counter() - started) * 1000.0
+
+def run_benchmark(scanner, sheets, repeat=3, folder=None):
+    """
+    Benchmark a scanner on (jpeg bytes, truth) sheets. Every measurement
+    is repeated `repeat` times per sheet; accuracy is taken from the full
+    scans. Returns the report dict.
+    """
+    detect_ms, fill_ms, scan_ms = [], [], []
+    stages = {}
+    accuracy = AccuracyTally()
+
+    with tempfile.TemporaryDirectory(dir=folder) as tmp:
+        for n, (jpeg, truth) in enumerate(sheets):
+            decoded = scanner.prepare_image(jpeg)
+            if decoded is None:
+                raise ValueError(f'Could not decode synthetic sheet {n}')
+
+            # Detection alone, on an already decoded frame (a fresh frame
+            # each time: frames cache their circles)
+            circles = []
+            for _ in range(repeat):
+                frame = {'image': decoded['image'], 'gray': decoded['gray']}
+                started = time.perf_counter()
+                circles = scanner.detect_circles(frame)
+                detect_ms.append(_elapsed_ms(started))
+
+            for circle in circles:
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    scanner.check_circle_fill(decoded['gray'], circle)
+                    fill_ms.append(_elapsed_ms(started))
+
+            # Full path from a file on disk, as the CLI and older callers use it
+            path = os.path.join(tmp, f"sheet_{n:04d}.jpg")
+            with open(path, 'wb') as f:
+                f.write(jpeg)
+            result = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                result = scanner.scan_shaded_circles(path)
+                scan_ms.append(_elapsed_ms(started))
+                for stage, ms in (result.get('timings') or {}).items():
+                    stages.setdefault(stage, []).append(ms)
+
+            accuracy.add(truth, result.get('circles', []))
+
+    return {
+        'detect_circles': latency_summary(detect_ms),
+        'check_circle_fill': latency_summary(fill_ms),
+        'scan_shaded_circles': latency_summary(scan_ms),
+        'stages_mean_ms': {stage: round(float(np.mean(ms)), 3) for stage, ms in sorted(stages.items())},
+        'accuracy': accuracy.summary()
+    }
+
+def check_coarse_detection(sheets, scanner=None):
+    """
+    Read every (jpeg bytes, truth) sheet at full resolution and
+    coarse-to-fine; returns a list of problem descriptions (empty when the
+    pyramid reads every sheet at least as well). Reduced decoding is off
+    for both so only detection differs.
+    """
+    def scanner_with(coarse_max_side):
+        checked = copy.deepcopy(scanner) if scanner is not None else OMRCircleScanner()
+        checked.coarse_max_side = coarse_max_side
+        checked.reduced_decode = False
+        return checked
+
+    coarse = scanner_with((scanner.coarse_max_side if scanner is not None else None) or 1280)
+    full = scanner_with(None)
+
+    problems = []
+    for n, (jpeg, truth) in enumerate(sheets):
+        tallies = []
+        for checked in (full, coarse):
+            frame = checked.prepare_image(jpeg)
+            if frame is None:
+                raise ValueError(f'Could not decode synthetic sheet {n}')
+            if checked is coarse and max(frame['gray'].shape[:2]) <= coarse.coarse_max_side:
+                raise ValueError(f'Sheet {n} is not larger than coarse_max_side ({coarse.coarse_max_side}px); '
+                                 'use bigger --width/--height')
+            tally = AccuracyTally()
+            tally.add(truth, checked.scan_image(frame, debug=False).get('circles', []))
+            tallies.append(tally)
+
+        full_tally, coarse_tally = tallies
+        if (coarse_tally.matched < full_tally.matched or
+                coarse_tally.detected != full_tally.detected or
+                coarse_tally.correct_fill < full_tally.correct_fill):
+            problems.append(
+                f"sheet {n}: full resolution matched {full_tally.matched}/{len(truth)} "
+                f"({full_tally.detected} found), coarse matched {coarse_tally.matched}/{len(truth)} "
+                f"({coarse_tally.detected} found)"
+            )
+    return problems
+
+LARGE_PHOTO_SIZES = ((3000, 4000), (6000, 8000))
+
+def check_large_photos(scanner=None, sizes=LARGE_PHOTO_SIZES, steps=5, seed=0):
+    """
+    Scan large synthetic photos whose bubbles span min_bubble_ratio to
+    max_bubble_ratio of the longest side (`steps` sizes per photo size),
+    with debug off and on. Returns (problems, extra circles found beyond
+    the bubbles); problems is empty when every bubble is found and read
+    correctly and debug changes nothing.
+    """
+    scanner = scanner or OMRCircleScanner()
+    rng = np.random.default_rng(seed)
+    problems = []
+    extra = 0
+    for width, height in sizes:
+        side = max(width, height)
+        for ratio in np.linspace(scanner.min_bubble_ratio, scanner.max_bubble_ratio, steps):
+            radius = int(round(side * ratio))
+            image, truth = generate_sheet(width, height, bubbles=8, radius=radius, noise=4, blur=1.0,
+                                          rotation=1.0, lighting=0.3, seed=int(rng.integers(1 << 31)))
+            jpeg = encode_sheet(image)
+            del image
+
+            plain = scanner.scan_image(jpeg, debug=False)
+            debug = scanner.scan_image(jpeg, debug=True)
+            name = f"{width}x{height} radius {radius}"
+            if 'error' in plain or 'error' in debug:
+                problems.append(f"{name}: {plain.get('error') or debug.get('error')}")
+                continue
+
+            tally = AccuracyTally()
+            tally.add(truth, plain['circles'])
+            extra += max(0, tally.detected - tally.matched)
+            if tally.matched < len(truth) or tally.correct_fill < tally.matched:
+                problems.append(f"{name}: matched {tally.matched}/{len(truth)}, "
+                                f"{tally.correct_fill} read correctly (factor {scanner.decode_factor(jpeg)})")
+
+            def verdicts(result):
+                return [(c['center'], c['radius'], c['is_shaded']) for c in result['circles']]
+            if verdicts(plain) != verdicts(debug):
+                problems.append(f"{name}: debug=True found different circles or verdicts")
+            if debug['debug_image'].shape[:2] != (height, width) or debug['debug_image'].ndim != 3:
+                problems.append(f"{name}: debug overlay is {debug['debug_image'].shape}, not a colour {width}x{height} image")
+            if abs(plain['megapixels'] - width * height / 1e6) > 0.01:
+                problems.append(f"{name}: reported {plain['megapixels']} megapixels")
+    return problems, extra
+
+def format_report(report):
+    """Human-readable report"""
+    lines = [f"{'operation':<22}{'count':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'per s':>10}"]
+    for name in ('detect_circles', 'check_circle_fill', 'scan_shaded_circles'):
+        s = report[name]
+        if not s['count']:
+            lines.append(f"{name:<22}{0:>7}")
+            continue
+        lines.append(f"{name:<22}{s['count']:>7}{s['p50_ms']:>10.2f}{s['p90_ms']:>10.2f}"
+                     f"{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}{s['per_second'] or 0:>10.1f}")
+
+    lines.append('')
+    lines.append('stages (mean ms): ' + ', '.join(f"{stage} {ms:.2f}" for stage, ms in report['stages_mean_ms'].items()))
+    lines.append('')
+    for key, value in report['accuracy'].items():
+        lines.append(f"{key:<22}{value}")
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the OMR scanner on synthetic sheets')
+    parser.add_argument('--sheets', type=int, default=20, help='Number of generated sheets')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per sheet and operation')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--classifier', choices=('adaptive', 'fixed'), help='Fill classifier (default: the scanner default)')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    parser.add_argument('--check-coarse', action='store_true',
+                        help='Fail if coarse-to-fine detection reads any sheet worse than full resolution')
+    parser.add_argument('--check-large', action='store_true',
+                        help='Fail if large phone-photo sheets lose bubbles or read differently with debug')
+    add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # Per-scan info logs would swamp the report
+    configure_logging(level=os.environ.get('LOG_LEVEL', 'warning'))
+
+    if args.check_large:
+        problems, extra = check_large_photos(seed=args.seed)
+        for problem in problems:
+            print(f"❌ {problem}")
+        if extra:
+            print(f"⚠️  {extra} circles found beyond the bubbles (label text)")
+        if problems:
+            sys.exit(1)
+        print("✅ Large photos read correctly, with and without debug")
+        return
+
+    rng = np.random.default_rng(args.seed)
+    sheets = []
+    for _ in range(args.sheets):
+        image, truth = generate_sheet(**generator_options(args, rng))
+        sheets.append((encode_sheet(image, args.quality), truth))
+
+    scanner = OMRCircleScanner()
+    if args.classifier:
+        scanner.fill_classifier = args.classifier
+
+    if args.check_coarse:
+        problems = check_coarse_detection(sheets, scanner)
+        for problem in problems:
+            print(f"❌ {problem}")
+        if problems:
+            sys.exit(1)
+        print(f"✅ Coarse-to-fine detection matches full resolution on {args.sheets} sheets")
+        return
+
+    started = time.time()
+    report = run_benchmark(scanner, sheets, repeat=args.repeat)
+    report['elapsed_seconds'] = round(time.time() - started, 2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+        print(f"\n⏱️  Benchmarked {args.sheets} sheets in {report['elapsed_seconds']}s", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
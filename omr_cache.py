@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+OMR Result Cache - Reuse scan results for repeated uploads
+Results are keyed by a hash of the image bytes plus the scanner
+parameters, held in an in-process LRU bounded by size, with an optional
+on-disk tier so hits survive restarts and are shared between workers.
+The disk tier is bounded too: entries older than the age limit are
+deleted, then the least recently used ones until it fits its byte limit.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from omr_results import dumps
+
+CACHE_FOLDER = os.path.join('results', 'cache')
+
+logger = logging.getLogger(__name__)
+
+def cache_key(image_bytes, *fingerprints):
+    """Hash of the image bytes and every parameter fingerprint that affects the result"""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(image_bytes)
+    for fingerprint in fingerprints:
+        digest.update(b'\0')
+        digest.update(str(fingerprint).encode('utf-8'))
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Size-bounded LRU of serialized scan results (debug images are never
+    cached). max_bytes=0 disables the memory tier; folder=None disables disk.
+    The disk tier keeps at most disk_max_bytes, and entries unused for
+    disk_max_age_seconds are dropped (0 = no age limit).
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, folder=None, disk_max_bytes=256 * 1024 * 1024,
+                 disk_max_age_seconds=7 * 24 * 3600, sweep_interval=60):
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_max_age_seconds = disk_max_age_seconds
+        self.sweep_interval = sweep_interval
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_size = 0
+        self._last_sweep = 0
+
+        if self.folder:
+            os.makedirs(self.folder, exist_ok=True)
+            self.sweep()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], f"{key}.json")
+
+    def _remember(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = payload
+            self.size += len(payload)
+
+            # Evict least recently used entries until we fit
+            while self.size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get(self, key):
+        """Return a fresh copy of the cached result, or None"""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+
+        if payload is None and self.folder:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    payload = f.read()
+                os.utime(path)  # Recently used: evicted last
+                self._remember(key, payload)
+            except OSError:
+                payload = None
+
+        if payload is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(payload)
+
+    def put(self, key, result):
+        """Cache a scan result (without its debug image)"""
+        result = {k: v for k, v in result.items() if k != 'debug_image'}
+        payload = dumps(result)
+
+        self._remember(key, payload)
+
+        if self.folder:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+
+            with self._lock:
+                self._disk_size += len(payload)
+                due = (self._disk_size > self.disk_max_bytes or
+                       time.time() - self._last_sweep > self.sweep_interval)
+            if due:
+                self.sweep()
+
+    def sweep(self):
+        """
+        Delete expired disk entries, then the least recently used ones
+        until the disk tier is under 90% of disk_max_bytes
+        """
+        if not self.folder:
+            return
+        now = time.time()
+        files = []
+        for shard in os.scandir(self.folder):
+            if not shard.is_dir():
+                continue
+            try:
+                entries = list(os.scandir(shard.path))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.name.endswith('.json'):  # Not files being written
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+                except OSError:
+                    pass
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            expired = self.disk_max_age_seconds and now - mtime > self.disk_max_age_seconds
+            if not expired and total <= self.disk_max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+
+        with self._lock:
+            self._disk_size = total
+            self._last_sweep = now
+        if removed:
+            logger.info("Result cache eviction: removed %d files, %.1f MB kept", removed, total / (1024 * 1024))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -5,8 +5,140 @@ Specifically designed to scan filled/shaded circles in OMR forms
 """
 
 import cv2
+import io
 import numpy as np
 import os
+import json
+import logging
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def _timed(timings, stage):
+    """Add the elapsed milliseconds of the block to timings[stage] (if timings is a dict)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - started) * 1000
+
+@lru_cache(maxsize=256)
+def _disk_offsets(radius):
+    """
+    Row/column offsets of every pixel inside a filled circle of `radius`,
+    rasterized exactly like cv2.circle(mask, center, radius, 255, -1)
+    """
+    size = 2 * radius + 1
+    disk = np.zeros((size, size), dtype=np.uint8)
+    cv2.circle(disk, (radius, radius), radius, 255, -1)
+    dy, dx = np.nonzero(disk)
+    return dy - radius, dx - radius
+
+@lru_cache(maxsize=256)
+def _ring_offsets(inner, outer):
+    """Offsets of the pixels of a disk of radius `outer` that lie outside radius `inner`"""
+    dy, dx = _disk_offsets(outer)
+    keep = dy * dy + dx * dx > inner * inner
+    return dy[keep], dx[keep]
+
+def _gather_pixels(gray_image, centers, radii, offsets):
+    """
+    Pixel values around every circle plus the index of the circle each one
+    belongs to. `offsets(radius)` gives the (dy, dx) pattern; circles that
+    share a radius are gathered with one fancy-index.
+    """
+    height, width = gray_image.shape[:2]
+    values = []
+    labels = []
+    for radius in np.unique(radii):
+        dy, dx = offsets(int(radius))
+        idx = np.nonzero(radii == radius)[0]
+        ys = centers[idx, 1][:, None] + dy[None, :]
+        xs = centers[idx, 0][:, None] + dx[None, :]
+        inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+        values.append(gray_image[ys[inside], xs[inside]])
+        labels.append(np.broadcast_to(idx[:, None], ys.shape)[inside])
+    
+    if not values:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(values).astype(np.int64), np.concatenate(labels).astype(np.int64)
+
+def _label_medians(labels, values, counts):
+    """
+    Exact median of each label's values: sort (label, value) pairs once,
+    then pick the middle element(s) of every label's run (0 for empty labels)
+    """
+    n = counts.size
+    valid = counts > 0
+    safe_counts = np.maximum(counts, 1)
+    ordered = np.sort(labels * 256 + values) & 255
+    starts = np.cumsum(counts) - counts
+    lower = np.where(valid, starts + (safe_counts - 1) // 2, 0)
+    upper = np.where(valid, starts + safe_counts // 2, 0)
+    if not ordered.size:
+        return np.zeros(n)
+    median = (ordered[lower] + ordered[upper]) / 2.0
+    median[~valid] = 0
+    return median
+
+_LEVELS = np.arange(256, dtype=np.int64)
+
+class _LabelStats:
+    """
+    Per-label statistics of 8-bit pixel values (label = circle index).
+    In histogram mode one bincount over label * 256 + value builds a
+    256-bin histogram for every label, and the mean, std, exact median and
+    below-cut counts are all read from it; otherwise the pixels themselves
+    are summed, compared and sorted.
+    """
+    def __init__(self, labels, values, n, histogram=True):
+        self.n = n
+        self.labels = labels
+        self.values = values
+        self.cumulative = None
+        if histogram:
+            hist = np.bincount(labels * 256 + values, minlength=n * 256).reshape(n, 256)
+            self.cumulative = np.cumsum(hist, axis=1)
+            self.count = self.cumulative[:, -1]
+            sums = hist @ _LEVELS
+            squares = hist @ (_LEVELS * _LEVELS)
+        else:
+            self.count = np.bincount(labels, minlength=n)
+            sums = np.bincount(labels, weights=values, minlength=n)
+            squares = np.bincount(labels, weights=values * values, minlength=n)
+        
+        safe_counts = np.maximum(self.count, 1)
+        self.mean = sums / safe_counts
+        self.std = np.sqrt(np.maximum(squares / safe_counts - self.mean * self.mean, 0))
+        self.mean[self.count == 0] = 0
+    
+    def median(self):
+        """Exact median per label (0 for labels without pixels)"""
+        if self.cumulative is None:
+            return _label_medians(self.labels, self.values, self.count)
+        # The k-th smallest value is the first level whose cumulative count exceeds k
+        lower = np.argmax(self.cumulative > (np.maximum(self.count, 1) - 1)[:, None] // 2, axis=1)
+        upper = np.argmax(self.cumulative > (self.count // 2)[:, None], axis=1)
+        median = (lower + upper) / 2.0
+        median[self.count == 0] = 0
+        return median
+    
+    def below(self, cut):
+        """Pixels per label darker than `cut` (one value, or one per label)"""
+        cut = np.broadcast_to(np.asarray(cut, dtype=np.float64), (self.n,))
+        if self.cumulative is None:
+            return np.bincount(self.labels, weights=self.values < cut[self.labels], minlength=self.n)
+        # value < cut  <=>  value <= ceil(cut) - 1
+        last = np.ceil(cut).astype(np.int64) - 1
+        counts = self.cumulative[np.arange(self.n), np.clip(last, 0, 255)]
+        return np.where(last >= 0, counts, 0)
+
 
 class OMRCircleScanner:
     def __init__(self):
@@ -15,38 +147,266 @@ class OMRCircleScanner:
             'isda','egg','water','sinigang','chicken','pusit','gatas','beef'
         ]
         
-    def detect_circles(self, image_path):
+        # HoughCircles parameters (tuned for full-resolution images)
+        self.hough_params = {
+            'dp': 1,
+            'minDist': 40,    # Increased to avoid duplicate detections
+            'param1': 80,     # Higher threshold for edge detection
+            'param2': 25,     # Lower accumulator threshold for better detection
+            'minRadius': 15,  # Adjusted based on your image
+            'maxRadius': 60   # Adjusted based on your image
+        }
+        
+        # Coarse-to-fine detection: images whose longest side exceeds this
+        # are searched on a downscaled copy and refined at full resolution
+        # (None disables the pyramid)
+        self.coarse_max_side = 1280
+        
+        # Expected bubble radii as fractions of the image's longest side:
+        # canonical order-form bubbles are 12-36 px on an 1100 px page.
+        # When the largest expected bubble would exceed the Hough maxRadius
+        # on the decoded image, detection widens maxRadius to cover it.
+        self.min_bubble_ratio = 0.01
+        self.max_bubble_ratio = 0.035
+        
+        # Reduced-resolution decode for unregistered scans: big encoded
+        # images are decoded straight to grayscale at 1/2, 1/4 or 1/8 size
+        # (JPEG DCT scaling), picked from the image header so the smallest
+        # expected bubble still has at least decode_min_radius pixels. On
+        # synthetic sheets Hough finds every bubble down to 24 px but starts
+        # missing some at 20 px, so pages up to 4800 px are decoded in full.
+        # Results are reported in source-image coordinates either way.
+        self.reduced_decode = True
+        self.decode_min_radius = 24
+        
+        # Fill classification thresholds
+        self.fill_margin = 5            # Shrink radius to avoid the printed border
+        self.dark_threshold = 100       # Pixels below this count as "dark"
+        self.min_dark_ratio = 0.6       # >60% dark pixels for filled black circles
+        self.max_mean_intensity = 120   # Mean must be below this when filled
+        self.max_median_intensity = 100 # Median must be below this when filled
+        
+        # Classifier: 'fixed' uses the thresholds above; 'adaptive' compares
+        # each bubble's median with the paper just outside it and finds the
+        # filled/empty cut per sheet (Otsu over all bubbles on the page), so
+        # dim or unevenly lit photos read the same as scans. Their
+        # fill_percent values are not comparable, so every result names the
+        # classifier that produced it.
+        self.fill_classifier = 'fixed'
+        self.ring_scale = (1.35, 1.6)       # Paper ring between these multiples of the radius
+        self.fill_ratio_threshold = 0.5     # Median/paper cut when the sheet has no clear split
+        self.fill_ratio_bounds = (0.3, 0.75)  # Per-sheet cuts are kept inside this range
+        self.min_fill_contrast = 0.25       # Class separation needed to trust a per-sheet cut
+        self.ambiguous_confidence = 0.5     # Below this confidence a bubble is flagged ambiguous
+        
+        # Per-circle statistics: 'histogram' (one 256-bin histogram per
+        # circle from a single bincount) or 'pixels' (sums and a sort over
+        # the raw pixels). Both give identical results, so this is not part
+        # of the params fingerprint.
+        self.fill_stats = 'histogram'
+        
+    def params_fingerprint(self):
+        """
+        Stable string of every parameter that affects scan results
+        (used as part of result cache keys)
+        """
+        return json.dumps({
+            'menu_items': self.menu_items,
+            'hough_params': self.hough_params,
+            'coarse_max_side': self.coarse_max_side,
+            'reduced_decode': self.reduced_decode,
+            'min_bubble_ratio': self.min_bubble_ratio,
+            'max_bubble_ratio': self.max_bubble_ratio,
+            'decode_min_radius': self.decode_min_radius,
+            'fill_margin': self.fill_margin,
+            'dark_threshold': self.dark_threshold,
+            'min_dark_ratio': self.min_dark_ratio,
+            'max_mean_intensity': self.max_mean_intensity,
+            'max_median_intensity': self.max_median_intensity,
+            'fill_classifier': self.fill_classifier,
+            'ring_scale': self.ring_scale,
+            'fill_ratio_threshold': self.fill_ratio_threshold,
+            'fill_ratio_bounds': self.fill_ratio_bounds,
+            'min_fill_contrast': self.min_fill_contrast,
+            'ambiguous_confidence': self.ambiguous_confidence
+        }, sort_keys=True)
+    
+    def load_image(self, source):
+        """
+        Decode an image from a file path, a raw encoded byte buffer or an
+        already decoded ndarray (returned as-is)
+        """
+        if isinstance(source, np.ndarray):
+            return source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            buffer = np.frombuffer(source, dtype=np.uint8)
+            if buffer.size == 0:
+                return None
+            return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        return cv2.imread(source)
+    
+    def image_size(self, source):
+        """(width, height) of an encoded image (path or bytes) from its header alone, or None"""
+        try:
+            stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+            with Image.open(stream) as header:
+                return header.size
+        except Exception:
+            return None
+    
+    def decode_factor(self, source, size=None):
+        """
+        Reduction factor (1, 2, 4 or 8) for decoding an encoded image, read
+        from its header alone: the largest that keeps the smallest expected
+        bubble at least decode_min_radius pixels. That is also the factor
+        that brings the largest expected bubble closest to the Hough radius
+        range; bubble_hough_params() covers whatever is still beyond it.
+        """
+        size = size or self.image_size(source)
+        if size is None:
+            return 1
+        
+        smallest_radius = max(size) * self.min_bubble_ratio
+        for factor in (8, 4, 2):
+            if smallest_radius / factor >= self.decode_min_radius:
+                return factor
+        return 1
+    
+    def bubble_hough_params(self, longest_side):
+        """
+        Hough parameters for a decoded image whose longest side is
+        `longest_side`: hough_params, with the radius range moved to cover
+        the expected bubbles (min_bubble_ratio..max_bubble_ratio of the
+        side) when the largest of them is beyond maxRadius. Radius
+        estimates of one bubble vary by about 10%, hence the 15% margins.
+        """
+        smallest_radius = longest_side * self.min_bubble_ratio
+        largest_radius = longest_side * self.max_bubble_ratio
+        if largest_radius <= self.hough_params['maxRadius']:
+            return self.hough_params
+        params = dict(self.hough_params)
+        # Raising minRadius with it keeps label text, which is large on such images, out
+        params['minRadius'] = max(params['minRadius'], int(smallest_radius * 0.85))
+        params['maxRadius'] = int(np.ceil(largest_radius * 1.15))
+        # Bubbles of at least the smallest expected radius are a diameter apart
+        params['minDist'] = max(params['minDist'], int(2 * smallest_radius))
+        return params
+    
+    def load_reduced(self, source, factor):
+        """Decode an encoded image (path or bytes) straight to grayscale at 1/factor size"""
+        flags = {
+            1: cv2.IMREAD_GRAYSCALE,
+            2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+            4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+            8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+        }[factor]
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            buffer = np.frombuffer(source, dtype=np.uint8)
+            if buffer.size == 0:
+                return None
+            return cv2.imdecode(buffer, flags)
+        return cv2.imread(source, flags)
+    
+    def prepare_image(self, source, reduce=False):
         """
-        Detect circles in the image using improved HoughCircles parameters
+        Decode the image and convert it to grayscale exactly once.
+        Returns a frame dict shared by detection and fill scoring, or None
+        if the image could not be decoded. With reduce=True (and
+        reduced_decode enabled) an encoded source whose decode_factor() is
+        above 1 is decoded directly to grayscale at that reduction; the
+        frame's 'image' is then the grayscale image and 'decode_scale'
+        holds the factor. 'megapixels' is always the source image's size.
         """
-        # Load image
-        image = cv2.imread(image_path)
-        if image is None:
+        if isinstance(source, dict):
+            return source
+        
+        timings = {}
+        scale = 1
+        size = None
+        with _timed(timings, 'decode'):
+            if reduce and self.reduced_decode and not isinstance(source, np.ndarray):
+                size = self.image_size(source)
+                scale = self.decode_factor(source, size)
+            if scale != 1:
+                image = gray = self.load_reduced(source, scale)
+                if image is None:
+                    return None
+            else:
+                image = self.load_image(source)
+                if image is None:
+                    return None
+                
+                if image.ndim == 2:
+                    gray = image
+                elif image.shape[2] == 4:
+                    gray = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+                else:
+                    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        
+        height, width = gray.shape[:2]
+        if size is None:
+            size = (width, height)
+        frame = {
+            'image': image,
+            'gray': gray,
+            'timings': timings,
+            'megapixels': size[0] * size[1] / 1e6
+        }
+        if scale != 1:
+            frame['decode_scale'] = scale
+        params = self.bubble_hough_params(max(width, height))
+        if params is not self.hough_params:
+            frame['hough_params'] = params
+        return frame
+    
+    def detect_circles(self, source):
+        """
+        Detect circles in the image using improved HoughCircles parameters.
+        `source` may be a file path, encoded bytes, a decoded ndarray or a
+        frame from prepare_image(); the filtered and thresholded images are
+        cached on the frame so repeated calls do not redo the work.
+        Large images are searched coarse-to-fine (see coarse_max_side).
+        """
+        frame = self.prepare_image(source)
+        if frame is None:
             return {'error': 'Could not load image'}
         
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if 'circles' in frame:
+            return frame['circles']
         
-        # Apply bilateral filter to reduce noise while keeping edges sharp
-        filtered = cv2.bilateralFilter(gray, 9, 75, 75)
+        gray = frame['gray']
+        height, width = gray.shape[:2]
+        timings = frame.setdefault('timings', {})
         
-        # Apply adaptive threshold to better detect circle edges
-        thresh = cv2.adaptiveThreshold(filtered, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-        
-        # Detect circles using optimized HoughCircles parameters
-        circles = cv2.HoughCircles(
-            thresh,
-            cv2.HOUGH_GRADIENT,
-            dp=1,
-            minDist=40,  # Increased to avoid duplicate detections
-            param1=80,   # Higher threshold for edge detection
-            param2=25,   # Lower accumulator threshold for better detection
-            minRadius=15, # Adjusted based on your image
-            maxRadius=60  # Adjusted based on your image
-        )
+        # Registered frames may carry parameters tuned for their canonical size
+        params = frame.get('hough_params', self.hough_params)
+        
+        scale = 1.0
+        if self.coarse_max_side and max(height, width) > self.coarse_max_side:
+            scale = self.coarse_max_side / float(max(height, width))
+        frame['detect_scale'] = scale
+        
+        if scale < 1.0:
+            # Coarse pass on a downscaled copy, then refine each candidate
+            # in a small full-resolution window
+            small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            filtered, thresh = self._edge_map(small, timings)
+            coarse = self._hough_circles(thresh, params, scale, timings)
+            circles = []
+            for x, y, r in coarse:
+                refined = self._refine_circle(gray, x / scale, y / scale, r / scale, params, scale, timings)
+                if refined is not None:
+                    circles.append(refined)
+        else:
+            filtered, thresh = self._edge_map(gray, timings)
+            circles = self._hough_circles(thresh, params, timings=timings)
+        
+        frame['filtered'] = filtered
+        frame['thresh'] = thresh
         
         circle_data = []
-        if circles is not None:
-            circles = np.round(circles[0, :]).astype("int")
+        if len(circles):
+            circles = np.round(np.array(circles)).astype("int")
             
             # Sort circles by y-coordinate (top to bottom)
             circles = sorted(circles, key=lambda c: c[1])
@@ -59,100 +419,407 @@ class OMRCircleScanner:
                     'index': i
                 })
         
+        frame['circles'] = circle_data
         return circle_data
     
-    def check_circle_fill(self, gray_image, circle):
+    def _edge_map(self, gray, timings=None):
         """
-        Improved circle fill detection for black filled vs red empty circles
+        Bilateral filter + adaptive threshold used as the Hough input
         """
-        x, y, r = circle['center'][0], circle['center'][1], circle['radius']
+        # Apply bilateral filter to reduce noise while keeping edges sharp
+        with _timed(timings, 'bilateral'):
+            filtered = cv2.bilateralFilter(gray, 9, 75, 75)
         
-        # Create a mask for the circle (slightly smaller to avoid border effects)
-        mask = np.zeros(gray_image.shape[:2], dtype=np.uint8)
-        cv2.circle(mask, (x, y), max(1, r-5), 255, -1)  # Inner circle to avoid borders
+        # Apply adaptive threshold to better detect circle edges
+        with _timed(timings, 'threshold'):
+            thresh = cv2.adaptiveThreshold(filtered, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
         
-        # Extract pixels within the circle
-        circle_pixels = gray_image[mask == 255]
+        return filtered, thresh
+    
+    def _hough_circles(self, thresh, params, scale=1.0, timings=None):
+        """
+        Run HoughCircles with distance/radius parameters scaled to the image
+        """
+        min_radius = max(1, int(round(params['minRadius'] * scale)))
+        max_radius = max(min_radius + 1, int(round(params['maxRadius'] * scale)))
         
-        if len(circle_pixels) == 0:
-            return False, 0
+        # Accumulator votes grow with the circumference, so a downscaled
+        # image needs a proportionally lower threshold
+        accumulator = params['param2'] if scale >= 1.0 else max(10, params['param2'] * scale)
+        
+        with _timed(timings, 'hough'):
+            circles = cv2.HoughCircles(
+                thresh,
+                cv2.HOUGH_GRADIENT,
+                dp=params['dp'],
+                minDist=max(1.0, params['minDist'] * scale),
+                param1=params['param1'],
+                param2=accumulator,
+                minRadius=min_radius,
+                maxRadius=max_radius
+            )
+        
+        if circles is None:
+            return []
+        return circles[0, :].tolist()
+    
+    def _refine_circle(self, gray, x, y, r, params, scale, timings=None):
+        """
+        Re-fit a coarse candidate inside a full-resolution window.
+        The coarse radius is often badly underestimated (a 35 px bubble can
+        come back as 17 px), so the window and the radius range come from
+        the full [minRadius, maxRadius] rather than from the candidate.
+        Returns None when no circle is confirmed at full resolution, which
+        also weeds out the extra candidates the low coarse threshold admits.
+        """
+        height, width = gray.shape[:2]
+        # Room for the largest bubble plus the coarse centre error
+        half = int(params['maxRadius']) + int(np.ceil(2.0 / scale)) + 8
+        x0, y0 = max(0, int(x) - half), max(0, int(y) - half)
+        x1, y1 = min(width, int(x) + half + 1), min(height, int(y) + half + 1)
+        
+        window = gray[y0:y1, x0:x1]
+        if window.shape[0] < 3 or window.shape[1] < 3:
+            return None
         
-        # Calculate statistics
-        mean_intensity = np.mean(circle_pixels)
-        median_intensity = np.median(circle_pixels)
-        std_intensity = np.std(circle_pixels)
+        _, thresh = self._edge_map(window, timings)
+        with _timed(timings, 'hough'):
+            found = cv2.HoughCircles(
+                thresh,
+                cv2.HOUGH_GRADIENT,
+                dp=1,
+                minDist=2 * half,  # Only the strongest circle in the window
+                param1=params['param1'],
+                param2=params['param2'],
+                minRadius=params['minRadius'],
+                maxRadius=params['maxRadius']
+            )
+        if found is None:
+            return None
         
-        # Count dark pixels (for black filled circles)
-        dark_pixels = np.sum(circle_pixels < 100)  # Very dark pixels
-        total_pixels = len(circle_pixels)
-        dark_ratio = dark_pixels / total_pixels
+        fx, fy, fr = found[0, 0]
+        fx, fy = fx + x0, fy + y0
         
-        # Calculate fill percentage based on darkness
-        fill_percentage = dark_ratio * 100
+        # Reject refinements that jumped to a neighbouring mark
+        if np.hypot(fx - x, fy - y) > max(r, fr):
+            return None
+        return fx, fy, fr
+    
+    def score_circles(self, gray_image, circles):
+        """
+        Batch fill scoring for all circles in one pass.
+        Only the pixels inside each (inner) circle are gathered - no
+        full-frame masks - so the cost scales with the bubble area rather
+        than bubbles x image size. Returns a dict of per-circle arrays:
+        count, mean, median, std, dark_ratio, fill_percent, is_shaded,
+        confidence and ambiguous (plus background and ratio when adaptive).
+        """
+        n = len(circles)
+        
+        centers = np.array([c['center'] for c in circles], dtype=np.intp).reshape(n, 2)
+        radii = np.array([c['radius'] for c in circles], dtype=np.intp)
+        inner_radii = np.maximum(1, radii - self.fill_margin)  # Inner circle to avoid borders
+        
+        values, labels = _gather_pixels(gray_image, centers, inner_radii, _disk_offsets)
+        pixels = _LabelStats(labels, values, n, self.fill_stats == 'histogram')
+        
+        counts = pixels.count
+        valid = counts > 0
+        mean = pixels.mean
+        median = pixels.median()
+        
+        stats = {
+            'count': counts,
+            'mean': mean,
+            'median': median,
+            'std': pixels.std
+        }
+        
+        if self.fill_classifier == 'adaptive':
+            self._classify_adaptive(gray_image, centers, radii, pixels, stats)
+            return stats
+        
+        dark_ratio = pixels.below(self.dark_threshold) / np.maximum(counts, 1)
         
         # A circle is considered "filled/selected" if:
         # 1. High percentage of dark pixels (>60% for filled black circles)
         # 2. Low mean intensity (<120 for black filled)
         # 3. Low median intensity (<100 for black filled)
-        is_shaded = (dark_ratio > 0.6 and 
-                    mean_intensity < 120 and 
-                    median_intensity < 100)
+        is_shaded = (valid &
+                     (dark_ratio > self.min_dark_ratio) &
+                     (mean < self.max_mean_intensity) &
+                     (median < self.max_median_intensity))
+        
+        stats.update({
+            'dark_ratio': dark_ratio,
+            'fill_percent': dark_ratio * 100,
+            'is_shaded': is_shaded,
+            'confidence': valid.astype(np.float64),
+            'ambiguous': np.zeros(n, dtype=bool)
+        })
+        return stats
+    
+    def _classify_adaptive(self, gray_image, centers, radii, pixels, stats):
+        """
+        Per-sheet classification over the circle statistics (vectorized).
+        Each bubble's darkness ratio is its median over the median of a
+        paper ring just outside it, which cancels out exposure and shadows.
+        Otsu's split over all ratios on the sheet gives the cut; confidence
+        is the distance from the cut relative to half the gap between the
+        filled and empty groups.
+        """
+        n = radii.size
+        counts = stats['count']
+        valid = counts > 0
+        
+        # Local paper brightness. The ring scales with the radius: filled
+        # bubbles are often detected on the edge of the ink, inside the
+        # printed border, so a fixed offset can land on the border itself
+        inner_scale, outer_scale = self.ring_scale
+        ring_values, ring_labels = _gather_pixels(
+            gray_image, centers, radii,
+            lambda radius: _ring_offsets(int(radius * inner_scale), int(radius * outer_scale))
+        )
+        ring = _LabelStats(ring_labels, ring_values, n, self.fill_stats == 'histogram')
+        background = ring.median()
+        has_ring = ring.count > 0
+        if not has_ring.all():
+            fallback = np.median(background[has_ring]) if has_ring.any() else 255.0
+            background[~has_ring] = fallback
+        background = np.maximum(background, 1.0)
+        ratio = np.clip(stats['median'] / background, 0, 1.5)
+        
+        # Otsu over the sorted ratios: every split point at once from
+        # cumulative sums, keeping the one with the largest between-class variance
+        threshold = self.fill_ratio_threshold
+        half_gap = self.min_fill_contrast
+        ordered = np.sort(ratio[valid])
+        m = ordered.size
+        if m >= 2:
+            k = np.arange(1, m)
+            below = np.cumsum(ordered)[:-1]
+            low_mean = below / k
+            high_mean = (ordered.sum() - below) / (m - k)
+            best = int(np.argmax(k * (m - k) * (high_mean - low_mean) ** 2))
+            gap = high_mean[best] - low_mean[best]
+            # Trust the split only when the groups are far apart and fall on
+            # either side of the default cut (an all-filled sheet with pen
+            # and pencil marks must not be split in two)
+            if (gap >= self.min_fill_contrast and
+                    low_mean[best] < self.fill_ratio_threshold < high_mean[best]):
+                low, high = self.fill_ratio_bounds
+                threshold = float(np.clip((low_mean[best] + high_mean[best]) / 2, low, high))
+                half_gap = gap / 2
         
-        return is_shaded, fill_percentage
+        is_shaded = valid & (ratio < threshold)
+        confidence = np.where(valid, np.clip(np.abs(ratio - threshold) / half_gap, 0, 1), 0.0)
+        
+        # Fill percentage: pixels darker than the cut relative to their own paper
+        dark_ratio = pixels.below(threshold * background) / np.maximum(counts, 1)
+        
+        stats.update({
+            'background': background,
+            'ratio': ratio,
+            'dark_ratio': dark_ratio,
+            'fill_percent': dark_ratio * 100,
+            'is_shaded': is_shaded,
+            'confidence': confidence,
+            'ambiguous': valid & (confidence < self.ambiguous_confidence)
+        })
     
-    def scan_shaded_circles(self, image_path):
+    def check_circle_fill(self, gray_image, circle):
         """
-        Main scanning function - detects shaded circles
+        Improved circle fill detection for black filled vs red empty circles
         """
-        print(f"🔍 Scanning image: {os.path.basename(image_path)}")
+        stats = self.score_circles(gray_image, [circle])
         
-        # Load image
-        image = cv2.imread(image_path)
-        if image is None:
+        if stats['count'][0] == 0:
+            return False, 0
+        
+        return bool(stats['is_shaded'][0]), float(stats['fill_percent'][0])
+    
+    def scan_image(self, source, debug=True, registrar=None, reuse_registration=False):
+        """
+        Scan an image for shaded circles. `source` is usually an in-memory
+        image (decoded ndarray or encoded byte buffer); decoding, grayscale
+        conversion, filtering and Hough detection each run once and nothing
+        is written to disk. Large encoded images are decoded at reduced
+        resolution (see reduced_decode), whether or not debug is set; the
+        debug overlay is then drawn on a separate full-size colour decode.
+        With debug=False no annotated image is rendered. With a
+        PageRegistrar the sheet is first warped to its canonical size.
+        """
+        frame = self.prepare_image(source, reduce=registrar is None)
+        if frame is None:
             return {'error': 'Could not load image'}
         
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if registrar is not None:
+            frame = self._register(frame, registrar, reuse_registration, debug)
         
-        # Detect circles
-        circles = self.detect_circles(image_path)
+        gray = frame['gray']
+        
+        # Detect circles (reuses the frame's grayscale image)
+        circles = self.detect_circles(frame)
         if isinstance(circles, dict) and 'error' in circles:
             return circles
         
-        print(f"⚫ Found {len(circles)} circles")
+        logger.debug("Found %d circles", len(circles))
         
-        # Check each circle for shading
-        shaded_selections = []
+        # Score every circle once and keep the per-circle analysis
+        with _timed(frame.setdefault('timings', {}), 'fill'):
+            analysis = self.analyze_circles(gray, circles)
         
-        for i, circle in enumerate(circles):
-            item_name = self.menu_items[i] if i < len(self.menu_items) else f"Item_{i+1}"
-            
-            is_shaded, fill_percent = self.check_circle_fill(gray, circle)
-            
-            if is_shaded:
+        # Reduced decodes report geometry in source-image pixels, and the
+        # overlay is drawn over the source image itself (as DebugImageRenderer does)
+        scale = frame.get('decode_scale', 1)
+        if scale != 1:
+            self.scale_circles(analysis, scale)
+            if debug:
+                with _timed(frame['timings'], 'annotate'):
+                    frame['image'] = self.load_image(source)
+                if frame['image'] is None:
+                    return {'error': 'Could not load image'}
+        
+        return self.build_result(frame, analysis, debug)
+    
+    def scale_circles(self, circles, scale):
+        """Scale circle geometry (center, radius, bbox) in place, e.g. from a reduced decode to the source"""
+        for circle in circles:
+            circle['center'] = (circle['center'][0] * scale, circle['center'][1] * scale)
+            circle['radius'] = circle['radius'] * scale
+            circle['bbox'] = tuple(v * scale for v in circle['bbox'])
+        return circles
+    
+    def scan_template(self, source, template, debug=True, registrar=None, reuse_registration=False):
+        """
+        Scan an image of a known form. Instead of a Hough search, the
+        template locates its page anchors and returns its precomputed bubble
+        positions, so only fill sampling runs (O(bubbles)) and item names
+        come straight from the template.
+        """
+        frame = self.prepare_image(source)
+        if frame is None:
+            return {'error': 'Could not load image'}
+        
+        if registrar is not None:
+            frame = self._register(frame, registrar, reuse_registration, debug)
+        
+        circles = template.locate(frame['gray'])
+        frame['circles'] = circles
+        logger.debug("Template '%s': %d bubbles", template.name, len(circles))
+        
+        with _timed(frame.setdefault('timings', {}), 'fill'):
+            analysis = self.analyze_circles(frame['gray'], circles)
+        
+        result = self.build_result(frame, analysis, debug)
+        result['template'] = template.name
+        return result
+    
+    def _register(self, frame, registrar, reuse, debug):
+        """Warp the frame to its canonical page, keeping its timings and size"""
+        timings = frame.setdefault('timings', {})
+        with _timed(timings, 'register'):
+            registered = registrar.register(frame, reuse=reuse, warp_color=debug)
+        registered['timings'] = timings
+        if 'megapixels' in frame:
+            registered['megapixels'] = frame['megapixels']
+        return registered
+    
+    def build_result(self, frame, analysis, debug):
+        """
+        Assemble the scan result (selections, summary and optional debug
+        overlay) from per-circle analysis records
+        """
+        shaded_selections = []
+        for circle in analysis:
+            if circle['is_shaded']:
                 shaded_selections.append({
-                    'item': item_name,
-                    'fill_percent': float(round(fill_percent, 1)),
-                    'center': (int(circle['center'][0]), int(circle['center'][1])),
-                    'radius': int(circle['radius']),
-                    'bbox': (int(circle['bbox'][0]), int(circle['bbox'][1]), 
-                            int(circle['bbox'][2]), int(circle['bbox'][3]))
+                    'item': circle['item'],
+                    'fill_percent': circle['fill_percent'],
+                    'center': circle['center'],
+                    'radius': circle['radius'],
+                    'bbox': circle['bbox']
                 })
-                print(f"✓ SHADED: {item_name} (fill: {fill_percent:.1f}%)")
-            else:
-                print(f"○ Empty: {item_name} (fill: {fill_percent:.1f}%)")
         
+        # Per-circle detail only at debug level (skip building the records otherwise)
+        if logger.isEnabledFor(logging.DEBUG):
+            for circle in analysis:
+                logger.debug(
+                    "%s: %s (fill: %.1f%%)",
+                    'SHADED' if circle['is_shaded'] else 'Empty', circle['item'], circle['fill_percent'],
+                    extra={'item': circle['item'], 'is_shaded': circle['is_shaded'], 'fill_percent': circle['fill_percent']}
+                )
+        
+        result = {
+            'shaded_selections': shaded_selections,
+            'circles': analysis,
+            'total_circles': int(len(analysis)),
+            'total_selected': int(len(shaded_selections)),
+            'scan_type': 'SHADED CIRCLES ONLY',
+            'fill_classifier': self.fill_classifier
+        }
+        
+        if 'registration' in frame:
+            result['registration'] = frame['registration']
+        
+        timings = frame.get('timings')
+        if debug:
+            with _timed(timings, 'annotate'):
+                result['debug_image'] = self.draw_debug_image(frame['image'], analysis)
+        
+        # Per-stage milliseconds and image size, for metrics
+        if timings is not None:
+            result['timings'] = {stage: round(ms, 3) for stage, ms in timings.items()}
+        if 'megapixels' in frame:
+            result['megapixels'] = round(frame['megapixels'], 3)
+        
+        return result
+    
+    def analyze_circles(self, gray_image, circles):
+        """
+        Build the per-circle analysis records (item name, geometry and fill
+        statistics) that both the selection list and the debug overlay use.
+        Circles that carry their own 'item' (e.g. from a template) keep it.
+        """
+        stats = self.score_circles(gray_image, circles)
+        
+        analysis = []
+        for i, circle in enumerate(circles):
+            item_name = circle.get('item')
+            if not item_name:
+                item_name = self.menu_items[i] if i < len(self.menu_items) else f"Item_{i+1}"
+            analysis.append({
+                'index': i,
+                'item': item_name,
+                'center': (int(circle['center'][0]), int(circle['center'][1])),
+                'radius': int(circle['radius']),
+                'bbox': (int(circle['bbox'][0]), int(circle['bbox'][1]), 
+                        int(circle['bbox'][2]), int(circle['bbox'][3])),
+                'is_shaded': bool(stats['is_shaded'][i]),
+                'fill_percent': float(round(stats['fill_percent'][i], 1)),
+                'mean_intensity': float(round(stats['mean'][i], 1)),
+                'median_intensity': float(stats['median'][i]),
+                'confidence': float(round(stats['confidence'][i], 2)),
+                'ambiguous': bool(stats['ambiguous'][i])
+            })
+        
+        return analysis
+    
+    def draw_debug_image(self, image, analysis):
+        """
+        Render the annotated debug overlay from per-circle analysis records
+        """
         # Create debug image with detailed analysis
-        debug_image = image.copy()
+        debug_image = image.copy() if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
         
         # Draw all circles with detailed info
-        for i, circle in enumerate(circles):
-            x, y, r = circle['center'][0], circle['center'][1], circle['radius']
-            item_name = self.menu_items[i] if i < len(self.menu_items) else f"Item_{i+1}"
-            
-            # Get fill analysis for this circle
-            is_shaded, fill_percent = self.check_circle_fill(gray, circle)
+        for circle in analysis:
+            x, y = circle['center']
+            r = circle['radius']
+            item_name = circle['item']
+            fill_percent = circle['fill_percent']
             
-            if is_shaded:
+            if circle['is_shaded']:
                 # Green for shaded/selected circles
                 cv2.circle(debug_image, (x, y), r, (0, 255, 0), 3)
                 cv2.putText(debug_image, f"SELECTED ({fill_percent:.1f}%)", (x-40, y-r-10), 
@@ -167,24 +834,34 @@ class OMRCircleScanner:
                 cv2.putText(debug_image, item_name, (x-20, y+r+15), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 255), 1)
         
+        total_selected = sum(1 for circle in analysis if circle['is_shaded'])
+        
         # Add comprehensive header
         cv2.putText(debug_image, "OMR CIRCLE DETECTION ANALYSIS", (10, 30), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
-        cv2.putText(debug_image, f"Found: {len(circles)} circles, Selected: {len(shaded_selections)}", 
+        cv2.putText(debug_image, f"Found: {len(analysis)} circles, Selected: {total_selected}", 
                    (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 1)
         
-        # Save debug image
-        debug_filename = f"circle_debug_{os.path.basename(image_path)}"
-        cv2.imwrite(debug_filename, debug_image)
-        print(f"💾 Debug image saved: {debug_filename}")
+        return debug_image
+
+    def scan_shaded_circles(self, image_path, debug=False, debug_path=None):
+        """
+        Main scanning function - detects shaded circles in an image file.
+        The annotated overlay is only written when a debug_path is given.
+        """
+        logger.info("Scanning image: %s", os.path.basename(image_path))
         
-        return {
-            'shaded_selections': shaded_selections,
-            'total_circles': int(len(circles)),
-            'total_selected': int(len(shaded_selections)),
-            'debug_image': debug_image,
-            'scan_type': 'SHADED CIRCLES ONLY'
-        }
+        result = self.scan_image(image_path, debug=debug or debug_path is not None)
+        if 'error' in result:
+            return result
+        
+        if debug_path is not None:
+            cv2.imwrite(debug_path, result['debug_image'])
+            logger.info("Debug image saved: %s", debug_path)
+            if not debug:
+                del result['debug_image']
+        
+        return result
 
 def test_circle_scanner():
     """Test the circle scanner with available images"""
@@ -204,12 +881,16 @@ def test_circle_scanner():
             if file.lower().endswith(('.jpg', '.jpeg', '.png')):
                 test_images.append(os.path.join('uploads', file))
     
-    if not test_images:
-        print("❌ No test images found in uploads folder")
-        return
-    
-    # Use the most recent image
-    test_image = test_images[-1]
+    if test_images:
+        # Use the most recent image
+        test_image = test_images[-1]
+    else:
+        # No real scans yet: fall back to a generated sheet
+        from omr_synthetic import encode_sheet, generate_sheet
+        image, _ = generate_sheet(seed=0)
+        test_image = os.path.join(tempfile.gettempdir(), 'omr_synthetic_sheet.jpg')
+        with open(test_image, 'wb') as f:
+            f.write(encode_sheet(image))
     print(f"📁 Testing with: {os.path.basename(test_image)}")
     
     result = scanner.scan_shaded_circles(test_image)
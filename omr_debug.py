@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+OMR Debug Overlays - Annotated images rendered on demand
+Scans store only circle data. The annotated overlay is drawn from the
+stored analysis and the saved upload the first time it is requested, then
+kept as encoded JPEG bytes in a size-bounded LRU.
+"""
+
+import cv2
+import numpy as np
+import threading
+import time
+from collections import OrderedDict
+
+from omr_metrics import observe_stage
+
+class DebugImageRenderer:
+    """
+    Renders and caches debug overlays keyed by (result id, JPEG quality)
+    """
+    def __init__(self, scanner, quality=80, max_bytes=16 * 1024 * 1024):
+        self.scanner = scanner
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, jpeg):
+        if len(jpeg) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = jpeg
+            self.size += len(jpeg)
+
+            while self.size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def render(self, result_id, source, result, quality=None):
+        """
+        Return the JPEG overlay for a stored scan result, drawing it over
+        `source` (the uploaded image) if it is not cached. Returns None if
+        the source image cannot be loaded.
+        """
+        quality = int(quality or self.quality)
+        key = (result_id, quality)
+        with self._lock:
+            jpeg = self._entries.get(key)
+            if jpeg is not None:
+                self._entries.move_to_end(key)
+                return jpeg
+
+        image = self.scanner.load_image(source)
+        if image is None:
+            return None
+
+        # Registered scans report coordinates on the warped page
+        registration = result.get('registration') or {}
+        if registration.get('registered'):
+            homography = np.array(registration['homography'], dtype=np.float64)
+            image = cv2.warpPerspective(image, homography, tuple(registration['canonical_size']))
+
+        started = time.perf_counter()
+        overlay = self.scanner.draw_debug_image(image, result.get('circles', []))
+        observe_stage('annotate', time.perf_counter() - started)
+
+        started = time.perf_counter()
+        ok, buffer = cv2.imencode('.jpg', overlay, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        observe_stage('encode', time.perf_counter() - started)
+        if not ok:
+            return None
+
+        jpeg = buffer.tobytes()
+        self._remember(key, jpeg)
+        return jpeg
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+OMR Documents - Multi-page PDF and TIFF order forms, one page at a time
+Pages are decoded (TIFF) or rasterized (PDF) lazily at a target DPI and
+handed out as grayscale arrays, so a document of any length only ever has
+the pages currently being scanned in memory.
+
+PDF support needs pypdfium2 (preferred) or PyMuPDF; TIFF uses Pillow.
+"""
+
+import io
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+try:
+    import pypdfium2
+except ImportError:  # Optional: only needed for PDF documents
+    pypdfium2 = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+DOCUMENT_EXTENSIONS = ('.pdf', '.tif', '.tiff')
+DEFAULT_DPI = 200
+
+def document_type(name, data=None):
+    """'pdf', 'tiff' or None, from the file's leading bytes or else its name"""
+    if data is not None:
+        head = bytes(data[:4])
+        if head == b'%PDF':
+            return 'pdf'
+        if head in (b'II*\0', b'MM\0*'):
+            return 'tiff'
+    lower = (name or '').lower()
+    if lower.endswith('.pdf'):
+        return 'pdf'
+    if lower.endswith(('.tif', '.tiff')):
+        return 'tiff'
+    return None
+
+def page_count(name, data):
+    """Number of pages in a PDF or TIFF document, or None if it cannot be read"""
+    kind = document_type(name, data)
+    try:
+        if kind == 'tiff':
+            with Image.open(io.BytesIO(data)) as document:
+                return getattr(document, 'n_frames', 1)
+        if kind == 'pdf':
+            if pypdfium2 is not None:
+                document = pypdfium2.PdfDocument(data)
+                try:
+                    return len(document)
+                finally:
+                    document.close()
+            if fitz is not None:
+                with fitz.open(stream=data, filetype='pdf') as document:
+                    return document.page_count
+    except Exception:
+        return None
+    return None
+
+def page_name(name, page):
+    """Sheet name of one page (the usual file.pdf#page=N fragment)"""
+    return f"{name}#page={page}"
+
+def iter_tiff_pages(data, dpi=DEFAULT_DPI):
+    """
+    Yield (page number, grayscale ndarray) for every frame of a TIFF.
+    Pages scanned above `dpi` are downscaled to it; lower ones are left as is.
+    """
+    with Image.open(io.BytesIO(data)) as document:
+        for number, page in enumerate(ImageSequence.Iterator(document), start=1):
+            gray = page.convert('L')
+            source_dpi = page.info.get('dpi', (0, 0))[0]
+            if dpi and source_dpi and source_dpi > dpi * 1.05:
+                scale = dpi / float(source_dpi)
+                size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+                gray = gray.resize(size, Image.BILINEAR, reducing_gap=2.0)
+            yield number, np.asarray(gray)
+
+def iter_pdf_pages(data, dpi=DEFAULT_DPI):
+    """Yield (page number, grayscale ndarray) for every page of a PDF, rendered at `dpi`"""
+    if pypdfium2 is not None:
+        document = pypdfium2.PdfDocument(data)
+        try:
+            for index in range(len(document)):
+                page = document[index]
+                bitmap = page.render(scale=dpi / 72.0, grayscale=True)
+                try:
+                    # Copy out of the native buffer before it is freed
+                    yield index + 1, np.array(bitmap.to_numpy())
+                finally:
+                    bitmap.close()
+                    page.close()
+        finally:
+            document.close()
+    elif fitz is not None:
+        with fitz.open(stream=data, filetype='pdf') as document:
+            for index, page in enumerate(document):
+                pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+                rows = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)
+                yield index + 1, rows[:, :pixmap.width].copy()
+    else:
+        raise RuntimeError('PDF documents require the pypdfium2 (or PyMuPDF) package')
+
+def iter_pages(name, data, dpi=DEFAULT_DPI):
+    """Yield (page number, grayscale ndarray) for a PDF or TIFF document"""
+    kind = document_type(name, data)
+    if kind == 'pdf':
+        return iter_pdf_pages(data, dpi)
+    if kind == 'tiff':
+        return iter_tiff_pages(data, dpi)
+    raise ValueError(f'Not a PDF or TIFF document: {name}')
+
+def expand_documents(sheets, dpi=DEFAULT_DPI):
+    """
+    Pass (name, bytes) sheets through, replacing each PDF or TIFF with its
+    pages as (name#page=N, ndarray). Pages are produced only as the
+    consumer asks for them. A document that cannot be read yields
+    (name, exception) in place of its remaining pages.
+    """
+    for name, data in sheets:
+        if document_type(name, data) is None:
+            yield name, data
+            continue
+        try:
+            for number, page in iter_pages(name, data, dpi):
+                yield page_name(name, number), page
+        except Exception as e:
+            yield name, e
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+OMR Scan Executor - Bounded process pool for CPU-bound scans
+Scans run in worker processes sized to the cores. At most
+`workers + queue_size` scans are admitted at once; beyond that submit()
+fails fast with ScanQueueFull so the web layer can answer 503 instead of
+slowing every request down together.
+"""
+
+import cv2
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+from omr_circle_scanner import OMRCircleScanner
+from omr_registration import RegistrarCache
+from omr_logging import configure_logging
+
+class ScanQueueFull(Exception):
+    """Raised when the executor already holds its maximum number of scans"""
+
+# Per-process state (each pool worker gets its own copy)
+_scanner = None
+
+def _init_worker(scanner, cv2_threads):
+    """
+    Pool worker initializer: pin OpenCV's internal thread pool so it does
+    not compete with the other workers, install the scanner and set up
+    logging (spawned workers start unconfigured)
+    """
+    global _scanner
+    configure_logging()
+    cv2.setNumThreads(cv2_threads)
+    _scanner = scanner
+
+def run_scan(source, template=None, debug=True, registrar=None, reuse_registration=False):
+    """
+    Scan one image in the current process (the pool's task function)
+    """
+    global _scanner
+    if _scanner is None:
+        _scanner = OMRCircleScanner()
+
+    options = {'debug': debug}
+    if registrar is not None:
+        options['registrar'] = registrar
+        options['reuse_registration'] = reuse_registration
+
+    if template is not None:
+        return _scanner.scan_template(source, template, **options)
+    return _scanner.scan_image(source, **options)
+
+def run_registered_scan(source, registrar, **options):
+    """
+    Pool task for registered scans. The session's PageRegistrar is sent
+    with the frame (its homography and thumbnail are a few KB) and comes
+    back updated next to the result, so whichever worker runs the next
+    frame can reuse the homography.
+    """
+    return run_scan(source, registrar=registrar, **options), registrar
+
+def run_tracked_scan(source, tracker):
+    """
+    Pool task for live video frames: decode the frame once, then follow the
+    session's bubbles with its BubbleTracker (a full detection on the same
+    decoded frame only when tracking is lost). The tracker travels like a
+    registrar and comes back updated next to the result.
+    """
+    global _scanner
+    if _scanner is None:
+        _scanner = OMRCircleScanner()
+
+    tracker.scanner = _scanner
+    frame = _scanner.prepare_image(source)
+    if frame is None:
+        return {'error': 'Could not load image'}, tracker
+    return tracker.update(frame), tracker
+
+class ScanExecutor:
+    """
+    Process pool with a bounded admission queue.
+    workers=0 runs scans inline in the calling thread (still bounded),
+    which is handy for local development.
+    """
+    def __init__(self, scanner=None, workers=None, queue_size=None, cv2_threads=1, registrars=None):
+        self.scanner = scanner or OMRCircleScanner()
+        # Page registrars per webcam session, kept in this process so they
+        # survive frames landing on different pool workers
+        self.registrars = registrars or RegistrarCache()
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = max(0, int(workers))
+        self.queue_size = self.workers * 2 if queue_size is None else max(0, int(queue_size))
+        self.cv2_threads = cv2_threads
+
+        self.capacity = max(1, self.workers + self.queue_size)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._pending = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Scans admitted but not yet finished (running + queued)"""
+        return self._pending
+
+    def _get_pool(self):
+        # Created lazily so each gunicorn worker builds its own pool after
+        # forking; 'spawn' avoids forking a multi-threaded server process
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.scanner, self.cv2_threads)
+                )
+            return self._pool
+
+    def _reset_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _run_inline(self, task, *args, **kwargs):
+        global _scanner
+        if _scanner is None:
+            _scanner = self.scanner
+        try:
+            return task(*args, **kwargs)
+        finally:
+            self._release()
+
+    def _stateful_result(self, future, state):
+        """
+        Future of the result alone; the state object (registrar or tracker)
+        the worker sent back is adopted by the local one first
+        """
+        outer = Future()
+
+        def done(inner):
+            try:
+                result, updated = inner.result()
+            except BaseException as e:
+                outer.set_exception(e)
+                return
+            state.adopt(updated)
+            outer.set_result(result)
+
+        future.add_done_callback(done)
+        return outer
+
+    def submit(self, source, register=False, session=None, tracker=None, **options):
+        """
+        Queue a scan and return a Future for its result dict.
+        register=True warps the page to its canonical size first, reusing
+        the session's homography while the camera is still. A BubbleTracker
+        scans the frame as the next one of its video stream instead.
+        Raises ScanQueueFull when the executor is at capacity.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise ScanQueueFull(f'{self.capacity} scans already in progress')
+        with self._lock:
+            self._pending += 1
+
+        task = run_scan
+        state = None
+        if tracker is not None:
+            task = run_tracked_scan
+            state = tracker
+            options = {'tracker': tracker}
+        elif register:
+            task = run_registered_scan
+            state = self.registrars.get(session)
+            options['registrar'] = state
+            options['reuse_registration'] = bool(session)
+
+        if self.workers == 0:
+            future = Future()
+            try:
+                future.set_result(self._run_inline(task, source, **options))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            try:
+                pool = self._get_pool()
+                try:
+                    future = pool.submit(task, source, **options)
+                except BrokenProcessPool:
+                    # A worker died (e.g. out of memory) - start a fresh pool once
+                    self._reset_pool(pool)
+                    future = self._get_pool().submit(task, source, **options)
+            except Exception:
+                self._release()
+                raise
+
+            future.add_done_callback(self._release)
+
+        if state is not None:
+            return self._stateful_result(future, state)
+        return future
+
+    def run(self, source, timeout=None, **options):
+        """Submit a scan and wait for its result"""
+        return self.submit(source, **options).result(timeout=timeout)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
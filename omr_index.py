@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+OMR Results Index - Queryable record of every scan
+Each scan's outcome (per-circle fill percentages and verdicts, timings,
+source and the fill classifier that produced them) is written to an
+SQLite database in WAL mode, so dashboards can ask for item totals over a
+time range without opening result files. Inserts are batched on a
+background thread, off the request path, which also deletes scans older
+than the retention period. Re-uploads answered from the result cache are
+listed but left out of item totals.
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# In its own sub-folder: LocalStorage evicts files directly under results/
+# by age and size, and an SQLite file's mtime only moves at checkpoints
+INDEX_PATH = os.path.join('results', 'index', 'index.db')
+_LEGACY_INDEX_PATH = os.path.join('results', 'index.db')
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    filename TEXT,
+    template TEXT,
+    total_circles INTEGER NOT NULL,
+    total_selected INTEGER NOT NULL,
+    scan_ms REAL,
+    total_ms REAL,
+    cached INTEGER NOT NULL DEFAULT 0,
+    classifier TEXT
+);
+CREATE INDEX IF NOT EXISTS scans_created_at ON scans (created_at);
+
+CREATE TABLE IF NOT EXISTS circles (
+    scan_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    item TEXT NOT NULL,
+    is_shaded INTEGER NOT NULL,
+    fill_percent REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS circles_item_time ON circles (item, created_at);
+CREATE INDEX IF NOT EXISTS circles_time ON circles (created_at);
+CREATE INDEX IF NOT EXISTS circles_scan ON circles (scan_id);
+"""
+
+# Columns added since the first schema: (table, column, definition)
+_ADDED_COLUMNS = (
+    # Fill classifier of the scan: 'fixed' and 'adaptive' fill percentages
+    # are not comparable (NULL for scans indexed before it was recorded)
+    ('scans', 'classifier', 'TEXT'),
+)
+
+def _add_columns(connection):
+    """Bring an index created by an older version up to the current schema"""
+    for table, column, definition in _ADDED_COLUMNS:
+        columns = {row[1] for row in connection.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def _move_legacy_index(path):
+    """Move an index left at the old results/index.db location to `path`"""
+    if os.path.exists(path) or not os.path.exists(_LEGACY_INDEX_PATH):
+        return
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(_LEGACY_INDEX_PATH + suffix):
+            os.replace(_LEGACY_INDEX_PATH + suffix, path + suffix)
+    logger.info("Moved results index from %s to %s", _LEGACY_INDEX_PATH, path)
+
+class ResultsIndex:
+    """
+    SQLite-backed scan index. record() only queues; a writer thread
+    inserts queued scans in batches, one transaction per batch, and every
+    sweep_interval deletes scans older than max_age_seconds (0 = keep all).
+    """
+    def __init__(self, path=INDEX_PATH, max_pending=10000, batch_size=200,
+                 max_age_seconds=7 * 24 * 3600, sweep_interval=3600):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_age_seconds = max_age_seconds
+        self.sweep_interval = sweep_interval
+        self.dropped = 0
+        self._last_sweep = 0
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writer = None
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if self.path == INDEX_PATH:
+            _move_legacy_index(self.path)
+        # Not kept: the app may be preloaded in the gunicorn master, and
+        # SQLite connections must not cross a fork
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(_SCHEMA)
+            _add_columns(connection)
+        finally:
+            connection.close()
+
+    @property
+    def pending(self):
+        """Scans queued but not yet written"""
+        return self._queue.qsize()
+
+    def _connect(self):
+        # One connection per thread; WAL lets readers run alongside the writer
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def record(self, scan_id, result, source, filename=None, scan_ms=None,
+               total_ms=None, cached=False, created_at=None):
+        """Queue one scan result (a scanner result dict) for indexing"""
+        circles = [
+            (scan_id, c['item'], bool(c['is_shaded']), float(c['fill_percent']))
+            for c in result.get('circles', [])
+        ]
+        scan = (
+            scan_id,
+            created_at or time.time(),
+            source,
+            filename,
+            result.get('template'),
+            int(result.get('total_circles', len(circles))),
+            int(result.get('total_selected', sum(1 for c in circles if c[2]))),
+            scan_ms,
+            total_ms,
+            int(bool(cached)),
+            result.get('fill_classifier')
+        )
+        try:
+            self._queue.put_nowait((scan, circles))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Results index queue full, dropped scan: %s", scan_id)
+            return
+        self._ensure_writer()
+
+    def _ensure_writer(self):
+        # Started lazily so it runs in the serving process, not the gunicorn master
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name='omr-index-writer', daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._insert(batch)
+                if time.time() - self._last_sweep > self.sweep_interval:
+                    self.sweep()
+            except Exception as e:
+                logger.error("Results index write failed (%d scans): %s", len(batch), e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _insert(self, batch):
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO scans (id, created_at, source, filename, template, total_circles, total_selected, '
+                'scan_ms, total_ms, cached, classifier) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [scan for scan, _ in batch]
+            )
+            connection.executemany(
+                'INSERT INTO circles VALUES (?, ?, ?, ?, ?)',
+                [
+                    (scan_id, scan[1], item, int(is_shaded), fill_percent)
+                    for scan, circles in batch
+                    for scan_id, item, is_shaded, fill_percent in circles
+                ]
+            )
+
+    def sweep(self):
+        """Delete scans (and their circles) older than max_age_seconds"""
+        self._last_sweep = time.time()
+        if not self.max_age_seconds:
+            return
+        cutoff = self._last_sweep - self.max_age_seconds
+        connection = self._connect()
+        with connection:
+            connection.execute('DELETE FROM circles WHERE created_at < ?', (cutoff,))
+            removed = connection.execute('DELETE FROM scans WHERE created_at < ?', (cutoff,)).rowcount
+        if removed:
+            logger.info("Results index retention: removed %d scans", removed)
+
+    def flush(self):
+        """Block until every queued scan has been written"""
+        self._queue.join()
+
+    def scans(self, since=None, until=None, item=None, source=None, classifier=None, limit=100):
+        """
+        Scans in a time range (newest first), optionally only those where
+        `item` was selected. Each scan lists its selected items.
+        """
+        where, params = ['1=1'], []
+        if since is not None:
+            where.append('s.created_at >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('s.created_at < ?')
+            params.append(until)
+        if source:
+            where.append('s.source = ?')
+            params.append(source)
+        if classifier:
+            where.append('s.classifier = ?')
+            params.append(classifier)
+        if item:
+            where.append('EXISTS (SELECT 1 FROM circles f WHERE f.scan_id = s.id AND f.item = ? AND f.is_shaded = 1)')
+            params.append(item)
+        params.append(int(limit))
+
+        connection = self._connect()
+        rows = connection.execute(
+            f"""
+            SELECT s.*, (SELECT group_concat(c.item, char(31)) FROM circles c
+                         WHERE c.scan_id = s.id AND c.is_shaded = 1) AS selected
+            FROM scans s WHERE {' AND '.join(where)}
+            ORDER BY s.created_at DESC LIMIT ?
+            """,
+            params
+        ).fetchall()
+
+        scans = []
+        for row in rows:
+            scan = dict(row)
+            scan['cached'] = bool(scan['cached'])
+            scan['selected'] = scan['selected'].split('\x1f') if scan['selected'] else []
+            scans.append(scan)
+        return scans
+
+    def item_counts(self, since=None, until=None, source=None, classifier=None):
+        """
+        Per-item totals over a time range: times selected, times scanned and
+        the average fill of selected bubbles. Totals are kept apart per fill
+        classifier, whose fill percentages do not mean the same thing.
+        Re-uploads answered from the result cache are not counted again.
+        """
+        where, params = ['s.cached = 0'], []
+        if since is not None:
+            where.append('c.created_at >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('c.created_at < ?')
+            params.append(until)
+        if source:
+            where.append('s.source = ?')
+            params.append(source)
+        if classifier:
+            where.append('s.classifier = ?')
+            params.append(classifier)
+
+        connection = self._connect()
+        rows = connection.execute(
+            f"""
+            SELECT c.item AS item,
+                   s.classifier AS classifier,
+                   SUM(c.is_shaded) AS selected,
+                   COUNT(*) AS scanned,
+                   AVG(CASE WHEN c.is_shaded THEN c.fill_percent END) AS avg_fill_percent
+            FROM circles c JOIN scans s ON s.id = c.scan_id
+            WHERE {' AND '.join(where)}
+            GROUP BY c.item, s.classifier
+            ORDER BY selected DESC, c.item
+            """,
+            params
+        ).fetchall()
+
+        counts = []
+        for row in rows:
+            count = dict(row)
+            if count['avg_fill_percent'] is not None:
+                count['avg_fill_percent'] = round(count['avg_fill_percent'], 1)
+            counts.append(count)
+        return counts
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+OMR Scan Jobs - Asynchronous submit / poll / fetch API
+A job is accepted immediately and scanned in the background by the
+ScanExecutor. Job status and results are kept as small JSON files so any
+server worker process can answer a poll, and the uploaded image is kept
+until the job succeeds so failed jobs can be retried without re-uploading.
+
+The waiting queue lives in the memory of the process that accepted the
+job, so every job records its owner. The owner refreshes the status file
+of every job it still holds (waiting, in the executor's queue or
+scanning) several times per `stale_seconds`. Jobs whose owner process has
+exited (a recycled or crashed gunicorn worker), or that have not been
+refreshed for longer than `stale_seconds`, are picked up again by
+whichever process next polls them or sweeps the folder.
+"""
+
+import json
+import logging
+import os
+import queue
+import re
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from omr_executor import ScanQueueFull
+
+JOBS_FOLDER = os.path.join('results', 'jobs')
+
+logger = logging.getLogger(__name__)
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+_HOST = socket.gethostname()
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # Exists but belongs to someone else
+    return True
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are waiting to be dispatched"""
+
+class JobManager:
+    """
+    Accepts scan jobs, dispatches them to the executor from a background
+    thread (absorbing bursts beyond the executor's own queue) and records
+    their progress on disk. `on_result(job, result)` is called for every
+    successful scan.
+    """
+    def __init__(self, executor, folder=JOBS_FOLDER, resolve_template=None,
+                 max_waiting=1000, max_attempts=3, ttl_seconds=24 * 3600, on_result=None,
+                 stale_seconds=60):
+        self.executor = executor
+        self.folder = folder
+        self.resolve_template = resolve_template
+        self.on_result = on_result
+        self.max_attempts = max_attempts
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+
+        self._waiting = queue.Queue(maxsize=max_waiting)
+        self._dispatcher = None
+        self._heartbeat = None
+        # Jobs this process holds until they finish: job id -> job
+        self._active = {}
+        self._lock = threading.Lock()
+        # Serializes status writes, so a status written right after a job is
+        # queued cannot overwrite the dispatcher's newer one
+        self._status_lock = threading.RLock()
+        self._last_prune = 0
+
+        os.makedirs(self.folder, exist_ok=True)
+
+    @property
+    def owner(self):
+        """This process as recorded on the jobs it queues (read per call: gunicorn forks after import)"""
+        return f"{_HOST}:{os.getpid()}"
+
+    @property
+    def waiting(self):
+        """Jobs accepted but not yet handed to the executor"""
+        return self._waiting.qsize()
+
+    def _status_path(self, job_id):
+        return os.path.join(self.folder, f"{job_id}.json")
+
+    def _input_path(self, job_id):
+        return os.path.join(self.folder, f"{job_id}.input")
+
+    def _write(self, job):
+        with self._status_lock:
+            job['updated_at'] = datetime.now().isoformat()
+            path = self._status_path(job['id'])
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(job, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, path)  # Atomic, so readers never see a partial file
+
+    def _read(self, job_id):
+        try:
+            with open(self._status_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, job_id):
+        """Return a job's status dict, or None if unknown"""
+        if not _JOB_ID.match(job_id or ''):
+            return None
+        self.prune()
+        job = self._read(job_id)
+        if job is not None and self._is_stale(job):
+            job = self._recover(job)
+        return job
+
+    def _is_stale(self, job):
+        """
+        True for a queued or running job that no live process will finish:
+        its owner exited (same host), or stopped refreshing it
+        """
+        if job['status'] not in ('queued', 'running'):
+            return False
+        owner = job.get('owner') or ''
+        if owner == self.owner:
+            return False  # Still in this process's queue or executor
+
+        host, _, pid = owner.rpartition(':')
+        if host == _HOST and pid.isdigit() and not _process_alive(int(pid)):
+            return True
+        try:
+            age = (datetime.now() - datetime.fromisoformat(job['updated_at'])).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            return True
+        return age > self.stale_seconds
+
+    def _recover(self, job):
+        """
+        Take over a stale job: queue it here again, or fail it once its
+        attempts are used up. Returns the job's new status.
+        """
+        # Only one process may take over a given stale state: the claim
+        # file is named after it and created exclusively
+        stamp = re.sub(r'[^0-9]', '', str(job.get('updated_at')))
+        claim = os.path.join(self.folder, f"{job['id']}.{stamp}.claim")
+        try:
+            os.close(os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return self._read(job['id']) or job
+        except OSError:
+            return job
+
+        logger.warning("Recovering stale job %s (%s, owner %s)", job['id'], job['status'], job.get('owner'),
+                       extra={'job_id': job['id']})
+        error = f"Worker lost while the job was {job['status']}"
+        if job['attempts'] >= self.max_attempts or not os.path.exists(self._input_path(job['id'])):
+            job['status'] = 'failed'
+            job['error'] = error
+            self._write(job)
+            return job
+
+        job['status'] = 'queued'
+        job['error'] = error
+        job['owner'] = self.owner
+        try:
+            with self._status_lock:
+                self._enqueue(job)
+                self._write(job)
+        except JobQueueFull:
+            # Leave it stale: the next poll or sweep tries again
+            os.remove(claim)
+            return self._read(job['id'])
+        return job
+
+    def prune(self, force=False):
+        """
+        Delete job files older than the TTL and take over stale jobs
+        (at most once a minute)
+        """
+        now = time.time()
+        if not force and now - self._last_prune < 60:
+            return
+        self._last_prune = now
+
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+
+            job_id, ext = os.path.splitext(name)
+            if ext == '.json' and _JOB_ID.match(job_id):
+                job = self._read(job_id)
+                if job is not None and self._is_stale(job):
+                    self._recover(job)
+
+    def submit(self, image_bytes, options=None):
+        """
+        Accept a job and return its initial status.
+        `options` may contain template (name), register and session.
+        Raises JobQueueFull when the dispatch backlog is full.
+        """
+        self.prune()
+
+        job_id = uuid.uuid4().hex
+        with open(self._input_path(job_id), 'wb') as f:
+            f.write(image_bytes)
+
+        now = datetime.now().isoformat()
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'created_at': now,
+            'attempts': 0,
+            'options': dict(options or {}),
+            'error': None,
+            'result': None,
+            'owner': self.owner
+        }
+        try:
+            with self._status_lock:
+                self._enqueue(job)
+                self._write(job)
+        except JobQueueFull:
+            os.remove(self._input_path(job_id))
+            raise
+        return job
+
+    def retry(self, job_id):
+        """Re-queue a failed job from its stored upload. Returns the job or None."""
+        job = self.get(job_id)
+        if job is None or job['status'] != 'failed' or not os.path.exists(self._input_path(job_id)):
+            return None
+
+        job['status'] = 'queued'
+        job['attempts'] = 0
+        job['error'] = None
+        job['owner'] = self.owner
+        # Queue first: if the backlog is full the job is still 'failed' on
+        # disk and can be retried again. The status lock keeps the
+        # dispatcher's 'running' from being overwritten by this 'queued'.
+        with self._status_lock:
+            self._enqueue(job)
+            self._write(job)
+        return job
+
+    def _enqueue(self, job):
+        try:
+            self._waiting.put_nowait(job)
+        except queue.Full:
+            raise JobQueueFull(f'{self._waiting.maxsize} jobs already waiting')
+        with self._lock:
+            self._active[job['id']] = job
+        self._ensure_dispatcher()
+
+    def _release(self, job):
+        with self._lock:
+            self._active.pop(job['id'], None)
+
+    def _ensure_dispatcher(self):
+        # Started lazily so they run in the serving process, not the gunicorn master
+        with self._lock:
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name='omr-job-dispatcher', daemon=True)
+                self._dispatcher.start()
+            if self._heartbeat is None or not self._heartbeat.is_alive():
+                self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='omr-job-heartbeat', daemon=True)
+                self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        # Rewriting a job's status moves its updated_at, which tells other
+        # processes it is still held here however long it waits
+        while True:
+            time.sleep(self.stale_seconds / 4)
+            with self._lock:
+                jobs = list(self._active.values())
+            for job in jobs:
+                try:
+                    with self._status_lock:
+                        if job['status'] in ('queued', 'running') and job['id'] in self._active:
+                            self._write(job)
+                except Exception as e:
+                    logger.error("Job heartbeat failed for %s: %s", job['id'], e)
+
+    def _dispatch_loop(self):
+        while True:
+            job = self._waiting.get()
+            try:
+                self._dispatch(job)
+            except Exception as e:
+                self._fail(job, f'Dispatch failed: {e}')
+
+    def _dispatch(self, job):
+        with open(self._input_path(job['id']), 'rb') as f:
+            image_bytes = f.read()
+
+        options = dict(job['options'])
+        template_name = options.pop('template', None)
+        if template_name:
+            template = self.resolve_template(template_name) if self.resolve_template else None
+            if template is None:
+                self._fail(job, f'Unknown template: {template_name}', retry=False)
+                return
+            options['template'] = template
+
+        # Wait for room in the executor instead of rejecting the job
+        while True:
+            try:
+                future = self.executor.submit(image_bytes, debug=False, **options)
+                break
+            except ScanQueueFull:
+                time.sleep(0.05)
+
+        job['status'] = 'running'
+        job['attempts'] += 1
+        self._write(job)
+        future.add_done_callback(lambda f: self._finish(job, f))
+
+    def _finish(self, job, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            self._fail(job, f'Scan failed: {e}')
+            return
+
+        if 'error' in result:
+            self._fail(job, result['error'], retry=False)
+            return
+
+        result.pop('debug_image', None)
+        job['status'] = 'done'
+        job['result'] = result
+        self._write(job)
+        self._release(job)
+
+        if self.on_result is not None:
+            try:
+                self.on_result(job, result)
+            except Exception as e:
+                logger.error("Job result hook failed for %s: %s", job['id'], e)
+
+        try:
+            os.remove(self._input_path(job['id']))
+        except OSError:
+            pass
+
+    def _fail(self, job, error, retry=True):
+        if retry and job['attempts'] < self.max_attempts:
+            job['status'] = 'queued'
+            job['error'] = error
+            self._write(job)
+            try:
+                self._waiting.put_nowait(job)
+                return
+            except queue.Full:
+                pass
+
+        job['status'] = 'failed'
+        job['error'] = error
+        self._write(job)
+        self._release(job)
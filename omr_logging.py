@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+OMR Logging - Structured JSON logs written off the request thread
+Records are put on a bounded in-memory queue and formatted and written by
+a listener thread, so logging never blocks a request on stdout/stderr.
+Every record carries the current request ID and any `extra` fields.
+
+Environment variables:
+    LOG_LEVEL    minimum level (debug, info, warning, error; default info)
+    LOG_FORMAT   json (default) or text
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+# Request ID of the code currently running (set per HTTP request)
+request_id = contextvars.ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else came from `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamp records with the request ID (runs on the calling thread, before
+    the record is queued)
+    """
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message, request_id and
+    any extra fields
+    """
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler whose listener thread is started lazily in each process
+    (threads do not survive the gunicorn fork). When the queue is full,
+    records are dropped and counted instead of blocking the caller.
+    """
+    def __init__(self, handler, max_queue=10000):
+        super().__init__(queue.Queue(max_queue))
+        self.handler = handler
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.max_queue)
+            self._listener = logging.handlers.QueueListener(self.queue, self.handler, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self._listener.stop)
+
+    def prepare(self, record):
+        # Merge args and render tracebacks now, but keep the message and the
+        # exception apart for the JSON formatter
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def configure_logging(level=None, fmt=None, stream=None):
+    """
+    Route the root logger through an AsyncLogHandler (idempotent).
+    Logs go to stderr so stdout stays free for program output (e.g. the
+    batch CLI's JSON Lines).
+    """
+    level = (level or os.environ.get('LOG_LEVEL', 'info')).upper()
+    fmt = (fmt or os.environ.get('LOG_FORMAT', 'json')).lower()
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers:
+        if isinstance(handler, AsyncLogHandler):
+            return handler
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'))
+
+    handler = AsyncLogHandler(output)
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+    return handler
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+OMR Metrics - Prometheus-style counters, gauges and histograms
+A small in-process registry rendered in the Prometheus text exposition
+format at /metrics. Scan stages that run in pool workers report their
+timings inside the scan result and are observed here by the web process.
+
+Gunicorn runs several worker processes and a scrape reaches only one of
+them, so a shared registry writes its values to a folder every few
+seconds and a scrape merges the files of all processes: counters and
+histograms are summed (those of exited workers are folded into an archive
+file so they never go backwards), gauges are summed over live processes.
+"""
+
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows: exited processes' files are then kept, not archived
+    fcntl = None
+
+METRICS_FOLDER = os.path.join('results', 'metrics')
+
+logger = logging.getLogger(__name__)
+
+_HOST = socket.gethostname()
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # Exists but belongs to someone else
+    return True
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # Unlabelled metrics may instead be read from a callback at scrape time
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self, values=None):
+        """Exposition lines for `values` (default: this process's own)"""
+        if values is None:
+            values = self.snapshot()
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples(values))
+        return lines
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        """Current values by label key (a callback is read now)"""
+        if self.callback is not None:
+            try:
+                return {(): self.callback()}
+            except Exception:
+                return {}
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, values, key, value):
+        """Add another process's value for `key` into `values`"""
+        values[key] = values.get(key, 0) + value
+
+    def _samples(self, values):
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in sorted(values.items())]
+
+class Gauge(Counter):
+    """
+    Current value, either set explicitly or read from a callback at scrape time
+    """
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    """
+    Cumulative bucket counts plus sum and count of observations
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {key: [[*counts], total, count] for key, (counts, total, count) in self._values.items()}
+
+    def merge(self, values, key, value):
+        counts, total, count = value
+        if len(counts) != len(self.buckets):
+            return  # Written with other buckets (an older deployment)
+        series = values.get(key)
+        if series is None:
+            values[key] = [[*counts], total, count]
+            return
+        series[0] = [a + b for a, b in zip(series[0], counts)]
+        series[1] += total
+        series[2] += count
+
+    def _samples(self, values):
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, ('le', _format_value(float(bound))))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(float(total))}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+class MetricsRegistry:
+    """
+    Named metrics rendered together for a scrape. After share(folder) the
+    values of every process using that folder are rendered together.
+    """
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+        self.folder = None
+        self.flush_interval = 5
+        self._writer_pid = None
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=(), callback=None):
+        return self._add(Counter(name, documentation, labels, callback))
+
+    def gauge(self, name, documentation, labels=(), callback=None):
+        return self._add(Gauge(name, documentation, labels, callback))
+
+    def histogram(self, name, documentation, buckets, labels=()):
+        return self._add(Histogram(name, documentation, buckets, labels))
+
+    def share(self, folder=METRICS_FOLDER, flush_interval=5):
+        """
+        Aggregate across processes through `folder`. Each process writes its
+        values there every `flush_interval` seconds, on exit and before it
+        renders; the writer starts in every forked child (gunicorn workers),
+        not in the process that calls share() (the preloading master).
+        """
+        first = self.folder is None
+        self.folder = folder
+        self.flush_interval = flush_interval
+        os.makedirs(folder, exist_ok=True)
+        if first:
+            os.register_at_fork(after_in_child=self._start_writer)
+
+    def _path(self):
+        return os.path.join(self.folder, f"{_HOST}-{os.getpid()}.json")
+
+    def _start_writer(self):
+        with self._lock:
+            if self.folder is None or self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+
+        # A file under this PID was left by an exited process that had it before
+        if os.path.exists(self._path()):
+            with self._locked_folder():
+                self._archive([self._path()])
+
+        atexit.register(self._write)
+        threading.Thread(target=self._write_loop, name='omr-metrics-writer', daemon=True).start()
+
+    def _write_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self._write()
+            except Exception as e:
+                logger.warning("Could not write metrics: %s", e)
+
+    def _write(self):
+        """Write this process's values to its file in the shared folder"""
+        with self._lock:
+            metrics = list(self._metrics)
+        values = {metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+                  for metric in metrics}
+        path = self._path()
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'host': _HOST, 'pid': os.getpid(), 'metrics': values}, f)
+        os.replace(tmp_path, path)  # Atomic, so a scrape never reads a partial file
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _locked_folder(self):
+        """Exclusive lock on the folder while exited processes' files are archived"""
+        return _FolderLock(os.path.join(self.folder, '.lock'))
+
+    def _exited(self, data, mtime):
+        """True when the process that wrote a metrics file is gone"""
+        if data.get('host') == _HOST:
+            return data.get('pid') != os.getpid() and not _process_alive(int(data.get('pid', 0)))
+        # Another host (e.g. a previous container): live writers refresh every flush_interval
+        return time.time() - mtime > max(60, 10 * self.flush_interval)
+
+    def _merge(self, totals, data, gauges=True):
+        with self._lock:
+            by_name = {metric.name: metric for metric in self._metrics}
+        for name, items in (data.get('metrics') or {}).items():
+            metric = by_name.get(name)
+            if metric is None or (metric.kind == 'gauge' and not gauges):
+                continue
+            values = totals.setdefault(name, {})
+            for key, value in items:
+                metric.merge(values, tuple(key), value)
+
+    def _archive(self, paths):
+        """Fold the counters and histograms of exited processes' files into archive.json"""
+        archive_path = os.path.join(self.folder, 'archive.json')
+        totals = {}
+        for path in [archive_path, *paths]:
+            data = self._read(path)
+            if data is not None:
+                self._merge(totals, data, gauges=False)
+
+        values = {name: [[list(key), value] for key, value in items.items()] for name, items in totals.items()}
+        tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'metrics': values}, f)
+        os.replace(tmp_path, archive_path)
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _render_shared(self):
+        self._start_writer()
+        self._write()
+
+        with self._locked_folder():
+            live, exited = [], []
+            for entry in os.scandir(self.folder):
+                if not entry.name.endswith('.json') or entry.name == 'archive.json':
+                    continue
+                data = self._read(entry.path)
+                if data is None:
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                if self._exited(data, mtime):
+                    exited.append(entry.path)
+                else:
+                    live.append(data)
+            if exited and fcntl is not None:
+                self._archive(exited)
+                exited = []
+
+            totals = {}
+            archive = self._read(os.path.join(self.folder, 'archive.json'))
+            for data in [archive or {}, *live]:
+                self._merge(totals, data)
+            for path in exited:
+                self._merge(totals, self._read(path) or {}, gauges=False)
+        return totals
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics)
+        totals = self._render_shared() if self.folder else None
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(None if totals is None else totals.get(metric.name, {})))
+        return '\n'.join(lines) + '\n'
+
+class _FolderLock:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            self._file.close()  # Releases the lock
+            self._file = None
+
+# Process-wide registry and the scan metrics every module reports into
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'omr_scan_stage_seconds', 'Time spent in each scan pipeline stage',
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    labels=('stage',)
+)
+CIRCLES_PER_IMAGE = REGISTRY.histogram(
+    'omr_scan_circles', 'Circles found per scanned image',
+    (0, 1, 5, 10, 20, 50, 100, 200, 500)
+)
+IMAGE_MEGAPIXELS = REGISTRY.histogram(
+    'omr_scan_image_megapixels', 'Size of scanned images in megapixels',
+    (0.1, 0.3, 0.5, 1, 2, 4, 8, 12, 16, 24, 48)
+)
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+def observe_scan(result):
+    """Record the stage timings, circle count and image size a scan reports"""
+    for stage, ms in (result.get('timings') or {}).items():
+        STAGE_SECONDS.observe(ms / 1000.0, stage=stage)
+    if 'total_circles' in result:
+        CIRCLES_PER_IMAGE.observe(result['total_circles'])
+    if result.get('megapixels'):
+        IMAGE_MEGAPIXELS.observe(result['megapixels'])
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+OMR Page Registration - Perspective correction for phone/webcam photos
+Finds the page outline, computes a homography and warps the sheet to a
+fixed canonical resolution so detection parameters work at one scale.
+"""
+
+import cv2
+import json
+import numpy as np
+import threading
+from collections import OrderedDict
+
+# Canonical page size (width, height) - US letter at 100 DPI
+CANONICAL_SIZE = (850, 1100)
+
+# Longest side used when searching for the page outline
+OUTLINE_SEARCH_SIDE = 500
+
+def canonical_hough_params(canonical_size=CANONICAL_SIZE):
+    """
+    HoughCircles parameters for pages warped to `canonical_size`. The
+    scale is known, so the radius range only has to cover real order-form
+    bubbles (about 6-18 mm across: 12-36 px at the default 100 DPI) instead
+    of the generic 15-60 px, which keeps the search tight and its cost
+    predictable. Other canonical sizes scale with their width.
+    """
+    scale = canonical_size[0] / float(CANONICAL_SIZE[0])
+    return {
+        'dp': 1,
+        'minDist': max(1, int(round(30 * scale))),   # Bubbles are at least a diameter apart
+        'param1': 80,
+        'param2': 25,
+        'minRadius': max(1, int(round(12 * scale))),
+        'maxRadius': max(2, int(round(36 * scale)))
+    }
+
+def registration_fingerprint(canonical_size=CANONICAL_SIZE):
+    """Stable string of the registration settings that affect scan results (for cache keys)"""
+    return json.dumps({
+        'canonical_size': list(canonical_size),
+        'hough_params': canonical_hough_params(canonical_size)
+    }, sort_keys=True)
+
+def order_corners(points):
+    """
+    Order four points as top-left, top-right, bottom-right, bottom-left
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)],   # top-left has the smallest x + y
+        points[np.argmin(diffs)],  # top-right has the smallest y - x
+        points[np.argmax(sums)],   # bottom-right has the largest x + y
+        points[np.argmax(diffs)]   # bottom-left has the largest y - x
+    ], dtype=np.float32)
+
+def find_page_quad(gray, min_area_ratio=0.2):
+    """
+    Locate the page as the largest convex quadrilateral in the image.
+    The search runs on a small copy; corners are returned in full-resolution
+    coordinates (ordered TL, TR, BR, BL), or None if no page is found.
+    """
+    height, width = gray.shape[:2]
+    scale = min(1.0, OUTLINE_SEARCH_SIDE / float(max(height, width)))
+    small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    blurred = cv2.GaussianBlur(small, (5, 5), 0)
+    edges = cv2.Canny(blurred, 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = min_area_ratio * small.shape[0] * small.shape[1]
+
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+        if cv2.contourArea(contour) < min_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return order_corners(approx.reshape(4, 2) / scale)
+
+    return None
+
+class PageRegistrar:
+    """
+    Warps sheets to a canonical size. For webcam sessions the previous
+    frame's homography is reused while the scene stays still, so the page
+    search only reruns when the camera or page moves.
+    """
+    def __init__(self, canonical_size=CANONICAL_SIZE, hough_params=None, motion_threshold=6.0):
+        self.canonical_size = (int(canonical_size[0]), int(canonical_size[1]))
+        # HoughCircles parameters tuned for the canonical scale
+        if hough_params is None:
+            hough_params = canonical_hough_params(self.canonical_size)
+        self.hough_params = hough_params
+        # Mean absolute thumbnail difference above which the cached
+        # homography is considered stale
+        self.motion_threshold = motion_threshold
+
+        self.homography = None
+        self._thumbnail = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Registrars travel to scan worker processes and back; the lock stays behind
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def adopt(self, other):
+        """Take over the homography a copy of this registrar computed (e.g. in a scan worker)"""
+        if other is self:
+            return
+        with self._lock:
+            self.homography = other.homography
+            self._thumbnail = other._thumbnail
+
+    def _thumb(self, gray):
+        return cv2.resize(gray, (64, 48), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def compute_homography(self, gray):
+        """
+        Homography from the image to the canonical page, or None
+        """
+        quad = find_page_quad(gray)
+        if quad is None:
+            return None
+
+        width, height = self.canonical_size
+        target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+        return cv2.getPerspectiveTransform(quad, target)
+
+    def register(self, frame, reuse=False, warp_color=True):
+        """
+        Register a frame from OMRCircleScanner.prepare_image().
+        Returns a new frame with the warped 'image'/'gray' and a
+        'registration' summary; if no page is found the original frame is
+        returned (marked unregistered).
+        """
+        gray = frame['gray']
+        thumbnail = self._thumb(gray)
+
+        reused = False
+        homography = None
+        with self._lock:
+            if reuse and self.homography is not None and self._thumbnail is not None:
+                if np.mean(np.abs(thumbnail - self._thumbnail)) < self.motion_threshold:
+                    homography = self.homography
+                    reused = True
+
+        if homography is None:
+            homography = self.compute_homography(gray)
+
+        with self._lock:
+            self.homography = homography
+            self._thumbnail = thumbnail
+
+        if homography is None:
+            registered = dict(frame)
+            registered['registration'] = {'registered': False, 'reused': False}
+            return registered
+
+        size = self.canonical_size
+        warped_gray = cv2.warpPerspective(gray, homography, size, flags=cv2.INTER_LINEAR)
+        if warp_color and frame['image'] is not gray:
+            warped_image = cv2.warpPerspective(frame['image'], homography, size, flags=cv2.INTER_LINEAR)
+        else:
+            warped_image = warped_gray
+
+        registered = {
+            'image': warped_image,
+            'gray': warped_gray,
+            'registration': {
+                'registered': True,
+                'reused': reused,
+                'canonical_size': list(size),
+                'homography': homography.tolist()
+            }
+        }
+        if self.hough_params:
+            registered['hough_params'] = self.hough_params
+        return registered
+
+class RegistrarCache:
+    """
+    Bounded LRU of PageRegistrars keyed by webcam session ID
+    """
+    def __init__(self, max_sessions=256, canonical_size=CANONICAL_SIZE, hough_params=None):
+        self.max_sessions = max_sessions
+        self.canonical_size = canonical_size
+        self.hough_params = hough_params or canonical_hough_params(canonical_size)
+        self._registrars = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _new_registrar(self):
+        return PageRegistrar(self.canonical_size, hough_params=self.hough_params)
+
+    def get(self, session_id):
+        """Return the registrar for a session (a fresh one when no session)"""
+        if not session_id:
+            return self._new_registrar()
+
+        with self._lock:
+            registrar = self._registrars.pop(session_id, None)
+            if registrar is None:
+                registrar = self._new_registrar()
+            self._registrars[session_id] = registrar
+            while len(self._registrars) > self.max_sessions:
+                self._registrars.popitem(last=False)
+        return registrar
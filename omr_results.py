@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+OMR Results - Typed scan result model and fast serialization
+Scan results are wrapped once in slotted dataclasses holding plain Python
+values, serialized in a single pass straight to JSON bytes (with orjson
+when it is installed), or packed into a compact binary form whose circle
+table is a fixed-size record array.
+"""
+
+import json
+import struct
+from dataclasses import dataclass, field
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; the stdlib encoder produces the same JSON
+    orjson = None
+
+BINARY_MIMETYPE = 'application/vnd.omr-result'
+BINARY_MAGIC = b'OMRB'
+BINARY_VERSION = 2
+
+# Binary header: magic, version, flags (bit 0 = page registered), circle count
+_HEADER = struct.Struct('<4sHHI')
+
+# One fixed-size record per circle, little-endian and unpadded
+CIRCLE_DTYPE = np.dtype([
+    ('x', '<i4'),
+    ('y', '<i4'),
+    ('radius', '<i4'),
+    ('is_shaded', 'u1'),
+    ('ambiguous', 'u1'),
+    ('fill_percent', '<f4'),
+    ('mean_intensity', '<f4'),
+    ('median_intensity', '<f4'),
+    ('confidence', '<f4')
+])
+
+def _default(obj):
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, tuple):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def dumps(obj):
+    """Serialize to UTF-8 JSON bytes in one pass (result models included)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_PASSTHROUGH_DATACLASS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+@dataclass(slots=True)
+class CircleResult:
+    """
+    One analyzed bubble
+    """
+    index: int
+    item: str
+    center: tuple
+    radius: int
+    bbox: tuple
+    is_shaded: bool
+    fill_percent: float
+    mean_intensity: float
+    median_intensity: float
+    confidence: float = 1.0
+    ambiguous: bool = False
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            int(data['index']),
+            str(data['item']),
+            (int(data['center'][0]), int(data['center'][1])),
+            int(data['radius']),
+            tuple(int(v) for v in data['bbox']),
+            bool(data['is_shaded']),
+            float(data['fill_percent']),
+            float(data['mean_intensity']),
+            float(data['median_intensity']),
+            float(data.get('confidence', 1.0)),
+            bool(data.get('ambiguous', False))
+        )
+
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'item': self.item,
+            'center': self.center,
+            'radius': self.radius,
+            'bbox': self.bbox,
+            'is_shaded': self.is_shaded,
+            'fill_percent': self.fill_percent,
+            'mean_intensity': self.mean_intensity,
+            'median_intensity': self.median_intensity,
+            'confidence': self.confidence,
+            'ambiguous': self.ambiguous
+        }
+
+    def selection(self):
+        return {
+            'item': self.item,
+            'fill_percent': self.fill_percent,
+            'center': self.center,
+            'radius': self.radius,
+            'bbox': self.bbox
+        }
+
+@dataclass(slots=True)
+class ScanResult:
+    """
+    A complete scan: every analyzed circle plus scan metadata.
+    to_dict() reproduces the scanner's result layout.
+    """
+    circles: list
+    scan_type: str = 'SHADED CIRCLES ONLY'
+    registration: dict = None
+    template: str = None
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, result):
+        """Wrap a scanner result dict (selections are derived, not copied)"""
+        known = ('shaded_selections', 'circles', 'total_circles', 'total_selected',
+                 'scan_type', 'registration', 'template', 'debug_image')
+        return cls(
+            [CircleResult.from_dict(c) for c in result.get('circles', [])],
+            result.get('scan_type', 'SHADED CIRCLES ONLY'),
+            result.get('registration'),
+            result.get('template'),
+            {k: v for k, v in result.items() if k not in known}
+        )
+
+    @property
+    def total_selected(self):
+        return sum(1 for c in self.circles if c.is_shaded)
+
+    def summary(self):
+        """Counts, selected item names and items worth a second look"""
+        return {
+            'total_circles': len(self.circles),
+            'total_selected': self.total_selected,
+            'scan_type': self.scan_type,
+            'selected': [c.item for c in self.circles if c.is_shaded],
+            'ambiguous': [c.item for c in self.circles if c.ambiguous]
+        }
+
+    def to_dict(self):
+        shaded_selections = [c.selection() for c in self.circles if c.is_shaded]
+        result = {
+            'shaded_selections': shaded_selections,
+            'circles': self.circles,
+            'total_circles': len(self.circles),
+            'total_selected': len(shaded_selections),
+            'scan_type': self.scan_type
+        }
+        if self.registration is not None:
+            result['registration'] = self.registration
+        if self.template is not None:
+            result['template'] = self.template
+        result.update(self.extra)
+        return result
+
+    def to_json(self):
+        return dumps(self)
+
+    def to_binary(self):
+        """
+        Compact form: a 12-byte header, one CIRCLE_DTYPE record per circle,
+        then the item names as UTF-8 separated by NUL bytes
+        """
+        records = np.zeros(len(self.circles), dtype=CIRCLE_DTYPE)
+        if self.circles:
+            records['x'] = [c.center[0] for c in self.circles]
+            records['y'] = [c.center[1] for c in self.circles]
+            records['radius'] = [c.radius for c in self.circles]
+            records['is_shaded'] = [c.is_shaded for c in self.circles]
+            records['fill_percent'] = [c.fill_percent for c in self.circles]
+            records['mean_intensity'] = [c.mean_intensity for c in self.circles]
+            records['median_intensity'] = [c.median_intensity for c in self.circles]
+            records['ambiguous'] = [c.ambiguous for c in self.circles]
+            records['confidence'] = [c.confidence for c in self.circles]
+
+        flags = 1 if (self.registration or {}).get('registered') else 0
+        header = _HEADER.pack(BINARY_MAGIC, BINARY_VERSION, flags, len(self.circles))
+        names = b'\0'.join(c.item.encode('utf-8') for c in self.circles)
+        return header + records.tobytes() + names
+
+    @classmethod
+    def from_binary(cls, data):
+        """Decode to_binary() output (registration and metadata are not included)"""
+        magic, version, _, count = _HEADER.unpack_from(data)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError('Not an OMR binary result')
+
+        offset = _HEADER.size
+        records = np.frombuffer(data, dtype=CIRCLE_DTYPE, count=count, offset=offset)
+        names = bytes(data[offset + records.nbytes:]).decode('utf-8').split('\0') if count else []
+
+        circles = []
+        for i, (record, name) in enumerate(zip(records, names)):
+            x, y, r = int(record['x']), int(record['y']), int(record['radius'])
+            circles.append(CircleResult(
+                i, name, (x, y), r, (x - r, y - r, 2 * r, 2 * r),
+                bool(record['is_shaded']),
+                # float32 storage; restore the one-decimal values
+                round(float(record['fill_percent']), 1),
+                round(float(record['mean_intensity']), 1),
+                round(float(record['median_intensity']), 1),
+                round(float(record['confidence']), 2),
+                bool(record['ambiguous'])
+            ))
+        return cls(circles)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+OMR Storage - Where uploads and scan results are kept
+Backends share a small put/get interface over keys like
+'uploads/<name>' or 'results/<name>':
+
+    none   nothing is persisted
+    local  files under a root folder, evicted by total size and age
+    s3     an S3-compatible object store (AWS, MinIO, ...); retention is
+           left to the bucket's lifecycle rules
+
+AsyncStorage wraps any backend so writes happen on a background thread,
+off the request path.
+"""
+
+import os
+import queue
+import logging
+import threading
+import time
+
+from omr_metrics import observe_stage
+
+try:
+    import boto3
+except ImportError:  # Only needed for STORAGE_BACKEND=s3
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+class NullStorage:
+    """
+    Persists nothing (scans still work; stored results cannot be fetched)
+    """
+    def put(self, key, data):
+        pass
+
+    def get(self, key):
+        return None
+
+class LocalStorage:
+    """
+    Files under `root`, keyed by relative path. Once the managed folders
+    exceed max_bytes, or files are older than max_age_seconds, the oldest
+    files are deleted. Sub-folders (e.g. results/jobs) are never touched.
+    """
+    def __init__(self, root='.', folders=(), max_bytes=1024 * 1024 * 1024,
+                 max_age_seconds=7 * 24 * 3600, sweep_interval=60):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.sweep_interval = sweep_interval
+
+        self._folders = set(folders)
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+        self._size = 0
+        for folder in self._folders:
+            os.makedirs(os.path.join(self.root, folder), exist_ok=True)
+        self.sweep()
+
+    def _path(self, key):
+        folder, name = os.path.split(key)
+        # Keys are generated by the server, but never let one escape the root
+        return os.path.join(self.root, os.path.basename(folder), os.path.basename(name))
+
+    def put(self, key, data):
+        path = self._path(key)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._folders.add(os.path.relpath(folder, self.root))
+            self._size += len(data)
+            due = (self._size > self.max_bytes or
+                   time.time() - self._last_sweep > self.sweep_interval)
+        if due:
+            self.sweep()
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def sweep(self):
+        """Delete expired files, then the oldest ones until under 90% of max_bytes"""
+        now = time.time()
+        files = []
+        for folder in list(self._folders):
+            path = os.path.join(self.root, folder)
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+                except OSError:
+                    pass
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            expired = self.max_age_seconds and now - mtime > self.max_age_seconds
+            if not expired and total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+
+        with self._lock:
+            self._size = total
+            self._last_sweep = now
+        if removed:
+            logger.info("Storage eviction: removed %d files, %.1f MB kept", removed, total / (1024 * 1024))
+
+class S3Storage:
+    """
+    Objects in an S3-compatible bucket. `endpoint_url` points at any
+    compatible server (e.g. a local MinIO) instead of AWS.
+    """
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        if boto3 is None:
+            raise RuntimeError('STORAGE_BACKEND=s3 requires the boto3 package')
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None)
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return response['Body'].read()
+
+class AsyncStorage:
+    """
+    Queues writes for a background thread. Pending writes are readable
+    immediately; when the queue is full, writes are dropped (and counted)
+    rather than blocking a request.
+    """
+    def __init__(self, backend, max_pending=256):
+        self.backend = backend
+        self.dropped = 0
+        self.failed = 0
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._writer = None
+
+    @property
+    def pending(self):
+        """Writes queued but not yet written"""
+        return self._queue.qsize()
+
+    def put(self, key, data):
+        with self._lock:
+            self._pending[key] = data
+        try:
+            self._queue.put_nowait(key)
+        except queue.Full:
+            with self._lock:
+                self._pending.pop(key, None)
+            self.dropped += 1
+            logger.warning("Storage queue full, dropped write: %s", key)
+            return
+        self._ensure_writer()
+
+    def get(self, key):
+        with self._lock:
+            data = self._pending.get(key)
+        if data is not None:
+            return data
+        return self.backend.get(key)
+
+    def _ensure_writer(self):
+        # Started lazily so it runs in the serving process, not the gunicorn master
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name='omr-storage-writer', daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            key = self._queue.get()
+            with self._lock:
+                data = self._pending.get(key)
+            try:
+                if data is not None:
+                    started = time.perf_counter()
+                    self.backend.put(key, data)
+                    observe_stage('persist', time.perf_counter() - started)
+            except Exception as e:
+                self.failed += 1
+                logger.error("Storage write failed for %s: %s", key, e)
+            finally:
+                with self._lock:
+                    if self._pending.get(key) is data:
+                        self._pending.pop(key, None)
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued write has been attempted"""
+        self._queue.join()
+
+def create_storage(backend='local', **options):
+    """
+    Build the storage for a backend name ('none', 'local' or 's3'),
+    wrapped for asynchronous writes
+    """
+    backend = (backend or 'local').lower()
+    if backend == 'none':
+        return NullStorage()
+
+    max_pending = options.pop('max_pending', 256)
+    if backend == 'local':
+        store = LocalStorage(**options)
+    elif backend == 's3':
+        store = S3Storage(**options)
+    else:
+        raise ValueError(f'Unknown storage backend: {backend}')
+    return AsyncStorage(store, max_pending)
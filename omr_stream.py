@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+OMR Live Stream - Continuous webcam scanning over a WebSocket
+The client sends JPEG frames as binary messages; the server answers with
+small JSON selection deltas. Only the newest frame is kept while a scan is
+running (stale frames are dropped), and frames that look unchanged since
+the last scanned one are skipped without a full scan. Bubbles are tracked
+between frames, so the full detection only runs when tracking is lost.
+Every scanned frame (tracked or detected) is decoded and processed in the
+bounded scan executor; the connection's thread only does the cheap 1/8
+thumbnail decode used for change detection.
+"""
+
+import cv2
+import json
+import threading
+import time
+import numpy as np
+from concurrent.futures import TimeoutError as ScanTimeout
+
+from omr_executor import ScanQueueFull
+from omr_tracker import BubbleTracker
+
+class FrameSlot:
+    """
+    Single-slot mailbox holding only the newest frame.
+    put() overwrites an unconsumed frame, counting it as dropped.
+    """
+    def __init__(self):
+        self._frame = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, seq, data):
+        with self._condition:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = (seq, data)
+            self._condition.notify()
+
+    def take(self):
+        """Block until a frame is available; returns (seq, data) or None once closed"""
+        with self._condition:
+            while self._frame is None and not self._closed:
+                self._condition.wait()
+            frame, self._frame = self._frame, None
+            return frame
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+class LiveScanSession:
+    """
+    Per-connection state: change detection on a tiny thumbnail, the bubble
+    tracker and the selection set of the last scanned frame (for deltas).
+    The tracker is handed to the executor with each frame and its updated
+    state adopted when the scan returns.
+    """
+    def __init__(self, executor, session_id, scanner, change_threshold=2.5, scan_timeout=10):
+        self.executor = executor
+        self.session_id = session_id
+        # Mean absolute difference (0-255) of the 32x24 thumbnail below which a
+        # frame is treated as unchanged
+        self.change_threshold = change_threshold
+        self.scan_timeout = scan_timeout
+
+        self.tracker = BubbleTracker(scanner)
+
+        self.selected = set()
+        self.frames_scanned = 0
+        self.frames_skipped = 0
+        self.frames_busy = 0
+        self._last_thumbnail = None
+        self._reset_requested = False
+
+    def configure(self, message):
+        """Apply a JSON control message from the client (from the receiver thread)"""
+        if message.get('reset'):
+            # Applied before the next frame, not under a scan in flight
+            self._reset_requested = True
+        if 'change_threshold' in message:
+            self.change_threshold = float(message['change_threshold'])
+
+    def _thumbnail(self, data):
+        # 1/8-scale grayscale decode is far cheaper than a full decode
+        small = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if small is None:
+            return None
+        return cv2.resize(small, (32, 24), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def process(self, seq, data):
+        """Scan one frame and return the JSON message to send back"""
+        started = time.time()
+        thumbnail = self._thumbnail(data)
+        if thumbnail is None:
+            return {'type': 'error', 'frame': seq, 'error': 'Invalid frame'}
+
+        if (self._last_thumbnail is not None and
+                np.mean(np.abs(thumbnail - self._last_thumbnail)) < self.change_threshold):
+            self.frames_skipped += 1
+            return {'type': 'skip', 'frame': seq}
+
+        if self._reset_requested:
+            self._reset_requested = False
+            self.tracker.reset()
+
+        try:
+            result = self.executor.run(data, timeout=self.scan_timeout, tracker=self.tracker)
+        except ScanQueueFull:
+            self.frames_busy += 1
+            return {'type': 'busy', 'frame': seq}
+        except ScanTimeout:
+            return {'type': 'error', 'frame': seq, 'error': 'Scan timed out'}
+
+        if 'error' in result:
+            return {'type': 'error', 'frame': seq, 'error': result['error']}
+
+        self._last_thumbnail = thumbnail
+        self.frames_scanned += 1
+        return self.delta(seq, result, started)
+
+    def delta(self, seq, result, started):
+        """Selection changes relative to the previous scanned frame"""
+        selected = {s['item'] for s in result['shaded_selections']}
+        added = sorted(selected - self.selected)
+        removed = sorted(self.selected - selected)
+        self.selected = selected
+
+        return {
+            'type': 'delta',
+            'frame': seq,
+            'added': added,
+            'removed': removed,
+            'selected': sorted(selected),
+            'total_circles': result['total_circles'],
+            'tracked': result['tracking']['tracked'],
+            'latency_ms': round((time.time() - started) * 1000, 1)
+        }
+
+    def stats(self, dropped):
+        return {
+            'scanned': self.frames_scanned,
+            'skipped': self.frames_skipped,
+            'busy': self.frames_busy,
+            'dropped': dropped,
+            'tracked': self.tracker.frames_tracked,
+            'detections': self.tracker.detections
+        }
+
+def run_live_session(ws, session):
+    """
+    Serve one WebSocket connection. A receiver thread keeps only the newest
+    frame while this thread scans, so a slow scan never builds a backlog.
+    Returns the session's final frame statistics.
+    """
+    slot = FrameSlot()
+
+    def receive():
+        seq = 0
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                if isinstance(message, (bytes, bytearray)):
+                    seq += 1
+                    slot.put(seq, bytes(message))
+                else:
+                    try:
+                        session.configure(json.loads(message))
+                    except (ValueError, TypeError, AttributeError):
+                        pass
+        except Exception:
+            pass
+        finally:
+            slot.close()
+
+    receiver = threading.Thread(target=receive, name='omr-live-receiver', daemon=True)
+    receiver.start()
+
+    while True:
+        frame = slot.take()
+        if frame is None:
+            break
+        message = session.process(*frame)
+        message['stats'] = session.stats(slot.dropped)
+        try:
+            ws.send(json.dumps(message))
+        except Exception:
+            break
+
+    slot.close()
+    return session.stats(slot.dropped)
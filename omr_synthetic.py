@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+OMR Synthetic Sheets - Generated bubble sheets with known answers
+Draws red-outlined bubbles in a grid, fills a chosen set of them and then
+degrades the page (rotation, uneven lighting, blur, sensor noise, JPEG
+artifacts), returning the image together with its ground truth. Used by
+omr_benchmark.py and as a fixture when no real scans are available.
+
+Usage:
+    python omr_synthetic.py OUTPUT_DIR [--count N] [--seed S] [generator options]
+"""
+
+import argparse
+import json
+import math
+import os
+
+import cv2
+import numpy as np
+
+FILL_PATTERNS = ('random', 'all', 'none', 'alternate')
+
+def fill_pattern(pattern, count, rng, fill_ratio=0.4):
+    """
+    Which bubbles are filled: a pattern name or an explicit sequence of
+    booleans (repeated to `count` if shorter)
+    """
+    if not isinstance(pattern, str):
+        pattern = [bool(v) for v in pattern] or [False]
+        return [pattern[i % len(pattern)] for i in range(count)]
+    if pattern == 'random':
+        return [bool(v) for v in rng.random(count) < fill_ratio]
+    if pattern == 'all':
+        return [True] * count
+    if pattern == 'none':
+        return [False] * count
+    if pattern == 'alternate':
+        return [i % 2 == 0 for i in range(count)]
+    raise ValueError(f'Unknown fill pattern: {pattern}')
+
+def _layout(width, height, bubbles, columns, radius):
+    rows = math.ceil(bubbles / columns)
+    margin_x = max(3 * radius, width // 8)
+    margin_y = max(3 * radius, height // 10)
+    step_x = (width - 2 * margin_x) / max(columns, 1)
+    step_y = (height - 2 * margin_y) / max(rows - 1, 1)
+    if step_y < 3 * radius or (columns > 1 and step_x < 5 * radius):
+        raise ValueError(f'{bubbles} bubbles of radius {radius} do not fit a {width}x{height} sheet')
+    return [
+        (int(round(margin_x + (i % columns) * step_x)), int(round(margin_y + (i // columns) * step_y)))
+        for i in range(bubbles)
+    ]
+
+def generate_sheet(width=900, height=1200, bubbles=8, columns=1, radius=30,
+                   pattern='random', fill_ratio=0.4, stray_marks=0.0, labels=True,
+                   noise=0.0, blur=0.0, rotation=0.0, lighting=0.0, exposure=1.0, seed=None):
+    """
+    Render one sheet. Returns (BGR image, truth) where truth lists every
+    bubble as {'index', 'center', 'radius', 'filled'} in image coordinates.
+
+    pattern      'random' (each filled with probability fill_ratio), 'all',
+                 'none', 'alternate' or a sequence of booleans
+    stray_marks  probability that an empty bubble gets a pen stroke (should
+                 still read as empty)
+    noise        standard deviation of Gaussian sensor noise (0-255 scale)
+    blur         Gaussian blur sigma in pixels
+    rotation     page rotation in degrees
+    lighting     0-1 strength of a shadow gradient across the page
+    exposure     overall brightness gain (e.g. 0.4 for a dim kitchen photo)
+    """
+    rng = np.random.default_rng(seed)
+    centers = _layout(width, height, bubbles, columns, radius)
+    filled = fill_pattern(pattern, bubbles, rng, fill_ratio)
+
+    paper = int(rng.integers(225, 246))
+    image = np.full((height, width, 3), paper, dtype=np.uint8)
+    # Printed strokes get thicker with the resolution, like a real scan
+    stroke = max(2, int(round(radius / 15.0)))
+    for i, ((x, y), is_filled) in enumerate(zip(centers, filled)):
+        cv2.circle(image, (x, y), radius, (30, 30, 200), stroke, cv2.LINE_AA)
+        if labels:
+            cv2.putText(image, f"Item {i + 1}", (x + 2 * radius, y + radius // 3),
+                        cv2.FONT_HERSHEY_SIMPLEX, radius / 30.0, (40, 40, 40), stroke, cv2.LINE_AA)
+        if is_filled:
+            # Hand fills are slightly off-centre and vary from pen to pencil
+            ink = int(rng.integers(15, 70))
+            dx, dy = rng.integers(-2, 3, size=2)
+            cv2.circle(image, (x + int(dx), y + int(dy)), radius - 2, (ink, ink, ink), -1, cv2.LINE_AA)
+        elif rng.random() < stray_marks:
+            angle = rng.uniform(0, math.pi)
+            ex, ey = int(radius * 0.7 * math.cos(angle)), int(radius * 0.7 * math.sin(angle))
+            cv2.line(image, (x - ex, y - ey), (x + ex, y + ey), (50, 50, 50), stroke, cv2.LINE_AA)
+
+    points = np.array(centers, dtype=np.float64).reshape(-1, 2)
+    if rotation:
+        matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), rotation, 1.0)
+        image = cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                               borderValue=(paper, paper, paper))
+        points = points @ matrix[:, :2].T + matrix[:, 2]
+
+    if lighting or exposure != 1.0:
+        gain = np.full((height, width), exposure, dtype=np.float32)
+        if lighting:
+            # Shadow falling across the page from a random direction
+            angle = rng.uniform(0, 2 * math.pi)
+            ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+            ramp = (xs / width - 0.5) * math.cos(angle) + (ys / height - 0.5) * math.sin(angle)
+            gain *= 1.0 - lighting * (ramp - ramp.min()) / max(float(np.ptp(ramp)), 1e-6)
+        image = (image.astype(np.float32) * gain[:, :, None]).clip(0, 255).astype(np.uint8)
+
+    if blur:
+        image = cv2.GaussianBlur(image, (0, 0), blur)
+
+    if noise:
+        image = (image + rng.normal(0, noise, image.shape)).clip(0, 255).astype(np.uint8)
+
+    truth = [
+        {'index': i, 'center': (float(x), float(y)), 'radius': radius, 'filled': is_filled}
+        for i, ((x, y), is_filled) in enumerate(zip(points, filled))
+    ]
+    return image, truth
+
+def encode_sheet(image, quality=90):
+    """JPEG bytes for a generated sheet (as a phone or scanner would upload it)"""
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError('Could not encode sheet')
+    return buffer.tobytes()
+
+def add_generator_arguments(parser):
+    """Sheet options shared by this CLI and the benchmark"""
+    parser.add_argument('--width', type=int, default=900, help='Sheet width in pixels')
+    parser.add_argument('--height', type=int, default=1200, help='Sheet height in pixels')
+    parser.add_argument('--bubbles', type=int, default=8, help='Bubbles per sheet')
+    parser.add_argument('--columns', type=int, default=1, help='Bubble columns')
+    parser.add_argument('--radius', type=int, default=30, help='Bubble radius in pixels')
+    parser.add_argument('--pattern', default='random', choices=FILL_PATTERNS, help='Which bubbles are filled')
+    parser.add_argument('--fill-ratio', type=float, default=0.4, help='Filled share for the random pattern')
+    parser.add_argument('--stray-marks', type=float, default=0.0, help='Chance of a stray stroke in an empty bubble')
+    parser.add_argument('--noise', type=float, default=0.0, help='Gaussian noise standard deviation')
+    parser.add_argument('--blur', type=float, default=0.0, help='Gaussian blur sigma')
+    parser.add_argument('--rotation', type=float, default=0.0, help='Maximum page rotation in degrees (random +/-)')
+    parser.add_argument('--lighting', type=float, default=0.0, help='Shadow gradient strength (0-1)')
+    parser.add_argument('--exposure', type=float, default=1.0, help='Overall brightness gain')
+    parser.add_argument('--quality', type=int, default=90, help='JPEG quality')
+
+def generator_options(args, rng):
+    """generate_sheet() keyword arguments from parsed options (rotation drawn per sheet)"""
+    return {
+        'width': args.width,
+        'height': args.height,
+        'bubbles': args.bubbles,
+        'columns': args.columns,
+        'radius': args.radius,
+        'pattern': args.pattern,
+        'fill_ratio': args.fill_ratio,
+        'stray_marks': args.stray_marks,
+        'noise': args.noise,
+        'blur': args.blur,
+        'rotation': float(rng.uniform(-args.rotation, args.rotation)) if args.rotation else 0.0,
+        'lighting': args.lighting,
+        'exposure': args.exposure,
+        'seed': int(rng.integers(2 ** 31))
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic OMR sheets and their ground truth')
+    parser.add_argument('output', help='Folder for sheet_NNNN.jpg and truth.json')
+    parser.add_argument('--count', type=int, default=10, help='Number of sheets')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    rng = np.random.default_rng(args.seed)
+    truth = {}
+    for n in range(args.count):
+        options = generator_options(args, rng)
+        image, bubbles = generate_sheet(**options)
+        name = f"sheet_{n:04d}.jpg"
+        with open(os.path.join(args.output, name), 'wb') as f:
+            f.write(encode_sheet(image, args.quality))
+        truth[name] = {'options': options, 'bubbles': bubbles}
+
+    with open(os.path.join(args.output, 'truth.json'), 'w', encoding='utf-8') as f:
+        json.dump(truth, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+OMR Form Templates - Precomputed bubble layouts for known forms
+A form layout (bubble positions, radii and item names plus page anchors)
+is registered once and cached; scans of that form only locate the anchors
+and sample fills at the precomputed positions.
+"""
+
+import cv2
+import numpy as np
+import os
+import json
+import hashlib
+import threading
+
+TEMPLATES_FOLDER = 'templates'
+
+def _find_square_marks(gray, min_area=64):
+    """
+    Find solid dark square marks (page anchors / fiducials).
+    Returns a list of ((cx, cy), side) tuples.
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    marks = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < min_area:
+            continue
+
+        (cx, cy), (w, h), _ = cv2.minAreaRect(contour)
+        if w == 0 or h == 0:
+            continue
+
+        # Square-ish and solidly filled
+        if min(w, h) / max(w, h) < 0.75 or area / (w * h) < 0.85:
+            continue
+
+        marks.append(((float(cx), float(cy)), float((w + h) / 2)))
+
+    return marks
+
+def find_corner_anchors(gray):
+    """
+    Pick the square mark closest to each page corner (within the outer
+    quarter of the page). Used when building a template from a reference
+    image. Returns up to four {'center', 'size'} anchors.
+    """
+    height, width = gray.shape[:2]
+    marks = _find_square_marks(gray)
+
+    anchors = []
+    for corner in ((0, 0), (width, 0), (width, height), (0, height)):
+        best = None
+        best_distance = None
+        for center, side in marks:
+            if abs(center[0] - corner[0]) > width / 4 or abs(center[1] - corner[1]) > height / 4:
+                continue
+            distance = np.hypot(center[0] - corner[0], center[1] - corner[1])
+            if best is None or distance < best_distance:
+                best, best_distance = (center, side), distance
+        if best is not None:
+            anchors.append({'center': best[0], 'size': best[1]})
+
+    return anchors
+
+def _locate_anchor(gray, expected, size, search_radius):
+    """
+    Search a window around the expected anchor position for a square mark
+    of roughly the expected size. Returns its center or None.
+    """
+    height, width = gray.shape[:2]
+    ex, ey = expected
+    x0, y0 = max(0, int(ex - search_radius)), max(0, int(ey - search_radius))
+    x1, y1 = min(width, int(ex + search_radius)), min(height, int(ey + search_radius))
+    if x1 - x0 < 3 or y1 - y0 < 3:
+        return None
+
+    best = None
+    best_distance = None
+    for (cx, cy), side in _find_square_marks(gray[y0:y1, x0:x1], min_area=max(16, (size * 0.4) ** 2)):
+        if not (size * 0.5 <= side <= size * 2.0):
+            continue
+        cx, cy = cx + x0, cy + y0
+        distance = np.hypot(cx - ex, cy - ey)
+        if best is None or distance < best_distance:
+            best, best_distance = (cx, cy), distance
+
+    return best
+
+class FormTemplate:
+    """
+    A registered form layout in canonical (reference image) coordinates
+    """
+    def __init__(self, name, size, bubbles, anchors=None):
+        self.name = name
+        self.size = (int(size[0]), int(size[1]))  # (width, height)
+        self.bubbles = [
+            {
+                'item': str(b['item']),
+                'center': (float(b['center'][0]), float(b['center'][1])),
+                'radius': float(b['radius'])
+            } for b in bubbles
+        ]
+        self.anchors = [
+            {
+                'center': (float(a['center'][0]), float(a['center'][1])),
+                'size': float(a['size'])
+            } for a in (anchors or [])
+        ]
+
+        # Precomputed arrays for mapping every bubble in one transform call
+        self.centers = np.array([b['center'] for b in self.bubbles], dtype=np.float32).reshape(-1, 2)
+        self.radii = np.array([b['radius'] for b in self.bubbles], dtype=np.float32)
+
+        # Identifies this exact layout (e.g. for result cache keys)
+        self.fingerprint = hashlib.sha1(json.dumps(self.to_dict(), sort_keys=True).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data['size'], data['bubbles'], data.get('anchors'))
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'size': list(self.size),
+            'bubbles': [
+                {'item': b['item'], 'center': list(b['center']), 'radius': b['radius']}
+                for b in self.bubbles
+            ],
+            'anchors': [
+                {'center': list(a['center']), 'size': a['size']}
+                for a in self.anchors
+            ]
+        }
+
+    def transform_for(self, gray):
+        """
+        Estimate the 3x3 transform from template coordinates to the image.
+        Uses a homography with 4 anchors, an affine fit with 3, and plain
+        scaling to the image size otherwise.
+        """
+        height, width = gray.shape[:2]
+        sx, sy = width / float(self.size[0]), height / float(self.size[1])
+        scaling = np.array([[sx, 0, 0], [0, sy, 0], [0, 0, 1]], dtype=np.float64)
+
+        src, dst = [], []
+        search_radius = 0.08 * max(width, height)
+        for anchor in self.anchors:
+            ax, ay = anchor['center']
+            size = anchor['size'] * (sx + sy) / 2
+            found = _locate_anchor(gray, (ax * sx, ay * sy), size, search_radius + size)
+            if found is not None:
+                src.append((ax, ay))
+                dst.append(found)
+
+        src = np.array(src, dtype=np.float32)
+        dst = np.array(dst, dtype=np.float32)
+        if len(src) >= 4:
+            matrix, _ = cv2.findHomography(src, dst, 0)
+            if matrix is not None:
+                return matrix
+        elif len(src) == 3:
+            return np.vstack([cv2.getAffineTransform(src, dst), [0, 0, 1]])
+
+        return scaling
+
+    def locate(self, gray):
+        """
+        Map every template bubble into the image and return circle dicts
+        (center, radius, bbox, index, item) in template order
+        """
+        matrix = self.transform_for(gray)
+        n = len(self.bubbles)
+        if n == 0:
+            return []
+
+        # Map each center plus a point one radius to the right/below it so
+        # the radius follows the local scale of the transform
+        points = np.concatenate([
+            self.centers,
+            self.centers + np.stack([self.radii, np.zeros(n, np.float32)], axis=1),
+            self.centers + np.stack([np.zeros(n, np.float32), self.radii], axis=1)
+        ]).reshape(-1, 1, 2)
+        mapped = cv2.perspectiveTransform(points, matrix).reshape(3, n, 2)
+        centers = mapped[0]
+        radii = (np.linalg.norm(mapped[1] - centers, axis=1) +
+                 np.linalg.norm(mapped[2] - centers, axis=1)) / 2
+
+        circles = []
+        for i, bubble in enumerate(self.bubbles):
+            x, y = int(round(centers[i, 0])), int(round(centers[i, 1]))
+            r = max(1, int(round(radii[i])))
+            circles.append({
+                'center': (x, y),
+                'radius': r,
+                'bbox': (x - r, y - r, 2 * r, 2 * r),
+                'index': i,
+                'item': bubble['item']
+            })
+
+        return circles
+
+def template_from_image(scanner, name, source, items=None):
+    """
+    Build a template from a clean reference scan of a form.
+    Bubbles are found once with the scanner's Hough detection and ordered
+    row-major (top to bottom, then left to right within a row), so bubbles
+    sharing a row map to items deterministically. Detection runs on the
+    same reduced decode as a plain scan_image(), so the template lists the
+    bubbles a scan of the same sheet would find.
+    """
+    frame = scanner.prepare_image(source, reduce=True)
+    if frame is None:
+        return None
+
+    circles = scanner.detect_circles(frame)
+    if isinstance(circles, dict) and 'error' in circles:
+        return None
+
+    # Layout and anchors are kept in source pixels, where scan_template() works
+    scale = frame.get('decode_scale', 1)
+    if scale != 1:
+        circles = scanner.scale_circles([dict(c) for c in circles], scale)
+        frame = scanner.prepare_image(source)
+        if frame is None:
+            return None
+
+    # Group into rows: a circle starts a new row when its center is more than
+    # one radius below the first circle of the current row
+    rows = []
+    for circle in sorted(circles, key=lambda c: c['center'][1]):
+        if rows and circle['center'][1] - rows[-1][0]['center'][1] <= rows[-1][0]['radius']:
+            rows[-1].append(circle)
+        else:
+            rows.append([circle])
+    ordered = [c for row in rows for c in sorted(row, key=lambda c: c['center'][0])]
+
+    items = list(items) if items else scanner.menu_items
+    bubbles = []
+    for i, circle in enumerate(ordered):
+        bubbles.append({
+            'item': items[i] if i < len(items) else f"Item_{i+1}",
+            'center': circle['center'],
+            'radius': circle['radius']
+        })
+
+    gray = frame['gray']
+    height, width = gray.shape[:2]
+    return FormTemplate(name, (width, height), bubbles, find_corner_anchors(gray))
+
+def valid_template_name(name):
+    """
+    Template names become file names: anything with a path separator (or
+    a bare '.'/'..') is refused rather than rewritten to another file
+    """
+    return bool(name) and name not in ('.', '..') and not any(
+        sep and sep in name for sep in ('/', '\\', os.sep, os.altsep)
+    )
+
+class TemplateRegistry:
+    """
+    Thread-safe cache of form templates, persisted as JSON files. Cached
+    templates are reloaded when their file changes, so a template
+    re-registered by one server process reaches the others.
+    """
+    def __init__(self, folder=TEMPLATES_FOLDER):
+        self.folder = folder
+        self._templates = {}  # name -> (template, file mtime or None)
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.folder, f"{name}.json")
+
+    def _mtime(self, name):
+        try:
+            return os.stat(self._path(name)).st_mtime_ns
+        except OSError:
+            return None
+
+    def register(self, template, persist=True):
+        """
+        Cache a template and (optionally) save it to the templates folder.
+        Raises ValueError for names that cannot be used as file names.
+        """
+        if not valid_template_name(template.name):
+            raise ValueError(f'Invalid template name: {template.name!r}')
+
+        mtime = None
+        if persist and self.folder:
+            os.makedirs(self.folder, exist_ok=True)
+            path = self._path(template.name)
+            # Written whole then swapped in: other processes may be reading it
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(template.to_dict(), f)
+            os.replace(tmp_path, path)
+            mtime = self._mtime(template.name)
+
+        with self._lock:
+            self._templates[template.name] = (template, mtime)
+        return template
+
+    def get(self, name):
+        """
+        Return a cached template, (re)loading it from disk on first use and
+        whenever its file has changed. None for unknown or invalid names.
+        """
+        if not valid_template_name(name):
+            return None
+
+        with self._lock:
+            template, cached_mtime = self._templates.get(name, (None, None))
+        mtime = self._mtime(name) if self.folder else None
+        # Templates registered without persisting have no file to follow
+        if template is not None and (mtime is None or mtime == cached_mtime):
+            return template
+        if mtime is None:
+            return None
+
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                template = FormTemplate.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._templates[name] = (template, mtime)
+        return template
+
+    def names(self):
+        """Names of all cached and persisted templates"""
+        with self._lock:
+            names = set(self._templates)
+        if self.folder and os.path.isdir(self.folder):
+            names.update(f[:-5] for f in os.listdir(self.folder) if f.endswith('.json'))
+        return sorted(names)
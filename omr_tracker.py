@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+OMR Bubble Tracker - Follow a detected bubble set across video frames
+The full Hough detection runs once; on later frames the page motion is
+estimated with sparse optical flow on a downscaled frame and applied to
+every bubble, so only fill sampling runs per frame. Detection runs again
+only when tracking fails. Fill verdicts are smoothed by a majority vote
+over the last few frames, so one blurry frame cannot flip a selection.
+"""
+
+import cv2
+import numpy as np
+from collections import deque
+
+class BubbleTracker:
+    """
+    Keeps the bubble set of one video stream between frames
+    """
+    def __init__(self, scanner, history=5, track_side=480, min_features=12,
+                 min_inlier_ratio=0.5, redetect_every=150):
+        self.scanner = scanner
+        # Frames in the fill-verdict vote (odd, so there are no ties)
+        self.history = history
+        # Longest side of the downscaled frame used for optical flow
+        self.track_side = track_side
+        self.min_features = min_features
+        self.min_inlier_ratio = min_inlier_ratio
+        # Safety net against slow drift: re-detect after this many tracked frames
+        self.redetect_every = redetect_every
+
+        self.tracks = []
+        self.frames_tracked = 0
+        self.detections = 0
+        self._previous = None
+        self._since_detection = 0
+
+    def __getstate__(self):
+        # Trackers travel to scan worker processes and back without their
+        # scanner; the worker installs its own
+        state = self.__dict__.copy()
+        state['scanner'] = None
+        return state
+
+    def adopt(self, other):
+        """Take over the bubble set a copy of this tracker produced (e.g. in a scan worker)"""
+        if other is self:
+            return
+        for name in ('tracks', 'frames_tracked', 'detections', '_previous', '_since_detection'):
+            setattr(self, name, getattr(other, name))
+
+    def reset(self):
+        """Forget the bubble set; the next frame runs a full detection"""
+        self.tracks = []
+        self._previous = None
+        self._since_detection = 0
+
+    def _small(self, gray):
+        height, width = gray.shape[:2]
+        scale = min(1.0, self.track_side / float(max(height, width)))
+        if scale < 1.0:
+            gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        return gray, scale
+
+    def _estimate_motion(self, previous, current):
+        """
+        Similarity transform (2x3, small-frame coordinates) from the previous
+        frame to this one, or None when the flow is unreliable
+        """
+        points = cv2.goodFeaturesToTrack(previous, maxCorners=200, qualityLevel=0.01, minDistance=8)
+        if points is None or len(points) < self.min_features:
+            return None
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(previous, current, points, None, winSize=(21, 21), maxLevel=3)
+        # Forward-backward check rejects points that drifted onto other texture
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(current, previous, moved, None, winSize=(21, 21), maxLevel=3)
+        error = np.linalg.norm((points - back).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < 1.0)
+        if good.sum() < self.min_features:
+            return None
+
+        matrix, inliers = cv2.estimateAffinePartial2D(
+            points[good], moved[good], method=cv2.RANSAC, ransacReprojThreshold=2.0
+        )
+        if matrix is None or inliers.sum() < self.min_inlier_ratio * len(points):
+            return None
+        return matrix
+
+    def _move_tracks(self, matrix, scale, shape):
+        """Apply the motion to every bubble; False if any leaves the frame"""
+        height, width = shape[:2]
+        # Motion was measured on the downscaled frame; radii follow its zoom
+        zoom = float(np.sqrt(abs(np.linalg.det(matrix[:, :2]))))
+        centers = np.array([track['center'] for track in self.tracks], dtype=np.float64) * scale
+        moved = (centers @ matrix[:, :2].T + matrix[:, 2]) / scale
+        radii = np.array([track['radius'] for track in self.tracks], dtype=np.float64) * zoom
+
+        if (np.any(moved - radii[:, None] < 0) or np.any(moved[:, 0] + radii >= width)
+                or np.any(moved[:, 1] + radii >= height)):
+            return False
+
+        for track, (x, y), radius in zip(self.tracks, moved, radii):
+            track['center'] = (float(x), float(y))
+            track['radius'] = float(radius)
+        return True
+
+    def _adopt(self, circles):
+        """
+        Replace the bubble set with freshly detected circles, carrying the
+        verdict history of bubbles that match a previous track
+        """
+        tracks = []
+        for circle in circles:
+            x, y = float(circle['center'][0]), float(circle['center'][1])
+            radius = float(circle['radius'])
+            verdicts = deque(maxlen=self.history)
+            for old in self.tracks:
+                if np.hypot(old['center'][0] - x, old['center'][1] - y) <= radius:
+                    verdicts.extend(old['verdicts'])
+                    break
+            tracks.append({
+                'center': (x, y),
+                'radius': radius,
+                'item': circle.get('item'),
+                'verdicts': verdicts
+            })
+        self.tracks = tracks
+        self.detections += 1
+        self._since_detection = 0
+
+    def _circles(self):
+        circles = []
+        for i, track in enumerate(self.tracks):
+            x, y = int(round(track['center'][0])), int(round(track['center'][1]))
+            r = max(1, int(round(track['radius'])))
+            circle = {'center': (x, y), 'radius': r, 'bbox': (x - r, y - r, 2 * r, 2 * r), 'index': i}
+            if track['item']:
+                circle['item'] = track['item']
+            circles.append(circle)
+        return circles
+
+    def update(self, frame, detect=None):
+        """
+        Process one prepared frame and return a scan result with smoothed
+        verdicts plus a 'tracking' summary. `detect(frame)` supplies circles
+        when a full detection is needed (default: the scanner's Hough search).
+        """
+        gray = frame['gray']
+        small, scale = self._small(gray)
+
+        tracked = False
+        if self.tracks and self._previous is not None and self._previous.shape == small.shape:
+            if self._since_detection < self.redetect_every:
+                matrix = self._estimate_motion(self._previous, small)
+                if matrix is not None:
+                    tracked = self._move_tracks(matrix, scale, gray.shape)
+
+        if tracked:
+            self.frames_tracked += 1
+            self._since_detection += 1
+        else:
+            circles = detect(frame) if detect is not None else self.scanner.detect_circles(frame)
+            if isinstance(circles, dict) and 'error' in circles:
+                self.reset()
+                return circles
+            self._adopt(circles)
+
+        self._previous = small
+
+        analysis = self.scanner.analyze_circles(gray, self._circles())
+        for record, track in zip(analysis, self.tracks):
+            track['verdicts'].append(record['is_shaded'])
+            record['raw_is_shaded'] = record['is_shaded']
+            record['is_shaded'] = 2 * sum(track['verdicts']) > len(track['verdicts'])
+
+        result = self.scanner.build_result(frame, analysis, debug=False)
+        result['tracking'] = {
+            'tracked': tracked,
+            'detections': self.detections,
+            'frames_tracked': self.frames_tracked
+        }
+        return result
@@ -4,20 +4,72 @@ OMR Web Circle Scanner - Web Interface for Shaded Circle Detection
 Flask web application to upload and scan OMR forms for shaded circles
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Request, render_template, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-import cv2
-import numpy as np
+from werkzeug.utils import secure_filename
 import os
 import json
+import logging
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import TimeoutError as ScanTimeout
 from datetime import datetime
 import base64
+import binascii
+import cv2
 
 # Import our circle scanner
 # Ensure you have the OMRCircleScanner class defined in omr_circle_scanner.py
 from omr_circle_scanner import OMRCircleScanner
+from omr_templates import TemplateRegistry, template_from_image, valid_template_name
+from omr_executor import ScanExecutor, ScanQueueFull
+from omr_jobs import JobManager, JobQueueFull
+from omr_batch import is_sheet_name, iter_zip_sheets, scan_sheets
+from omr_documents import DEFAULT_DPI, document_type, expand_documents, iter_pages, page_count
+from omr_cache import ResultCache, CACHE_FOLDER, cache_key
+from omr_registration import registration_fingerprint
+from omr_stream import LiveScanSession, run_live_session
+from omr_debug import DebugImageRenderer
+from omr_results import ScanResult, BINARY_MIMETYPE, dumps
+from omr_storage import create_storage
+from omr_index import ResultsIndex, INDEX_PATH
+from omr_metrics import REGISTRY, METRICS_FOLDER, observe_scan, observe_stage
+from omr_logging import configure_logging, request_id
+
+try:
+    from flask_sock import Sock
+except ImportError:  # Live scanning needs flask-sock; everything else works without it
+    Sock = None
+
+# Structured JSON logs (LOG_LEVEL, LOG_FORMAT), written off the request thread
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# /batch takes hundreds of sheets per request, far beyond the 16MB limit
+# for single uploads; its parts are spooled to temporary files, not memory
+BATCH_MAX_CONTENT_LENGTH = int(os.environ.get('BATCH_MAX_MB', '1024')) * 1024 * 1024
+BATCH_MAX_PARTS = int(os.environ.get('BATCH_MAX_PARTS', '5000'))
+
+class ScannerRequest(Request):
+    """Request with its own body and part limits for /batch"""
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'batch_scan':
+            return BATCH_MAX_CONTENT_LENGTH
+        return super().max_content_length
+
+    @property
+    def max_form_parts(self):
+        if self.endpoint == 'batch_scan':
+            return BATCH_MAX_PARTS
+        return super().max_form_parts
 
 app = Flask(__name__)
+app.request_class = ScannerRequest
 CORS(app)  # Enable CORS for all routes
 
 # Configuration
@@ -31,48 +83,165 @@ os.makedirs(RESULTS_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Where uploads and scan results are kept (written in the background):
+# STORAGE_BACKEND=none, local (uploads/ and results/, evicted by size and
+# age) or s3 (any S3-compatible endpoint, e.g. a local MinIO)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local').lower()
+if STORAGE_BACKEND == 's3':
+    storage = create_storage(
+        's3',
+        bucket=os.environ.get('S3_BUCKET', 'omr-scanner'),
+        prefix=os.environ.get('S3_PREFIX', ''),
+        endpoint_url=os.environ.get('S3_ENDPOINT_URL')
+    )
+elif STORAGE_BACKEND == 'local':
+    storage = create_storage(
+        'local',
+        folders=(UPLOAD_FOLDER, RESULTS_FOLDER),
+        max_bytes=int(os.environ.get('STORAGE_MAX_MB', '1024')) * 1024 * 1024,
+        max_age_seconds=float(os.environ.get('STORAGE_MAX_AGE_HOURS', '168')) * 3600
+    )
+else:
+    storage = create_storage(STORAGE_BACKEND)
+
 # Initialize scanner
 scanner = OMRCircleScanner()
 
-class NumpyEncoder(json.JSONEncoder):
-    """Custom JSON encoder for numpy types"""
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return super().default(obj)
-
-def convert_numpy_types(obj):
-    """Convert numpy types to native Python types recursively"""
-    if isinstance(obj, dict):
-        return {k: convert_numpy_types(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_numpy_types(v) for v in obj]
-    elif isinstance(obj, tuple):
-        return tuple(convert_numpy_types(v) for v in obj)
-    elif isinstance(obj, (np.integer, np.int64, np.int32, np.int8, np.int16)):
-        return int(obj)
-    elif isinstance(obj, (np.floating, np.float64, np.float32, np.float16)):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, (np.bool_, bool)):
-        return bool(obj)
-    elif hasattr(obj, 'item'):  # Handle numpy scalars
-        try:
-            return obj.item()
-        except ValueError:
-            return str(obj)
-    elif obj is None:
-        return None
-    elif isinstance(obj, (str, int, float)):
-        return obj
-    else:
-        # Fallback: convert to string for unknown types
-        return str(obj)
+# Debug overlays are rendered on demand (GET /results/<id>/debug.jpg) and
+# cached as JPEG bytes; scans themselves never draw or encode them
+DEBUG_JPEG_QUALITY = int(os.environ.get('DEBUG_JPEG_QUALITY', '80'))
+DEBUG_CACHE_BYTES = int(os.environ.get('DEBUG_CACHE_BYTES', 16 * 1024 * 1024))
+debug_renderer = DebugImageRenderer(scanner, DEBUG_JPEG_QUALITY, DEBUG_CACHE_BYTES)
+
+_RESULT_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# Registered form layouts (templates/<name>.json), cached after first use
+# and reloaded when another worker re-registers them
+template_registry = TemplateRegistry()
+
+# Scans run in a bounded process pool. By default the pools of all gunicorn
+# workers together use one process per core: gunicorn.conf.py exports the
+# worker count it picked as WEB_CONCURRENCY before the app is preloaded
+# (a plain `python omr_web_circle_scanner.py` is one web process).
+# SCAN_WORKERS=0 scans inline.
+WEB_WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', max(1, (os.cpu_count() or 1) // WEB_WORKERS)))
+SCAN_QUEUE_SIZE = int(os.environ.get('SCAN_QUEUE_SIZE', SCAN_WORKERS * 2))
+SCAN_TIMEOUT = float(os.environ.get('SCAN_TIMEOUT', '60'))
+OPENCV_THREADS = int(os.environ.get('OPENCV_THREADS', '1'))
+
+scan_executor = ScanExecutor(scanner, SCAN_WORKERS, SCAN_QUEUE_SIZE, OPENCV_THREADS)
+
+# Result cache for repeated uploads: in-process LRU bounded by size, plus an
+# optional disk tier under results/cache (RESULT_CACHE_DISK=1) with its own
+# size and age limits (storage retention never sweeps sub-folders)
+RESULT_CACHE_BYTES = int(os.environ.get('RESULT_CACHE_BYTES', 32 * 1024 * 1024))
+RESULT_CACHE_DISK = os.environ.get('RESULT_CACHE_DISK', 'False').lower() in ('1', 'true', 'yes')
+result_cache = ResultCache(
+    RESULT_CACHE_BYTES,
+    CACHE_FOLDER if RESULT_CACHE_DISK else None,
+    disk_max_bytes=int(os.environ.get('RESULT_CACHE_DISK_MB', '256')) * 1024 * 1024,
+    disk_max_age_seconds=float(os.environ.get('RESULT_CACHE_DISK_MAX_AGE_HOURS', '168')) * 3600
+)
+
+# Multi-page PDF/TIFF uploads are rasterized page by page at this
+# resolution (?dpi= overrides it per request, within 72-600)
+DOCUMENT_DPI = int(os.environ.get('DOCUMENT_DPI', DEFAULT_DPI))
+
+# Queryable index of every scan outcome (SQLite, WAL mode); scans are kept
+# as long as stored uploads and results unless RESULTS_INDEX_MAX_AGE_HOURS says otherwise
+results_index = ResultsIndex(
+    os.environ.get('RESULTS_INDEX_PATH', INDEX_PATH),
+    max_age_seconds=float(os.environ.get('RESULTS_INDEX_MAX_AGE_HOURS',
+                                         os.environ.get('STORAGE_MAX_AGE_HOURS', '168'))) * 3600
+)
+
+def record_job_result(job, result):
+    """Metrics and results index entry for a finished background job"""
+    observe_scan(result)
+    results_index.record(job['id'], result, 'job')
+
+# Asynchronous scan jobs (POST /jobs, GET /jobs/<id>). Jobs their worker
+# has not refreshed for SCAN_TIMEOUT, or queued in a worker that has since
+# exited, are taken over by the next worker that polls them.
+job_manager = JobManager(
+    scan_executor,
+    resolve_template=template_registry.get,
+    on_result=record_job_result,
+    stale_seconds=SCAN_TIMEOUT
+)
+
+# Prometheus metrics (GET /metrics), summed over all gunicorn workers: each
+# writes its values to METRICS_FOLDER every METRICS_FLUSH_SECONDS and a
+# scrape merges them (METRICS_FOLDER= empty reports only the scraped worker)
+METRICS_FOLDER = os.environ.get('METRICS_FOLDER', METRICS_FOLDER)
+if METRICS_FOLDER:
+    REGISTRY.share(METRICS_FOLDER, float(os.environ.get('METRICS_FLUSH_SECONDS', '5')))
+HTTP_REQUESTS = REGISTRY.counter(
+    'omr_http_requests_total', 'HTTP requests by endpoint and status',
+    labels=('method', 'endpoint', 'status')
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    'omr_http_request_duration_seconds', 'Time to produce a response',
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    labels=('endpoint',)
+)
+REGISTRY.gauge('omr_scan_queue_depth', 'Scans admitted and not yet finished', callback=lambda: scan_executor.pending)
+REGISTRY.gauge('omr_scan_capacity', 'Maximum scans admitted at once', callback=lambda: scan_executor.capacity)
+REGISTRY.gauge('omr_scan_workers', 'Scan worker processes', callback=lambda: scan_executor.workers)
+REGISTRY.gauge('omr_job_queue_depth', 'Jobs waiting for the executor', callback=lambda: job_manager.waiting)
+REGISTRY.gauge('omr_storage_queue_depth', 'Storage writes not yet written', callback=lambda: getattr(storage, 'pending', 0))
+REGISTRY.gauge('omr_index_queue_depth', 'Scans not yet written to the results index', callback=lambda: results_index.pending)
+REGISTRY.counter('omr_result_cache_hits_total', 'Result cache hits', callback=lambda: result_cache.hits)
+REGISTRY.counter('omr_result_cache_misses_total', 'Result cache misses', callback=lambda: result_cache.misses)
+
+@app.before_request
+def start_request():
+    g.request_started = time.perf_counter()
+    # Honour an upstream proxy's ID so logs can be joined across services
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    request_id.set(g.request_id)
+
+@app.after_request
+def finish_request(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        HTTP_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+    return response
+
+def scanner_busy_response():
+    """Fast rejection when the scan queue is full"""
+    response = jsonify({'error': 'Scanner is busy, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def requested_dpi():
+    """Page resolution for documents in this request"""
+    dpi = request.values.get('dpi', DOCUMENT_DPI, type=int) or DOCUMENT_DPI
+    return min(600, max(72, dpi))
+
+def stream_sheet_records(sheets, source, **options):
+    """
+    Scan (name, data) sheets and stream one JSON line per sheet (or
+    document page) as each scan finishes
+    """
+    def generate():
+        # Leave room in the shared executor for interactive uploads
+        max_in_flight = max(1, scan_executor.workers)
+        count = 0
+        for record in scan_sheets(sheets, scan_executor, max_in_flight=max_in_flight, **options):
+            count += 1
+            if record['success']:
+                observe_scan(record)
+                results_index.record(uuid.uuid4().hex, record, source, filename=record['sheet'])
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+        logger.info("Streamed scan completed: %d sheets", count, extra={'sheets': count, 'source': source})
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/')
 def index():
@@ -236,9 +405,16 @@ def index():
                     method: 'POST',
                     body: formData
                 })
-                .then(response => response.json())
-                .then(data => {
-                    displayResults(data);
+                .then(response => {
+                    // Multi-page PDF/TIFF documents come back as JSON Lines, one record per page
+                    if ((response.headers.get('Content-Type') || '').startsWith('application/x-ndjson')) {
+                        return response.text().then(text => {
+                            displayPages(text.split('\\n').filter(line => line).map(line => JSON.parse(line)));
+                        });
+                    }
+                    return response.json().then(data => {
+                        displayResults(data);
+                    });
                 })
                 .catch(error => {
                     document.getElementById('results').innerHTML = '<div class="error">Error: ' + error + '</div>';
@@ -277,9 +453,9 @@ def index():
                 html += '</div>';
                 
                 // Show debug image if available
-                if (data.debug_image) {
+                if (data.debug_image_url) {
                     html += '<h3>🖼️ Debug Image:</h3>';
-                    html += '<img src="data:image/jpeg;base64,' + data.debug_image + '" class="debug-image" alt="Debug Image">';
+                    html += '<img src="' + data.debug_image_url + '" class="debug-image" alt="Debug Image" loading="lazy">';
                 }
                 
                 // Add "Send to POS" button if items were detected
@@ -295,6 +471,30 @@ def index():
                 resultsDiv.innerHTML = html;
             }
             
+            function displayPages(records) {
+                let html = '<div class="success">✅ Scanned ' + records.length + ' page(s)</div>';
+                
+                records.forEach(record => {
+                    html += '<h3>📄 ' + record.sheet + '</h3>';
+                    if (!record.success) {
+                        html += '<div class="error">Error: ' + record.error + '</div>';
+                        return;
+                    }
+                    html += '<div class="result-item">';
+                    if (record.shaded_selections && record.shaded_selections.length > 0) {
+                        record.shaded_selections.forEach(selection => {
+                            html += '<strong>✓ ' + selection.item + '</strong> (Fill: ' + selection.fill_percent + '%)<br>';
+                        });
+                    } else {
+                        html += 'No shaded circles detected<br>';
+                    }
+                    html += 'Total Circles: ' + record.total_circles + ', Shaded Selections: ' + record.total_selected;
+                    html += '</div>';
+                });
+                
+                document.getElementById('results').innerHTML = html;
+            }
+            
             function sendToPOS() {
                 if (window.scanResults && window.opener) {
                     console.log('Sending results to POS:', window.scanResults);
@@ -326,7 +526,8 @@ def index():
 def upload_file():
     """Handle file upload and scanning"""
     try:
-        print("📤 Upload request received")
+        started = time.time()
+        logger.debug("Upload request received")
         
         if 'file' not in request.files:
             return jsonify({'error': 'No file uploaded'}), 400
@@ -336,114 +537,381 @@ def upload_file():
             return jsonify({'error': 'No file selected'}), 400
         
         if file:
-            # Generate unique filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"circle_scan_{timestamp}_{file.filename}"
+            # Result IDs are random, so names never collide under concurrent load
+            result_id = uuid.uuid4().hex
+            filename = f"circle_scan_{result_id}_{secure_filename(file.filename) or 'upload'}"
+            
+            logger.debug("Processing file: %s", filename)
+            
+            # Read the upload into memory and scan it straight from the buffer
+            image_bytes = file.read()
             
-            print(f"📁 Processing file: {filename}")
+            # Multi-page PDF/TIFF: pages are rasterized one at a time and
+            # streamed back as JSON Lines, one record per page. Single-page
+            # documents get the usual single-scan response below.
+            kind = document_type(file.filename, image_bytes)
+            if kind and page_count(file.filename, image_bytes) != 1:
+                options = {'debug': False}
+                template_name = request.form.get('template')
+                if template_name:
+                    options['template'] = template_registry.get(template_name)
+                    if options['template'] is None:
+                        return jsonify({'error': f'Unknown template: {template_name}'}), 404
+                logger.info("Document upload received: %s", filename)
+                pages = expand_documents([(file.filename, image_bytes)], requested_dpi())
+                return stream_sheet_records(pages, 'document', **options)
             
-            # Save uploaded file
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            print(f"💾 File saved to: {filepath}")
+            # A single-page PDF is scanned as its rasterized page, which is
+            # also what gets stored so its debug overlay can be drawn
+            if kind == 'pdf':
+                _, page = next(iter_pages(file.filename, image_bytes, requested_dpi()))
+                ok, buffer = cv2.imencode('.png', page)
+                if not ok:
+                    return jsonify({'error': 'Could not rasterize the PDF page'}), 500
+                image_bytes = buffer.tobytes()
+                filename = f"{filename}.png"
             
-            # Scan for shaded circles
-            print("🔍 Starting circle scan...")
-            result = scanner.scan_shaded_circles(filepath)
-            print("✅ Scan completed")
+            # Known forms skip the Hough search and use the template layout
+            template_name = request.form.get('template')
+            template = None
+            if template_name:
+                template = template_registry.get(template_name)
+                if template is None:
+                    return jsonify({'error': f'Unknown template: {template_name}'}), 404
+            
+            # Optional perspective correction to the canonical page size;
+            # webcam sessions reuse the last homography while the page is still
+            register = request.form.get('register', '').lower() in ('1', 'true', 'yes')
+            
+            # Identical bytes + identical parameters = identical result
+            result_key = cache_key(
+                image_bytes,
+                scanner.params_fingerprint(),
+                template.fingerprint if template is not None else '',
+                registration_fingerprint() if register else ''
+            )
+            result = result_cache.get(result_key)
+            cached = result is not None
+            scan_ms = None
+            
+            if cached:
+                logger.debug("Result cache hit, skipping scan")
+            else:
+                # Scan for shaded circles in the process pool
+                logger.debug("Starting circle scan")
+                try:
+                    scan_started = time.time()
+                    result = scan_executor.run(
+                        image_bytes,
+                        timeout=SCAN_TIMEOUT,
+                        template=template,
+                        debug=False,
+                        register=register,
+                        session=request.form.get('session')
+                    )
+                except ScanQueueFull:
+                    logger.warning("Scan queue full, rejecting upload")
+                    return scanner_busy_response()
+                except ScanTimeout:
+                    return jsonify({'error': 'Scan timed out'}), 504
+                scan_ms = (time.time() - scan_started) * 1000
+                logger.debug("Scan completed in %.1f ms", scan_ms)
+                observe_scan(result)
             
             # Handle scan errors
             if 'error' in result:
                 return jsonify({'error': result['error']}), 500
             
-            # Save debug image
-            debug_filename = f"circle_debug_{filename}"
-            debug_path = os.path.join(RESULTS_FOLDER, debug_filename)
+            # Keep a copy of the uploaded file (queued for the storage backend)
+            # for the debug overlay. Cache hits are stored too: the first
+            # upload of the same bytes may already have been swept.
+            result.pop('source_file', None)  # Set by older cache entries
+            result.pop('timings', None)
+            result.pop('megapixels', None)
+            storage.put(f"{UPLOAD_FOLDER}/{filename}", image_bytes)
+            if not cached:
+                result_cache.put(result_key, result)
             
-            if 'debug_image' in result:
-                cv2.imwrite(debug_path, result['debug_image'])
-                print(f"💾 Debug image saved: {debug_filename}")
-                
-                # Convert debug image to base64 for web display
-                _, buffer = cv2.imencode('.jpg', result['debug_image'])
-                debug_image_b64 = base64.b64encode(buffer).decode('utf-8')
-                
-                # Remove debug_image from results as it's not JSON serializable
-                del result['debug_image']
-            else:
-                debug_image_b64 = None
+            # Typed result model: serialized once, straight to JSON bytes
+            scan = ScanResult.from_dict(result)
+            response_data = {
+                'success': True,
+                'result_id': result_id,
+                'filename': filename,
+                'cached': cached,
+                'results': scan,
+                'debug_image_url': f'/results/{result_id}/debug.jpg',
+                'summary': scan.summary()
+            }
+            encode_started = time.perf_counter()
+            payload = dumps(response_data)
+            observe_stage('encode', time.perf_counter() - encode_started)
             
-            # Convert numpy types to JSON-serializable types
-            print("🔄 Converting numpy types...")
-            result = convert_numpy_types(result)
-            print("✅ Conversion completed")
+            # Save results as JSON (the full response, reused byte for byte)
+            storage.put(f"{RESULTS_FOLDER}/circle_results_{result_id}.json", payload)
+            results_index.record(
+                result_id, result, 'upload',
+                filename=filename,
+                scan_ms=scan_ms,
+                total_ms=(time.time() - started) * 1000,
+                cached=cached
+            )
             
-            # Prepare response
-            try:
-                response_data = {
-                    'success': True,
-                    'filename': filename,
-                    'results': result,
-                    'debug_image': debug_image_b64,
-                    'summary': {
-                        'total_circles': result.get('total_circles', 0),
-                        'total_selected': result.get('total_selected', 0),
-                        'scan_type': result.get('scan_type', 'CIRCLE SCAN')
-                    }
-                }
-                print("✅ Response prepared successfully")
-            except Exception as e:
-                print(f"❌ Response preparation error: {e}")
-                return jsonify({'error': f'Response preparation failed: {str(e)}'}), 500
+            # ?format=binary returns the compact circle table;
+            # ?view=summary drops the per-circle data
+            output_format = request.values.get('format', 'json').lower()
+            if output_format == 'binary':
+                response = Response(scan.to_binary(), mimetype=BINARY_MIMETYPE)
+                response.headers['X-Result-Id'] = result_id
+                return response
             
-            # Save results as JSON
-            print("💾 Saving results...")
-            try:
-                results_filename = f"circle_results_{timestamp}.json"
-                results_path = os.path.join(RESULTS_FOLDER, results_filename)
-                # Create a safe copy for JSON serialization
-                safe_response = convert_numpy_types(response_data.copy())
-                with open(results_path, 'w', encoding='utf-8') as f:
-                    json.dump(safe_response, f, indent=2, ensure_ascii=False, default=str)
-                print("✅ Results saved successfully")
-            except Exception as e:
-                print(f"⚠️ Results save warning: {e}")
-                # Continue execution even if save fails
-            print("🚀 Sending response...")
-            # Ensure response is JSON serializable
-            try:
-                # Test JSON serialization before sending
-                json.dumps(response_data, default=str)
-                return jsonify(response_data)
-            except Exception as json_error:
-                print(f"❌ JSON serialization error: {json_error}")
-                # Return a simplified response
-                return jsonify({
-                    'success': True,
-                    'filename': filename,
-                    'results': {
-                        'success': True,
-                        'total_circles': len(result.get('shaded_selections', [])),
-                        'total_selected': len([s for s in result.get('shaded_selections', []) if s]),
-                        'shaded_selections': [
-                            {
-                                'item': str(sel.get('item', 'Unknown')),
-                                'fill_percent': float(sel.get('fill_percent', 0))
-                            } for sel in result.get('shaded_selections', [])
-                        ]
-                    },
-                    'summary': {
-                        'total_circles': len(result.get('shaded_selections', [])),
-                        'total_selected': len([s for s in result.get('shaded_selections', []) if s]),
-                        'scan_type': 'CIRCLE SCAN'
-                    }
-                })
+            if request.values.get('view', 'full').lower() == 'summary':
+                del response_data['results']
+                payload = dumps(response_data)
+            
+            logger.info(
+                "Upload scanned: %d/%d selected", scan.total_selected, len(scan.circles),
+                extra={
+                    'result_id': result_id,
+                    'cached': cached,
+                    'circles': len(scan.circles),
+                    'selected': scan.total_selected,
+                    'scan_ms': round(scan_ms, 1) if scan_ms is not None else None,
+                    'total_ms': round((time.time() - started) * 1000, 1)
+                }
+            )
+            return Response(payload, mimetype='application/json')
         
         else:
             return jsonify({'error': 'Invalid file type. Please upload PNG, JPG, JPEG, or GIF'}), 400
             
     except Exception as e:
-        print(f"❌ Upload error: {str(e)}")
+        logger.exception("Upload error: %s", e)
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/results/<result_id>/debug.jpg', methods=['GET'])
+def result_debug_image(result_id):
+    """Annotated overlay of a stored scan, rendered on first request (?quality=10-100)"""
+    try:
+        if not _RESULT_ID.match(result_id):
+            return jsonify({'error': 'Result not found'}), 404
+        
+        stored = storage.get(f"{RESULTS_FOLDER}/circle_results_{result_id}.json")
+        if stored is None:
+            return jsonify({'error': 'Result not found'}), 404
+        record = json.loads(stored)
+        
+        quality = request.args.get('quality', DEBUG_JPEG_QUALITY, type=int)
+        quality = min(100, max(10, quality))
+        
+        source = storage.get(f"{UPLOAD_FOLDER}/{record['filename']}")
+        jpeg = debug_renderer.render(result_id, source, record['results'], quality) if source else None
+        if jpeg is None:
+            return jsonify({'error': 'Source image is no longer available'}), 410
+        
+        # A stored result never changes, so clients may cache the overlay forever
+        response = Response(jpeg, mimetype='image/jpeg')
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response.headers['ETag'] = f'"{result_id}-{quality}"'
+        return response
+        
+    except Exception as e:
+        logger.exception("Debug image error: %s", e)
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+def parse_time(value, default=None):
+    """Query-string time: unix seconds, ISO 8601, or negative seconds relative to now"""
+    if value is None or value == '':
+        return default
+    try:
+        seconds = float(value)
+        return time.time() + seconds if seconds < 0 else seconds
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/results', methods=['GET'])
+def query_results():
+    """Indexed scans by time range (?since=&until=), selected item, source and classifier"""
+    try:
+        scans = results_index.scans(
+            since=parse_time(request.args.get('since')),
+            until=parse_time(request.args.get('until')),
+            item=request.args.get('item'),
+            source=request.args.get('source'),
+            classifier=request.args.get('classifier'),
+            limit=min(1000, request.args.get('limit', 100, type=int))
+        )
+        return jsonify({'success': True, 'count': len(scans), 'scans': scans})
+    except ValueError as e:
+        return jsonify({'error': f'Invalid time: {str(e)}'}), 400
+    except Exception as e:
+        logger.exception("Results query error: %s", e)
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/results/items', methods=['GET'])
+def item_totals():
+    """Per-item selection counts (per fill classifier); defaults to the last hour"""
+    try:
+        since = parse_time(request.args.get('since'), time.time() - 3600)
+        until = parse_time(request.args.get('until'))
+        items = results_index.item_counts(
+            since=since, until=until,
+            source=request.args.get('source'),
+            classifier=request.args.get('classifier')
+        )
+        return jsonify({'success': True, 'since': since, 'until': until, 'items': items})
+    except ValueError as e:
+        return jsonify({'error': f'Invalid time: {str(e)}'}), 400
+    except Exception as e:
+        logger.exception("Item totals error: %s", e)
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/batch', methods=['POST'])
+def batch_scan():
+    """
+    Scan many sheets in one request: several 'files' parts and/or zip
+    archives (multi-page PDFs and TIFFs are scanned page by page).
+    Streams one JSON line per sheet as each scan finishes.
+    """
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    uploads = [f for f in uploads if f.filename]
+    if not uploads:
+        return jsonify({'error': 'No files uploaded'}), 400
+    
+    options = {'debug': False}
+    template_name = request.form.get('template')
+    if template_name:
+        options['template'] = template_registry.get(template_name)
+        if options['template'] is None:
+            return jsonify({'error': f'Unknown template: {template_name}'}), 404
+    
+    # Spool the parts to temporary files before streaming starts (the
+    # request's files are closed once the view returns). Only one sheet is
+    # read into memory at a time; zip members are decompressed one by one.
+    spooled = []
+    try:
+        for upload in uploads:
+            spool = tempfile.TemporaryFile()
+            spooled.append((upload.filename, spool))
+            shutil.copyfileobj(upload.stream, spool)
+            spool.seek(0)
+    except Exception:
+        for _, spool in spooled:
+            spool.close()
+        raise
+    
+    def sheets():
+        for filename, spool in spooled:
+            if filename.lower().endswith('.zip'):
+                yield from iter_zip_sheets(spool)
+            elif is_sheet_name(filename):
+                yield filename, spool.read()
+            spool.close()
+    
+    logger.info("Batch request received: %d upload(s)", len(uploads))
+    response = stream_sheet_records(expand_documents(sheets(), requested_dpi()), 'batch', **options)
+    response.call_on_close(lambda: [spool.close() for _, spool in spooled])
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Accept an image for background scanning and return a job ID immediately"""
+    try:
+        if 'file' not in request.files or request.files['file'].filename == '':
+            return jsonify({'error': 'No file uploaded'}), 400
+        
+        image_bytes = request.files['file'].read()
+        if not image_bytes:
+            return jsonify({'error': 'Empty file'}), 400
+        
+        options = {
+            'register': request.form.get('register', '').lower() in ('1', 'true', 'yes'),
+            'session': request.form.get('session')
+        }
+        template_name = request.form.get('template')
+        if template_name:
+            if template_registry.get(template_name) is None:
+                return jsonify({'error': f'Unknown template: {template_name}'}), 404
+            options['template'] = template_name
+        
+        try:
+            job = job_manager.submit(image_bytes, options)
+        except JobQueueFull:
+            return scanner_busy_response()
+        
+        logger.info("Job queued: %s", job['id'], extra={'job_id': job['id']})
+        status_url = f"/jobs/{job['id']}"
+        response = jsonify({
+            'success': True,
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': status_url
+        })
+        response.headers['Location'] = status_url
+        return response, 202
+        
+    except Exception as e:
+        logger.exception("Job submission error: %s", e)
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll a scan job's status; the result is included once it is done"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """Re-run a failed job from its stored upload"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    try:
+        job = job_manager.retry(job_id)
+    except JobQueueFull:
+        return scanner_busy_response()
+    if job is None:
+        return jsonify({'error': 'Only failed jobs with a stored upload can be retried'}), 409
+    
+    return jsonify({'success': True, 'job_id': job_id, 'status': job['status']}), 202
+
+@app.route('/templates', methods=['GET'])
+def list_templates():
+    """List registered form templates"""
+    return jsonify({'templates': template_registry.names()})
+
+@app.route('/templates', methods=['POST'])
+def register_template():
+    """Register a form template from a clean reference scan"""
+    try:
+        name = request.form.get('name', '').strip()
+        if not name:
+            return jsonify({'error': 'Template name is required'}), 400
+        if not valid_template_name(name):
+            return jsonify({'error': 'Template name must not contain path separators'}), 400
+        
+        if 'file' not in request.files or request.files['file'].filename == '':
+            return jsonify({'error': 'No reference image uploaded'}), 400
+        
+        items = request.form.get('items')
+        items = [item.strip() for item in items.split(',') if item.strip()] if items else None
+        
+        template = template_from_image(scanner, name, request.files['file'].read(), items)
+        if template is None:
+            return jsonify({'error': 'Could not load reference image'}), 400
+        if not template.bubbles:
+            return jsonify({'error': 'No bubbles detected in reference image'}), 400
+        
+        template_registry.register(template)
+        logger.info("Template registered: %s (%d bubbles, %d anchors)", name, len(template.bubbles), len(template.anchors))
+        
+        return jsonify({'success': True, 'template': template.to_dict()})
+        
+    except Exception as e:
+        logger.exception("Template registration error: %s", e)
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 @app.route('/webcam')
@@ -575,6 +1043,7 @@ def webcam_scanner():
                     <button id="startBtn" class="btn">📷 Start Camera</button>
                     <button id="captureBtn" class="btn" disabled>📸 Capture & Scan</button>
                     <button id="stopBtn" class="btn" disabled>⏹️ Stop Camera</button>
+                    <button id="liveBtn" class="btn" disabled>🔴 Live Scan</button>
                 </div>
                 
                 <div id="status"></div>
@@ -602,9 +1071,18 @@ def webcam_scanner():
             const results = document.getElementById('results');
             const resultContent = document.getElementById('resultContent');
             const sendToPOSBtn = document.getElementById('sendToPOSBtn');
+            const liveBtn = document.getElementById('liveBtn');
             
             let stream = null;
             let lastScanResult = null;
+            let liveSocket = null;
+            
+            // Live frames are downscaled before encoding to keep uploads small
+            const LIVE_FRAME_WIDTH = 960;
+            const LIVE_FRAME_INTERVAL_MS = 100;
+            
+            // Identifies this camera session so the server can reuse the page registration
+            const sessionId = 'webcam-' + Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
 
             function showStatus(message, type = 'info') {
                 status.innerHTML = `<div class="status ${type}">${message}</div>`;
@@ -627,6 +1105,7 @@ def webcam_scanner():
                     startBtn.disabled = true;
                     captureBtn.disabled = false;
                     stopBtn.disabled = false;
+                    liveBtn.disabled = false;
                     
                     showStatus('✅ Camera ready! Position your OMR form and click Capture', 'success');
                     
@@ -637,6 +1116,8 @@ def webcam_scanner():
             }
 
             function stopCamera() {
+                stopLive();
+                
                 if (stream) {
                     stream.getTracks().forEach(track => track.stop());
                     stream = null;
@@ -647,10 +1128,104 @@ def webcam_scanner():
                 startBtn.disabled = false;
                 captureBtn.disabled = true;
                 stopBtn.disabled = true;
+                liveBtn.disabled = true;
                 
                 showStatus('📷 Camera stopped', 'info');
             }
 
+            function sendLiveFrame() {
+                if (!liveSocket || liveSocket.readyState !== WebSocket.OPEN || !video.videoWidth) {
+                    return;
+                }
+                
+                const scale = Math.min(1, LIVE_FRAME_WIDTH / video.videoWidth);
+                canvas.width = Math.round(video.videoWidth * scale);
+                canvas.height = Math.round(video.videoHeight * scale);
+                ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
+                
+                canvas.toBlob((blob) => {
+                    if (blob && liveSocket && liveSocket.readyState === WebSocket.OPEN) {
+                        liveSocket.send(blob);
+                    }
+                }, 'image/jpeg', 0.7);
+            }
+
+            function displayLiveSelection(message) {
+                let html = `
+                    <div style="margin-bottom: 15px;">
+                        <strong>🔴 Live:</strong> ${message.total_circles} circles,
+                        ${message.selected.length} selected (${message.latency_ms} ms)
+                    </div>
+                `;
+                
+                if (message.selected.length > 0) {
+                    html += '<div><strong>🛒 Selected Items:</strong><ul>';
+                    message.selected.forEach(item => {
+                        html += `<li>${item}</li>`;
+                    });
+                    html += '</ul></div>';
+                } else {
+                    html += '<div>⚠️ No items detected</div>';
+                }
+                
+                resultContent.innerHTML = html;
+                results.style.display = 'block';
+                
+                lastScanResult = {
+                    results: {
+                        shaded_selections: message.selected.map(item => ({ item: item }))
+                    }
+                };
+            }
+
+            function startLive() {
+                const protocol = location.protocol === 'https:' ? 'wss' : 'ws';
+                liveSocket = new WebSocket(`${protocol}://${location.host}/ws/scan`);
+                
+                liveSocket.onopen = () => {
+                    liveBtn.textContent = '⏸️ Stop Live';
+                    showStatus('🔴 Live scanning...', 'info');
+                    sendLiveFrame();
+                };
+                
+                liveSocket.onmessage = (event) => {
+                    const message = JSON.parse(event.data);
+                    if (message.type === 'delta') {
+                        displayLiveSelection(message);
+                    } else if (message.type === 'error') {
+                        showStatus(`⚠️ ${message.error}`, 'error');
+                    }
+                    // Each reply acknowledges a frame: send the next one
+                    setTimeout(sendLiveFrame, LIVE_FRAME_INTERVAL_MS);
+                };
+                
+                liveSocket.onclose = () => {
+                    liveSocket = null;
+                    liveBtn.textContent = '🔴 Live Scan';
+                };
+                
+                liveSocket.onerror = () => {
+                    showStatus('❌ Live scanning is unavailable', 'error');
+                };
+            }
+
+            function stopLive() {
+                if (liveSocket) {
+                    liveSocket.close();
+                    liveSocket = null;
+                }
+                liveBtn.textContent = '🔴 Live Scan';
+            }
+
+            function toggleLive() {
+                if (liveSocket) {
+                    stopLive();
+                    showStatus('⏸️ Live scanning stopped', 'info');
+                } else {
+                    startLive();
+                }
+            }
+
             async function captureAndScan() {
                 try {
                     showStatus('📸 Capturing image...', 'info');
@@ -666,6 +1241,8 @@ def webcam_scanner():
                     canvas.toBlob(async (blob) => {
                         const formData = new FormData();
                         formData.append('file', blob, 'webcam_capture.jpg');
+                        formData.append('register', '1');
+                        formData.append('session', sessionId);
                         
                         showStatus('🔍 Scanning for circles...', 'info');
                         
@@ -757,6 +1334,7 @@ def webcam_scanner():
             startBtn.addEventListener('click', startCamera);
             captureBtn.addEventListener('click', captureAndScan);
             stopBtn.addEventListener('click', stopCamera);
+            liveBtn.addEventListener('click', toggleLive);
             sendToPOSBtn.addEventListener('click', sendToPOS);
 
             // Auto-start camera on page load
@@ -773,87 +1351,170 @@ def webcam_scanner():
     </html>
     '''
 
+# Each live socket holds one of the worker's GUNICORN_THREADS threads for
+# the whole session, so by default one thread is always left for HTTP
+LIVE_MAX_SESSIONS = int(os.environ.get('LIVE_MAX_SESSIONS', max(1, int(os.environ.get('GUNICORN_THREADS', '2')) - 1)))
+live_sessions = threading.BoundedSemaphore(LIVE_MAX_SESSIONS)
+
+if Sock is not None:
+    sock = Sock(app)
+    
+    @sock.route('/ws/scan')
+    def live_scan(ws):
+        """Stream webcam frames in, selection deltas out"""
+        if not live_sessions.acquire(blocking=False):
+            logger.warning("Live session rejected: %d already running", LIVE_MAX_SESSIONS)
+            ws.send(json.dumps({'type': 'error', 'error': 'Too many live sessions, please retry shortly'}))
+            return
+        try:
+            session = LiveScanSession(scan_executor, f"live-{uuid.uuid4().hex}", scanner, scan_timeout=SCAN_TIMEOUT)
+            logger.info("Live session started: %s", session.session_id)
+            stats = run_live_session(ws, session)
+            logger.info("Live session ended: %s", session.session_id, extra={'stats': stats})
+        finally:
+            live_sessions.release()
+
+def read_capture_image():
+    """
+    Encoded image bytes from a /capture request: a raw image/* or
+    application/octet-stream body, or JSON {"image": "<base64 or data URL>"}.
+    Returns None if the request carries no image.
+    """
+    if request.mimetype == 'application/json':
+        data = request.get_json(silent=True)
+        if not data or not data.get('image'):
+            return None
+        image_data = data['image']
+        if image_data.startswith('data:image'):
+            image_data = image_data.split(',', 1)[1]
+        try:
+            return base64.b64decode(image_data)
+        except (binascii.Error, ValueError):
+            return None
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        return request.get_data(cache=False) or None
+    return None
+
 @app.route('/capture', methods=['POST'])
 def capture_webcam():
-    """Handle webcam capture data"""
+    """
+    Scan one webcam frame. Kiosks should POST the JPEG as the raw body
+    (Content-Type: image/jpeg); base64 JSON is still accepted. The frame is
+    scanned from memory in the process pool (?register=1&session=<id> for
+    perspective correction with homography reuse). The scan is returned
+    under both 'result' (as always) and 'results' (as from /upload).
+    """
     try:
-        print("📸 Webcam capture request received")
+        started = time.time()
+        logger.debug("Webcam capture request received")
         
-        # Get base64 image data from request
-        data = request.get_json()
-        if not data or 'image' not in data:
+        image_bytes = read_capture_image()
+        if image_bytes is None:
             return jsonify({'error': 'No image data provided'}), 400
         
-        # Decode base64 image
-        image_data = data['image']
-        if image_data.startswith('data:image'):
-            image_data = image_data.split(',')[1]
+        capture_id = uuid.uuid4().hex
+        filename = f"webcam_capture_{capture_id}.jpg"
+        register = request.values.get('register', '').lower() in ('1', 'true', 'yes')
         
-        image_bytes = base64.b64decode(image_data)
+        try:
+            scan_started = time.time()
+            result = scan_executor.run(
+                image_bytes,
+                timeout=SCAN_TIMEOUT,
+                debug=False,
+                register=register,
+                session=request.values.get('session')
+            )
+        except ScanQueueFull:
+            logger.warning("Scan queue full, rejecting capture")
+            return scanner_busy_response()
+        except ScanTimeout:
+            return jsonify({'error': 'Scan timed out'}), 504
+        scan_ms = (time.time() - scan_started) * 1000
         
-        # Convert to numpy array
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if 'error' in result:
+            if result['error'] == 'Could not load image':
+                return jsonify({'error': 'Invalid image data'}), 400
+            return jsonify({'error': result['error']}), 500
         
-        if image is None:
-            return jsonify({'error': 'Invalid image data'}), 400
+        observe_scan(result)
+        result.pop('timings', None)
+        result.pop('megapixels', None)
         
-        # Save the captured image
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"webcam_capture_{timestamp}.jpg"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        cv2.imwrite(filepath, image)
+        if not result['circles']:
+            return jsonify({'error': 'No circles detected in webcam capture'}), 400
         
-        print(f"📸 Processing webcam capture: {filename}")
+        # Stored like uploads, so /results/<id>/debug.jpg works for captures too
+        storage.put(f"{UPLOAD_FOLDER}/{filename}", image_bytes)
+        scan = ScanResult.from_dict(result)
+        result_filename = f"circle_results_{capture_id}.json"
+        response_data = {
+            'success': True,
+            'result_id': capture_id,
+            'filename': filename,
+            'result_file': result_filename,
+            'circles_found': len(scan.circles),
+            'message': f'Successfully processed webcam capture with {len(scan.circles)} circles',
+            # 'result' for existing /capture clients, 'results' as in /upload
+            'result': scan,
+            'results': scan,
+            'debug_image_url': f'/results/{capture_id}/debug.jpg',
+            'summary': scan.summary()
+        }
+        encode_started = time.perf_counter()
+        payload = dumps(response_data)
+        observe_stage('encode', time.perf_counter() - encode_started)
         
-        # Process with scanner
-        result = scanner.scan_image(image)
+        storage.put(f"{RESULTS_FOLDER}/{result_filename}", payload)
+        results_index.record(
+            capture_id, result, 'capture',
+            filename=filename,
+            scan_ms=scan_ms,
+            total_ms=(time.time() - started) * 1000
+        )
+        
+        logger.info(
+            "Webcam capture scanned: %d/%d selected", scan.total_selected, len(scan.circles),
+            extra={
+                'result_id': capture_id,
+                'circles': len(scan.circles),
+                'selected': scan.total_selected,
+                'scan_ms': round(scan_ms, 1),
+                'total_ms': round((time.time() - started) * 1000, 1)
+            }
+        )
+        return Response(payload, mimetype='application/json')
         
-        if result and 'circles' in result:
-            print(f"✅ Found {len(result['circles'])} circles")
-            
-            # Save results
-            result_filename = f"webcam_result_{timestamp}.json"
-            result_path = os.path.join(RESULTS_FOLDER, result_filename);
-            
-            with open(result_path, 'w') as f:
-                json.dump(result, f, indent=2, cls=NumpyEncoder);
-            
-            return jsonify({
-                'success': True,
-                'filename': filename,
-                'result_file': result_filename,
-                'circles_found': len(result['circles']),
-                'message': f'Successfully processed webcam capture with {len(result["circles"])} circles',
-                'result': convert_numpy_types(result)
-            })
-        else:
-            return jsonify({'error': 'No circles detected in webcam capture'}), 400
-            
     except Exception as e:
-        print(f"❌ Webcam capture error: {str(e)}")
+        logger.exception("Webcam capture error: %s", e)
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 @app.route('/status')
 def server_status():
-    """Check if the OMR server is running"""
+    """Check if the OMR server is running, with current scan load"""
     return jsonify({
         'status': 'running',
         'message': 'OMR Scanner Server is active',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'scans_pending': scan_executor.pending,
+        'scan_capacity': scan_executor.capacity,
+        'jobs_waiting': job_manager.waiting
     })
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == '__main__':
-    # Configuration for online deployment
+    # Flask development server - production runs under gunicorn with the
+    # preloaded multi-worker config (see scanner/gunicorn.conf.py):
+    #   gunicorn -c gunicorn.conf.py omr_web_circle_scanner:app
     import os
     port = int(os.environ.get('PORT', 5000))
     host = os.environ.get('HOST', '0.0.0.0')  # Allow external connections
     debug = os.environ.get('DEBUG', 'False').lower() == 'true'
     
-    print(f"🚀 Starting OMR Scanner Server...")
-    print(f"📡 Host: {host}")
-    print(f"🔌 Port: {port}")
-    print(f"🐛 Debug: {debug}")
-    print(f"🌐 Access: http://{host}:{port}")
+    logger.info("Starting OMR Scanner Server on http://%s:%s (debug=%s)", host, port, debug)
     
     app.run(debug=debug, host=host, port=port)
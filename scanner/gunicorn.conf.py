@@ -0,0 +1,52 @@
+"""
+Gunicorn configuration for the OMR Scanner Server (production serving)
+The app is preloaded in the master process, so cv2/numpy are imported and
+OMRCircleScanner is built once before the workers fork.
+
+Environment variables:
+    HOST / PORT                 bind address (defaults 0.0.0.0:5000)
+    WEB_CONCURRENCY             worker processes (default: CPU count)
+    GUNICORN_THREADS            threads per worker (default 2)
+    GUNICORN_TIMEOUT            seconds before a stuck worker is restarted (default 120)
+    GUNICORN_GRACEFUL_TIMEOUT   seconds to finish in-flight scans on restart (default 30)
+    GUNICORN_KEEPALIVE          keep-alive seconds (default 5)
+    GUNICORN_MAX_REQUESTS       recycle workers after N requests (default 1000, 0 = never)
+    LOG_LEVEL                   gunicorn and application log level (default info)
+    LOG_FORMAT                  application log format: json (default) or text
+
+Scans themselves run in each worker's process pool (omr_executor), sized
+by SCAN_WORKERS / SCAN_QUEUE_SIZE / SCAN_TIMEOUT / OPENCV_THREADS. By
+default each pool gets cores / workers processes, so all pools together
+use one process per core. Each live WebSocket holds a thread for its whole
+session; LIVE_MAX_SESSIONS (default GUNICORN_THREADS - 1) caps them per
+worker so HTTP requests always keep a thread.
+"""
+
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5000')}"
+
+# Scans are CPU-bound: one process per core, a couple of threads each so
+# I/O (uploads, responses) overlaps with scanning
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# The preloaded app sizes each worker's scan pool as cores / workers, so it
+# must see the worker count actually used even when WEB_CONCURRENCY is unset
+os.environ['WEB_CONCURRENCY'] = str(workers)
+threads = int(os.environ.get('GUNICORN_THREADS', '2'))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+# Recycle workers periodically to bound memory growth from large images
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = max_requests // 10
+
+# Import cv2/numpy and build the scanner once, before forking
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
@@ -5,5 +5,5 @@ echo "📋 Files in directory: $(ls -la)"
 echo "🐍 Python version: $(python --version)"
 echo "📦 Installing requirements..."
 pip install -r requirements.txt
-echo "🚀 Starting Flask app..."
-python omr_web_circle_scanner.py
+echo "🚀 Starting gunicorn..."
+exec gunicorn -c gunicorn.conf.py omr_web_circle_scanner:app
@@ -0,0 +1,9 @@
+"""
+Shared fixtures. The omr_* modules live at the repository root, next to
+this folder, so it is put on the import path for every test.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,59 @@
+"""
+Result cache: keys follow every parameter that changes a result, and
+both tiers stay within their bounds
+"""
+
+import os
+import time
+
+from omr_cache import ResultCache, cache_key
+from omr_circle_scanner import OMRCircleScanner
+from omr_synthetic import encode_sheet, generate_sheet
+
+def test_key_follows_image_and_parameters():
+    image_bytes = encode_sheet(generate_sheet(seed=0)[0])
+    scanner = OMRCircleScanner()
+    key = cache_key(image_bytes, scanner.params_fingerprint(), '', '')
+
+    assert cache_key(image_bytes, scanner.params_fingerprint(), '', '') == key
+    assert cache_key(image_bytes + b'\0', scanner.params_fingerprint(), '', '') != key
+    assert cache_key(image_bytes, scanner.params_fingerprint(), 'template', '') != key
+
+    scanner.min_dark_ratio += 0.05
+    assert cache_key(image_bytes, scanner.params_fingerprint(), '', '') != key
+
+def test_cached_result_matches_scan_and_is_a_copy():
+    image_bytes = encode_sheet(generate_sheet(seed=1)[0])
+    result = OMRCircleScanner().scan_image(image_bytes, debug=False)
+    cache = ResultCache()
+    key = cache_key(image_bytes)
+    cache.put(key, result)
+
+    cached = cache.get(key)
+    assert [c['is_shaded'] for c in cached['circles']] == [c['is_shaded'] for c in result['circles']]
+    cached['circles'].clear()
+    assert cache.get(key)['circles']
+    assert (cache.hits, cache.misses) == (2, 0)
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(max_bytes=200)
+    for key in 'abc':
+        cache.put(key, {'circles': [], 'pad': 'x' * 40})
+    cache.get('a')
+    cache.put('d', {'circles': [], 'pad': 'x' * 40})
+
+    assert cache.size <= 200
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+
+def test_disk_tier_is_shared_and_expires(tmp_path):
+    folder = str(tmp_path)
+    ResultCache(folder=folder).put('ab' * 20, {'circles': []})
+    assert ResultCache(max_bytes=0, folder=folder).get('ab' * 20) == {'circles': []}
+
+    path = os.path.join(folder, 'ab', f"{'ab' * 20}.json")
+    old = time.time() - 7200
+    os.utime(path, (old, old))
+    cache = ResultCache(max_bytes=0, folder=folder, disk_max_age_seconds=3600)
+    assert not os.path.exists(path)
+    assert cache.get('ab' * 20) is None
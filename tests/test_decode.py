@@ -0,0 +1,87 @@
+"""
+Decode factor, bubble radius range and debug independence of scan_image(),
+checked on synthetic sheets with known answers (omr_synthetic)
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from omr_benchmark import AccuracyTally
+from omr_circle_scanner import OMRCircleScanner
+from omr_synthetic import encode_sheet, generate_sheet
+
+@pytest.fixture(scope='module')
+def scanner():
+    return OMRCircleScanner()
+
+def blank_jpeg(width, height):
+    ok, buffer = cv2.imencode('.jpg', np.full((height, width), 240, np.uint8))
+    assert ok
+    return buffer.tobytes()
+
+def verdicts(result):
+    return [(c['center'], c['radius'], c['is_shaded']) for c in result['circles']]
+
+@pytest.mark.parametrize('width, height, factor', [
+    (900, 1200, 1),
+    (3000, 4000, 1),   # 40 px smallest bubbles would drop to 20 px at 1/2
+    (4500, 6000, 2),
+    (6000, 8000, 2),
+    (12000, 16000, 4)
+])
+def test_decode_factor_keeps_smallest_bubble(scanner, width, height, factor):
+    assert scanner.decode_factor(None, (width, height)) == factor
+    smallest = max(width, height) * scanner.min_bubble_ratio
+    if factor > 1:
+        assert smallest / factor >= scanner.decode_min_radius
+    assert smallest / (factor * 2) < scanner.decode_min_radius
+
+def test_decode_factor_reads_the_header(scanner):
+    jpeg = blank_jpeg(4500, 6000)
+    assert scanner.image_size(jpeg) == (4500, 6000)
+    assert scanner.decode_factor(jpeg) == 2
+    assert scanner.decode_factor(b'not an image') == 1
+
+@pytest.mark.parametrize('side', [1200, 2200, 4000, 8000])
+def test_hough_range_covers_expected_bubbles(scanner, side):
+    params = scanner.bubble_hough_params(side)
+    assert params['maxRadius'] >= side * scanner.max_bubble_ratio
+    if params is not scanner.hough_params:
+        assert params['minRadius'] <= side * scanner.min_bubble_ratio
+
+def test_small_images_keep_default_hough_params(scanner):
+    assert scanner.bubble_hough_params(1200) is scanner.hough_params
+
+def test_full_size_decode_is_colour(scanner):
+    image, _ = generate_sheet(seed=1)
+    jpeg = encode_sheet(image)
+    frame = scanner.prepare_image(jpeg, reduce=True)
+    reference = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+    assert 'decode_scale' not in frame
+    assert np.array_equal(frame['image'], reference)
+    assert np.array_equal(frame['gray'], cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY))
+
+@pytest.mark.parametrize('width, height, radius', [
+    (900, 1200, 30),
+    (3000, 4000, 60),
+    (3000, 4000, 120),
+    (6000, 8000, 120)
+])
+def test_large_photos_read_the_same_with_debug(scanner, width, height, radius):
+    image, truth = generate_sheet(width, height, bubbles=8, radius=radius, noise=4, blur=1.0, seed=3)
+    jpeg = encode_sheet(image)
+    del image
+
+    plain = scanner.scan_image(jpeg, debug=False)
+    debug = scanner.scan_image(jpeg, debug=True)
+
+    tally = AccuracyTally()
+    tally.add(truth, plain['circles'])
+    assert tally.matched == len(truth)
+    assert tally.correct_fill == len(truth)
+    assert verdicts(plain) == verdicts(debug)
+
+    overlay = debug['debug_image']
+    assert overlay.shape == (height, width, 3)
+    assert plain['megapixels'] == pytest.approx(width * height / 1e6, abs=0.001)
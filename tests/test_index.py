@@ -0,0 +1,81 @@
+"""
+Results index: item totals, cache hits, classifiers, retention and the
+schema migration
+"""
+
+import sqlite3
+import time
+
+import pytest
+
+from omr_index import ResultsIndex, _SCHEMA
+
+def scan_result(selected, classifier='fixed', items=('egg', 'water', 'beef')):
+    return {
+        'circles': [{'item': item, 'is_shaded': item in selected, 'fill_percent': 80.0 if item in selected else 5.0}
+                    for item in items],
+        'fill_classifier': classifier
+    }
+
+@pytest.fixture
+def index(tmp_path):
+    return ResultsIndex(str(tmp_path / 'index.db'))
+
+def totals(index, **filters):
+    return {(row['item'], row['classifier']): row for row in index.item_counts(since=0, **filters)}
+
+def test_item_totals(index):
+    index.record('a', scan_result({'egg'}), 'upload')
+    index.record('b', scan_result({'egg', 'beef'}), 'upload')
+    index.flush()
+
+    counts = totals(index)
+    assert counts[('egg', 'fixed')]['selected'] == 2
+    assert counts[('egg', 'fixed')]['scanned'] == 2
+    assert counts[('beef', 'fixed')]['selected'] == 1
+    assert counts[('water', 'fixed')]['avg_fill_percent'] is None
+
+def test_cache_hits_are_listed_but_not_counted(index):
+    for n in range(3):
+        index.record(f'first{n}', scan_result({'egg'}), 'upload')
+        index.record(f'again{n}', scan_result({'egg'}), 'upload', cached=True)
+    index.flush()
+
+    assert totals(index)[('egg', 'fixed')]['scanned'] == 3
+    scans = index.scans()
+    assert len(scans) == 6
+    assert sum(scan['cached'] for scan in scans) == 3
+
+def test_classifiers_are_kept_apart(index):
+    index.record('a', scan_result({'egg'}, 'fixed'), 'upload')
+    index.record('b', scan_result({'egg'}, 'adaptive'), 'upload')
+    index.flush()
+
+    assert set(totals(index)) >= {('egg', 'fixed'), ('egg', 'adaptive')}
+    assert set(totals(index, classifier='adaptive')) == {('egg', 'adaptive'), ('water', 'adaptive'), ('beef', 'adaptive')}
+    assert [scan['id'] for scan in index.scans(classifier='fixed')] == ['a']
+
+def test_retention_deletes_old_scans(tmp_path):
+    index = ResultsIndex(str(tmp_path / 'index.db'), max_age_seconds=3600)
+    index.record('old', scan_result({'egg'}), 'upload', created_at=time.time() - 7200)
+    index.record('new', scan_result({'egg'}), 'upload')
+    index.flush()
+    index.sweep()
+
+    assert [scan['id'] for scan in index.scans()] == ['new']
+    assert totals(index)[('egg', 'fixed')]['scanned'] == 1
+    circles = index._connect().execute('SELECT COUNT(*) FROM circles').fetchone()[0]
+    assert circles == 3
+
+def test_older_index_gains_classifier_column(tmp_path):
+    path = str(tmp_path / 'index.db')
+    connection = sqlite3.connect(path)
+    connection.executescript(_SCHEMA.replace(',\n    classifier TEXT', ''))
+    connection.execute("INSERT INTO scans VALUES ('legacy', ?, 'upload', NULL, NULL, 1, 1, NULL, NULL, 0)", (time.time(),))
+    connection.commit()
+    connection.close()
+
+    index = ResultsIndex(path)
+    index.record('new', scan_result({'egg'}, 'adaptive'), 'upload')
+    index.flush()
+    assert {scan['id']: scan['classifier'] for scan in index.scans()} == {'legacy': None, 'new': 'adaptive'}
@@ -0,0 +1,66 @@
+"""
+Scan jobs: a job waiting in a live owner's executor is not taken over by
+another process, and a job its owner stopped refreshing is
+"""
+
+import json
+import os
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from omr_jobs import JobManager
+
+class HeldExecutor:
+    """Accepts scans and only finishes them when released"""
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, source, **options):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def release(self):
+        for future in self.futures:
+            future.set_result({'circles': [], 'total_circles': 0, 'total_selected': 0})
+
+class OtherProcess(JobManager):
+    owner = 'other-host:1'
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.02)
+
+def test_job_held_by_live_owner_is_not_recovered(tmp_path):
+    executor = HeldExecutor()
+    owner = JobManager(executor, folder=str(tmp_path), stale_seconds=0.4)
+    other = OtherProcess(HeldExecutor(), folder=str(tmp_path), stale_seconds=0.4)
+
+    job = owner.submit(b'image')
+    wait_for(lambda: executor.futures)
+    time.sleep(1.2)  # Three times stale_seconds in the executor queue
+
+    assert other.get(job['id'])['owner'] == owner.owner
+    assert other.waiting == 0
+
+    executor.release()
+    wait_for(lambda: owner.get(job['id'])['status'] == 'done')
+    assert owner.get(job['id'])['attempts'] == 1
+
+def test_job_not_refreshed_is_recovered(tmp_path):
+    manager = JobManager(HeldExecutor(), folder=str(tmp_path), stale_seconds=0.4)
+    job_id = 'a' * 32
+    with open(os.path.join(str(tmp_path), f'{job_id}.input'), 'wb') as f:
+        f.write(b'image')
+    with open(os.path.join(str(tmp_path), f'{job_id}.json'), 'w') as f:
+        json.dump({
+            'id': job_id, 'status': 'running', 'attempts': 1, 'options': {}, 'error': None, 'result': None,
+            'owner': 'other-host:1', 'updated_at': (datetime.now() - timedelta(seconds=5)).isoformat()
+        }, f)
+
+    job = manager.get(job_id)
+    assert job['owner'] == manager.owner
+    assert job['error'] == 'Worker lost while the job was running'
@@ -0,0 +1,40 @@
+"""
+Template registry: reloading templates re-registered by another process
+and refusing names that are not plain file names
+"""
+
+import pytest
+
+from omr_templates import FormTemplate, TemplateRegistry
+
+def layout(name, items):
+    bubbles = [{'item': item, 'center': (100 + 50 * i, 200), 'radius': 12} for i, item in enumerate(items)]
+    return FormTemplate(name, (850, 1100), bubbles)
+
+def test_template_reloaded_after_another_registry_changes_it(tmp_path):
+    # Two workers sharing one templates folder
+    first, second = TemplateRegistry(str(tmp_path)), TemplateRegistry(str(tmp_path))
+    first.register(layout('menu', ['egg', 'water']))
+    old = second.get('menu')
+    assert [b['item'] for b in old.bubbles] == ['egg', 'water']
+    assert second.get('menu') is old
+
+    first.register(layout('menu', ['egg', 'water', 'beef']))
+    new = second.get('menu')
+    assert [b['item'] for b in new.bubbles] == ['egg', 'water', 'beef']
+    assert new.fingerprint != old.fingerprint
+
+def test_unpersisted_template_stays_cached(tmp_path):
+    registry = TemplateRegistry(str(tmp_path))
+    template = registry.register(layout('draft', ['egg']), persist=False)
+    assert registry.get('draft') is template
+    assert registry.get('missing') is None
+
+@pytest.mark.parametrize('name', ['a/x', '../x', 'a\\x', '.', '..', ''])
+def test_names_with_path_separators_are_refused(tmp_path, name):
+    registry = TemplateRegistry(str(tmp_path))
+    registry.register(layout('x', ['egg']))
+    with pytest.raises(ValueError):
+        registry.register(layout(name, ['egg']))
+    assert registry.get(name) is None
+    assert registry.names() == ['x']
@@ -0,0 +1,104 @@
+"""
+Web API paths around the result cache: repeated uploads, their debug
+overlays and the item totals they feed
+"""
+
+import importlib
+import io
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from omr_synthetic import encode_sheet, generate_sheet
+
+@pytest.fixture(scope='module')
+def web(tmp_path_factory):
+    # The app keeps its folders relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('web'))
+    saved = {name: os.environ.get(name) for name in ('SCAN_WORKERS', 'METRICS_FOLDER')}
+    os.environ.update(SCAN_WORKERS='0', METRICS_FOLDER='')
+    sys.modules.pop('omr_web_circle_scanner', None)
+    try:
+        yield importlib.import_module('omr_web_circle_scanner')
+    finally:
+        sys.modules.pop('omr_web_circle_scanner', None)
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        os.chdir(cwd)
+
+@pytest.fixture(scope='module')
+def sheets():
+    return [encode_sheet(generate_sheet(seed=seed)[0]) for seed in range(3)]
+
+def upload(client, image_bytes, name='sheet.jpg'):
+    response = client.post('/upload', data={'file': (io.BytesIO(image_bytes), name)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def test_cache_hit_keeps_its_own_debug_overlay(web, sheets):
+    client = web.app.test_client()
+    first = upload(client, sheets[0])
+    again = upload(client, sheets[0])
+    assert not first['cached'] and again['cached']
+    assert again['filename'] != first['filename']
+
+    # The original upload is swept before the repeat's overlay is asked for
+    web.storage.flush()
+    os.remove(os.path.join(web.UPLOAD_FOLDER, first['filename']))
+
+    response = client.get(f"/results/{again['result_id']}/debug.jpg")
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+
+def test_repeated_uploads_are_counted_once(web, sheets):
+    client = web.app.test_client()
+    web.results_index.flush()
+    before = {row['item']: row['scanned'] for row in client.get('/results/items').get_json()['items']}
+
+    for image_bytes in sheets[1:] * 2:
+        upload(client, image_bytes)
+    web.results_index.flush()
+
+    items = client.get('/results/items').get_json()['items']
+    assert items
+    for row in items:
+        assert row['scanned'] - before.get(row['item'], 0) == 2
+
+def test_capture_returns_result_under_both_keys(web, sheets):
+    client = web.app.test_client()
+    response = client.post('/capture', data=sheets[0], content_type='image/jpeg')
+    data = response.get_json()
+    assert response.status_code == 200, data
+    assert data['result'] == data['results']
+
+def test_template_names_with_path_separators_are_refused(web, sheets):
+    client = web.app.test_client()
+    response = client.post('/templates', data={'name': '../menu', 'file': (io.BytesIO(sheets[0]), 'ref.jpg')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_multi_page_tiff_upload_streams_one_record_per_page(web, sheets):
+    pages = [Image.fromarray(cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE))
+             for image_bytes in sheets]
+    document = io.BytesIO()
+    pages[0].save(document, format='TIFF', save_all=True, append_images=pages[1:])
+
+    response = web.app.test_client().post(
+        '/upload', data={'file': (io.BytesIO(document.getvalue()), 'sheets.tif')},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(record['sheet'] for record in records) == [f'sheets.tif#page={n}' for n in (1, 2, 3)]
+    assert all(record['success'] and record['circles'] for record in records)